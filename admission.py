@@ -0,0 +1,93 @@
+import time
+import threading
+from contextlib import contextmanager
+from config import (ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_MEMORY, ADMISSION_RETRY_AFTER,
+                    REQUEST_TIMEOUT)
+
+
+class Overloaded(Exception):
+    """超出排队深度或内存预算，请求被拒绝"""
+
+    def __init__(self, reason, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__(f"Overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """请求在开始处理前已超过截止时间（客户端已超时）"""
+
+
+def check_deadline(deadline):
+    """deadline 为 time.time() 时间戳，已过期时抛出 DeadlineExceeded"""
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded(f"Deadline passed {time.time() - deadline:.3f}s ago")
+
+
+def deadline_after(timeout=None, limit=REQUEST_TIMEOUT):
+    """由客户端给出的超时（秒，可以是请求头字符串）计算截止时间，不超过 limit"""
+    try:
+        timeout = float(timeout) if timeout is not None else limit
+    except ValueError:
+        timeout = limit
+    return time.time() + min(max(timeout, 0), limit)
+
+
+def run_before_deadline(deadline, fn, *args, **kwargs):
+    """在执行引擎中使用：真正开始执行前检查截止时间，过期的任务不消耗 CPU"""
+    check_deadline(deadline)
+    return fn(*args, **kwargs)
+
+
+class AdmissionController:
+    """请求准入控制：限制进行中的请求数和按图片头估算的解码内存，超出时立即拒绝"""
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, max_memory=ADMISSION_MAX_MEMORY):
+        self.max_inflight = max_inflight
+        self.max_memory = max_memory
+        self.inflight = 0
+        self.memory = 0
+        self.admitted = 0
+        self.shed_queue = 0
+        self.shed_memory = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, cost):
+        """占用一个请求名额和 cost 字节内存预算，超出限制时抛出 Overloaded"""
+        with self._lock:
+            if self.inflight >= self.max_inflight:
+                self.shed_queue += 1
+                raise Overloaded('queue full')
+            # 单个请求超过整个预算时，只要没有其他请求占用内存仍然允许执行
+            if self.memory and self.memory + cost > self.max_memory:
+                self.shed_memory += 1
+                raise Overloaded('memory budget exhausted')
+            self.inflight += 1
+            self.memory += cost
+            self.admitted += 1
+        try:
+            yield
+        except DeadlineExceeded:
+            with self._lock:
+                self.expired += 1
+            raise
+        finally:
+            with self._lock:
+                self.inflight -= 1
+                self.memory -= cost
+
+    def stats(self):
+        """进行中的请求数、占用的内存预算和拒绝计数"""
+        with self._lock:
+            return {
+                'inflight': self.inflight,
+                'max_inflight': self.max_inflight,
+                'memory': self.memory,
+                'max_memory': self.max_memory,
+                'admitted': self.admitted,
+                'shed_queue': self.shed_queue,
+                'shed_memory': self.shed_memory,
+                'expired': self.expired
+            }
@@ -1,44 +1,112 @@
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, request, jsonify, send_file, Response, url_for, g
 from flask_cors import CORS
-import io
-import base64
 from image_processor import ImageProcessor
-from config import PHOTO_SIZES
+from admission import AdmissionController, DeadlineExceeded, Overloaded, deadline_after
+from batch import BatchManager, RUNNING, iter_zip
+from ingest import InvalidImage, ingest_stream
+import metrics
+from log_setup import configure_logging
+from encoder import TargetTooSmall
+from sheet import parse_sheet
+from spec import ProcessingSpec, parse_output_options, parse_size
+from config import (PHOTO_SIZES, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, RESULT_MAX_AGE,
+                    REQUEST_WORKERS, BATCH_MAX_BYTES)
 import logging
-from functools import wraps
+from functools import partial, wraps
 import asyncio
+import re
 from concurrent.futures import ThreadPoolExecutor
 
+configure_logging()
 app = Flask(__name__)
 CORS(app)
 processor = ImageProcessor()
-executor = ThreadPoolExecutor(max_workers=4)
+processor.cache.start_sweeper()
+executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS)
+admission = AdmissionController()
+batches = BatchManager(processor)
 logger = logging.getLogger('FlaskApp')
 
+# 源图片 ID：上传文件的 BLAKE2b-128 哈希
+SOURCE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+TARGET_TOO_SMALL_MESSAGE = '无法在指定的字节数内编码图片，请增大 max_bytes'
+
 def async_route(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
         return asyncio.run(f(*args, **kwargs))
     return wrapped
 
+def ingest_upload():
+    """验证并接收上传的图片，保存到 g.upload；无效时返回错误响应"""
+    if 'image' not in request.files:
+        return jsonify({'error': '没有上传图片'}), 400
+
+    file = request.files['image']
+    if not file.filename:
+        return jsonify({'error': '没有选择文件'}), 400
+
+    if not processor.is_valid_file(file.filename, request.content_length):
+        return jsonify({
+            'error': f'无效的文件。允许的格式：{", ".join(ALLOWED_EXTENSIONS)}，最大大小：{MAX_FILE_SIZE/1024/1024}MB'
+        }), 400
+
+    try:
+        # 分块读取上传：边读边计算哈希、解析文件头，无效或像素数过大的图片在解码前拒绝
+        g.upload = ingest_stream(file.stream)
+    except InvalidImage as e:
+        logger.info(f"Rejected upload {file.filename}: {e}")
+        return jsonify({'error': '无效的图片文件'}), 400
+    return None
+
 def validate_request(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'image' not in request.files:
-            return jsonify({'error': '没有上传图片'}), 400
-        
-        file = request.files['image']
-        if not file.filename:
-            return jsonify({'error': '没有选择文件'}), 400
-            
-        if not processor.is_valid_file(file.filename, request.content_length):
-            return jsonify({
-                'error': f'无效的文件。允许的格式：{", ".join(ALLOWED_EXTENSIONS)}，最大大小：{MAX_FILE_SIZE/1024/1024}MB'
-            }), 400
-            
+        error = ingest_upload()
+        if error:
+            return error
         return f(*args, **kwargs)
     return decorated_function
 
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """排队已满或内存预算不足：立即拒绝，提示客户端稍后重试"""
+    response = jsonify({'error': '服务繁忙，请稍后重试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(DeadlineExceeded)
+def handle_deadline_exceeded(e):
+    """请求排队超过截止时间，客户端已不再等待，不再处理"""
+    return jsonify({'error': '请求超时'}), 504
+
+def request_deadline():
+    """本次请求的截止时间：X-Request-Timeout 头（秒），不超过 REQUEST_TIMEOUT"""
+    return deadline_after(request.headers.get('X-Request-Timeout'))
+
+async def process_admitted(upload, specs):
+    """按图片头估算内存并通过准入控制后，在线程池中处理图片，返回 {尺寸名称: 结果 ID}"""
+    cost = processor.estimate_memory(upload, [spec.output_size for spec in specs])
+    deadline = request_deadline()
+    with admission.admit(cost):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor,
+            partial(processor.process_upload, upload, specs, deadline=deadline)
+        )
+
+def result_payload(spec, result_id):
+    """结果的 JSON 描述：图片通过 /api/result/<结果 ID> 以二进制获取，附带字节数和编码质量"""
+    return {
+        'id': result_id,
+        'url': url_for('get_result', result_id=result_id),
+        'size': spec.size_name,
+        # 源图片 ID，调整亮度/对比度时通过 /api/adjust 引用，无需重新上传
+        'source': result_id.split('_', 1)[0],
+        **(processor.result_info(result_id, spec) or {})
+    }
+
 @app.route('/')
 def index():
     return send_file('static/index.html')
@@ -56,13 +124,17 @@ def get_sizes():
         logger.error(f"Error in get_sizes: {str(e)}")
         return jsonify({'error': '获取尺寸列表失败'}), 500
 
+async def respond_with_spec(upload, spec):
+    """在线程池中按处理参数处理图片并返回 JSON 响应"""
+    result_ids = await process_admitted(upload, [spec])
+    return jsonify(result_payload(spec, result_ids[spec.size_name]))
+
 @app.route('/api/process', methods=['POST'])
 @validate_request
 @async_route
 async def process():
     """处理图片的异步路由"""
     try:
-        image_file = request.files['image']
         size_name = request.form.get('size')
         brightness = float(request.form.get('brightness', 1.0))
         contrast = float(request.form.get('contrast', 1.0))
@@ -70,27 +142,16 @@ async def process():
         if size_name not in PHOTO_SIZES:
             return jsonify({'error': '无效的尺寸选择'}), 400
 
-        # 在线程池中处理图片
-        loop = asyncio.get_event_loop()
-        processed_image = await loop.run_in_executor(
-            executor,
-            processor.process_image,
-            image_file,
-            size_name,
-            brightness,
-            contrast
-        )
-
-        # 转换为base64
-        buffered = io.BytesIO()
-        processed_image.save(buffered, format="JPEG", quality=95)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-
-        return jsonify({
-            'image': f'data:image/jpeg;base64,{img_str}',
-            'size': size_name
-        })
+        spec = ProcessingSpec.create(size_name, brightness, contrast, **parse_output_options(request.form))
+        return await respond_with_spec(g.upload, spec)
 
+    except TargetTooSmall:
+        return jsonify({'error': TARGET_TOO_SMALL_MESSAGE}), 400
+    except ValueError:
+        return jsonify({'error': '无效的参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        # 交给 errorhandler 返回 503/504
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -103,27 +164,266 @@ async def process_custom_size():
     try:
         width = int(request.form.get('width', 0))
         height = int(request.form.get('height', 0))
+        brightness = float(request.form.get('brightness', 1.0))
+        contrast = float(request.form.get('contrast', 1.0))
         
         if width <= 0 or height <= 0:
             return jsonify({'error': '无效的尺寸'}), 400
-            
-        # 创建临时尺寸名称
-        temp_size_name = f"custom_{width}x{height}"
-        PHOTO_SIZES[temp_size_name] = (width, height)
-        
-        # 处理图片
-        response = await process()
-        
-        # 清理临时尺寸
-        del PHOTO_SIZES[temp_size_name]
-        
-        return response
+
+        # 尺寸只存在于本次请求的处理参数中，不修改全局 PHOTO_SIZES
+        spec = ProcessingSpec.create((width, height), brightness, contrast,
+                                     **parse_output_options(request.form))
+        return await respond_with_spec(g.upload, spec)
         
+    except TargetTooSmall:
+        return jsonify({'error': TARGET_TOO_SMALL_MESSAGE}), 400
     except ValueError:
         return jsonify({'error': '无效的尺寸参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error(f"Error processing custom size: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/preview', methods=['POST'])
+@validate_request
+@async_route
+async def preview():
+    """交互编辑用的低延迟预览：小尺寸、低成本解码和缩放、低质量编码"""
+    try:
+        size = parse_size(request.form.get('size', ''))
+        brightness = float(request.form.get('brightness', 1.0))
+        contrast = float(request.form.get('contrast', 1.0))
+
+        if size is None:
+            return jsonify({'error': '无效的尺寸选择'}), 400
+
+        spec = ProcessingSpec.create(size, brightness, contrast, preview=True,
+                                     background=request.form.get('background') or None)
+        return await respond_with_spec(g.upload, spec)
+
+    except ValueError:
+        return jsonify({'error': '无效的参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Error previewing image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process-all', methods=['POST'])
+@validate_request
+@async_route
+async def process_all():
+    """一次上传生成多个尺寸（默认全部预设尺寸），源图片只解码一次"""
+    try:
+        size_values = request.form.getlist('sizes') or list(PHOTO_SIZES)
+        brightness = float(request.form.get('brightness', 1.0))
+        contrast = float(request.form.get('contrast', 1.0))
+
+        sizes = [parse_size(value) for value in size_values]
+        if None in sizes:
+            return jsonify({'error': '无效的尺寸选择'}), 400
+        options = parse_output_options(request.form)
+        specs = list(dict.fromkeys(ProcessingSpec.create(size, brightness, contrast, **options)
+                                   for size in sizes))
+
+        result_ids = await process_admitted(g.upload, specs)
+        return jsonify({
+            'images': [
+                result_payload(spec, result_ids[spec.size_name])
+                for spec in specs
+            ]
+        })
+
+    except TargetTooSmall:
+        return jsonify({'error': TARGET_TOO_SMALL_MESSAGE}), 400
+    except ValueError:
+        return jsonify({'error': '无效的参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Error processing all sizes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/adjust', methods=['POST'])
+@async_route
+async def adjust():
+    """基于已上传的源图片调整亮度和对比度，只执行调整和编码"""
+    try:
+        source = request.form.get('source', '')
+        size = parse_size(request.form.get('size', ''))
+        brightness = float(request.form.get('brightness', 1.0))
+        contrast = float(request.form.get('contrast', 1.0))
+
+        if not SOURCE_ID_PATTERN.match(source):
+            return jsonify({'error': '无效的源图片'}), 400
+        if size is None:
+            return jsonify({'error': '无效的尺寸选择'}), 400
+
+        spec = ProcessingSpec.create(size, brightness, contrast, **parse_output_options(request.form))
+        # 只调整和编码已缓存的中间结果，不解码源图片，只占用请求名额
+        with admission.admit(0):
+            loop = asyncio.get_event_loop()
+            result_ids = await loop.run_in_executor(
+                executor,
+                partial(processor.readjust_results, source, [spec], deadline=request_deadline())
+            )
+
+        return jsonify(result_payload(spec, result_ids[spec.size_name]))
+
+    except KeyError:
+        return jsonify({'error': '源图片已过期，请重新上传'}), 404
+    except TargetTooSmall:
+        return jsonify({'error': TARGET_TOO_SMALL_MESSAGE}), 400
+    except ValueError:
+        return jsonify({'error': '无效的参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Error adjusting image: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def sheet_payload(sheet, result_id):
+    """排版结果的 JSON 描述：结果描述加上相纸、分辨率和每个尺寸实际排入的份数"""
+    return dict(result_payload(sheet, result_id), paper=sheet.paper, dpi=sheet.dpi,
+                items=[{'size': size_name, 'copies': copies} for size_name, copies in sheet.placed_copies()])
+
+@app.route('/api/sheet', methods=['POST'])
+@async_route
+async def make_sheet():
+    """冲印排版：上传图片（image）或引用已上传的源图片（source），把 sizes 的照片按 copies 份排到相纸上
+
+    引用源图片时使用已缓存的结果或几何中间结果，不重新处理源图片。
+    """
+    try:
+        source = request.form.get('source')
+        if 'image' in request.files or source is None:
+            error = ingest_upload()
+            if error:
+                return error
+            upload, source = g.upload, g.upload.file_hash
+        elif SOURCE_ID_PATTERN.match(source):
+            upload = None
+        else:
+            return jsonify({'error': '无效的源图片'}), 400
+
+        sheet = parse_sheet(request.form, request.form.getlist('sizes'), request.form.getlist('copies'))
+        # 放不下时在处理之前返回 400
+        sheet.layout()
+        with admission.admit(processor.estimate_sheet_memory(upload, sheet)):
+            loop = asyncio.get_event_loop()
+            result_id = await loop.run_in_executor(
+                executor,
+                partial(processor.process_sheet, upload and upload.open(), source, sheet,
+                        deadline=request_deadline())
+            )
+        return jsonify(sheet_payload(sheet, result_id))
+
+    except KeyError:
+        return jsonify({'error': '源图片已过期，请重新上传'}), 404
+    except ValueError:
+        return jsonify({'error': '无效的排版参数'}), 400
+    except (Overloaded, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error(f"Error making sheet: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def batch_payload(job):
+    """批处理任务的 JSON 描述：进度和失败原因，以及查询和下载 URL"""
+    return dict(job.status(),
+                status_url=url_for('get_batch', job_id=job.id),
+                download_url=url_for('download_batch', job_id=job.id))
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """提交批处理任务：多个 images 文件和/或 archive ZIP，处理参数同 /api/process-all"""
+    try:
+        # 在解析表单之前检查，过大的请求体不会被读取
+        if (request.content_length or 0) > BATCH_MAX_BYTES:
+            return jsonify({'error': f'上传过大，最大大小：{BATCH_MAX_BYTES/1024/1024}MB'}), 400
+        images = [file for file in request.files.getlist('images') if file.filename]
+        archives = [file for file in request.files.getlist('archive') if file.filename]
+        if not images and not archives:
+            return jsonify({'error': '没有上传图片'}), 400
+
+        size_values = request.form.getlist('sizes') or list(PHOTO_SIZES)
+        brightness = float(request.form.get('brightness', 1.0))
+        contrast = float(request.form.get('contrast', 1.0))
+        sizes = [parse_size(value) for value in size_values]
+        if None in sizes:
+            return jsonify({'error': '无效的尺寸选择'}), 400
+        options = parse_output_options(request.form)
+        specs = list(dict.fromkeys(ProcessingSpec.create(size, brightness, contrast, **options)
+                                   for size in sizes))
+
+        job = batches.submit(specs,
+                             files=[(file.filename, file.stream) for file in images],
+                             archives=[file.stream for file in archives])
+        return jsonify(batch_payload(job)), 202
+
+    except ValueError as e:
+        return jsonify({'error': f'无效的批处理上传：{str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"Error creating batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """查询批处理进度：total/done/failed/pending 和失败原因"""
+    job = batches.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(batch_payload(job))
+
+@app.route('/api/batch/<job_id>/download', methods=['GET'])
+def download_batch(job_id):
+    """以流式 ZIP 下载结果；任务仍在运行时随处理进度逐个写入"""
+    job = batches.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    # 其他服务进程运行中的任务无法等待其进度，完成后才能下载
+    if job.state == RUNNING and not batches.is_local(job):
+        return jsonify({'error': '任务仍在处理中，请稍后下载'}), 409
+    return Response(iter_zip(job), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename=batch_{job.id}.zip'
+    })
+
+@app.route('/api/result/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """返回处理结果的二进制图片；结果 ID 由内容决定，浏览器可永久缓存"""
+    # 先确认结果 ID 有效且结果存在，再由 send_file 比较 ETag（匹配时返回 304，不发送文件）
+    cache_path = processor.get_result_path(result_id)
+    if cache_path is None:
+        return jsonify({'error': '结果不存在或已过期'}), 404
+    response = send_file(cache_path, etag=result_id, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = RESULT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """结果缓存的命中、未命中、淘汰计数和容量"""
+    return jsonify(processor.cache.stats())
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """结果缓存、几何中间结果缓存、并发请求合并和准入控制的统计"""
+    return jsonify({
+        'cache': processor.cache.stats(),
+        'intermediates': processor.intermediates.stats(),
+        'singleflight': processor.flights.stats(),
+        'admission': admission.stats(),
+        # 等待线程池空闲线程的请求数
+        'queue_depth': executor._work_queue.qsize()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 抓取：各阶段耗时直方图、字节和解码像素计数、缓存命中率、队列深度和进行中的请求"""
+    body = metrics.render(metrics.service_gauges(processor, admission, executor))
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,173 @@
+"""证件照背景替换：估计原背景色，生成与边缘连通的柔和蒙版，一次合成新的背景色
+
+在缩放到目标尺寸的图片上进行（一寸、二寸只有十几到二十几万像素），全部为 NumPy 数组运算：
+1. 取上边和左右两边（不含下部，通常是肩膀）的像素，逐通道中位数作为背景色，
+   样本到背景色距离的高百分位数决定容差；
+2. 每个像素到背景色的 RGB 距离平方（逐通道查表求平方差），再查表得到蒙版值：容差以内为背景、
+   容差的 BACKGROUND_FEATHER 倍以外为前景，中间按距离线性过渡，得到柔和蒙版；
+3. 只保留与上边和左右两边连通的背景（衣服、眼镜上与背景相近的颜色不会被替换）：
+   在按 CONNECTIVITY_SCALE 缩小的网格上，先给每行、每列的连续候选格编号，再按行、按列交替
+   把种子扩展到整段，通常几轮即收敛；膨胀一格后放大回原尺寸，全分辨率上只做一次取值和与运算；
+4. 蒙版轻微模糊后，用 Image.composite 一次合成新的背景色。
+"""
+import math
+import numpy as np
+from PIL import Image, ImageFilter
+from config import (BACKGROUND_COLORS, BACKGROUND_BORDER, BACKGROUND_MIN_TOLERANCE,
+                    BACKGROUND_MAX_TOLERANCE, BACKGROUND_FEATHER, BACKGROUND_SAMPLE_PERCENTILE)
+
+# 连通传播的最多轮数（每轮按行、按列各传播一次）
+MAX_SWEEPS = 32
+# 连通性在按 2x2 缩小的网格上计算，放大前在网格上向外扩展一格（CONNECTIVITY_SCALE 个像素）
+CONNECTIVITY_SCALE = 2
+
+
+def border_samples(pixels, border=BACKGROUND_BORDER):
+    """上边和左右两边上部 2/3 的像素，返回 (N, 3) uint8 数组"""
+    height, width = pixels.shape[:2]
+    band_height = max(1, round(height * border))
+    band_width = max(1, round(width * border))
+    side_height = max(band_height, height * 2 // 3)
+    return np.concatenate([
+        pixels[:band_height].reshape(-1, 3),
+        pixels[band_height:side_height, :band_width].reshape(-1, 3),
+        pixels[band_height:side_height, -band_width:].reshape(-1, 3),
+    ])
+
+
+def squared_distance_tables(color):
+    """每个通道 0–255 到 color 的平方差，(3, 256) int32"""
+    return ((np.arange(256, dtype=np.int32)[None, :] - np.asarray(color, dtype=np.int32)[:, None]) ** 2)
+
+
+def squared_distances(pixels, tables):
+    """(..., 3) uint8 像素到背景色的距离平方（查表，不生成浮点中间数组）"""
+    result = np.take(tables[0], pixels[..., 0])
+    result += np.take(tables[1], pixels[..., 1])
+    result += np.take(tables[2], pixels[..., 2])
+    return result
+
+
+def estimate_background(pixels, border=BACKGROUND_BORDER):
+    """估计背景色和容差：返回 ((R, G, B), 容差)
+
+    中位数由每个通道的直方图求得，不对样本排序。
+    """
+    samples = border_samples(pixels, border)
+    half = (len(samples) + 1) // 2
+    color = tuple(int(np.searchsorted(np.cumsum(np.bincount(samples[:, band], minlength=256)), half))
+                  for band in range(3))
+    distances = np.sqrt(squared_distances(samples, squared_distance_tables(color)))
+    tolerance = float(np.percentile(distances, BACKGROUND_SAMPLE_PERCENTILE))
+    return color, min(max(tolerance, BACKGROUND_MIN_TOLERANCE), BACKGROUND_MAX_TOLERANCE)
+
+
+def run_labels(candidates):
+    """每行连续候选像素段的编号（从 1 开始，非候选像素为 0），返回 (编号数组, 段数)"""
+    starts = candidates.copy()
+    starts[:, 1:] &= ~candidates[:, :-1]
+    # 每行第一个候选像素总是段的起点，按行展开累加不会跨行合并
+    labels = np.cumsum(starts.ravel(), dtype=np.intp).reshape(candidates.shape)
+    labels *= candidates
+    return labels, int(labels.max())
+
+
+def spread(seeds, labels, count):
+    """把种子扩展到所在的整段"""
+    seeded = np.zeros(count + 1, dtype=bool)
+    seeded[labels[seeds]] = True
+    seeded[0] = False
+    return np.take(seeded, labels)
+
+
+def propagate_from_border(candidates):
+    """与上边、左右两边连通的候选像素（4 连通）
+
+    下边通常是肩膀和衣服，不作为种子；按行、按列交替传播直到不再变化。
+    """
+    row_labels, row_count = run_labels(candidates)
+    column_labels, column_count = run_labels(np.ascontiguousarray(candidates.T))
+    column_labels = np.ascontiguousarray(column_labels.T)
+
+    seeds = np.zeros_like(candidates)
+    seeds[0, :] = True
+    seeds[:, 0] = seeds[:, -1] = True
+    seeds &= candidates
+    filled = int(seeds.sum())
+    for _ in range(MAX_SWEEPS):
+        seeds = spread(spread(seeds, row_labels, row_count), column_labels, column_count)
+        previous, filled = filled, int(seeds.sum())
+        if filled == previous:
+            break
+    return seeds
+
+
+def dilate(mask):
+    """4 邻域膨胀一个像素"""
+    result = mask.copy()
+    result[1:] |= mask[:-1]
+    result[:-1] |= mask[1:]
+    result[:, 1:] |= mask[:, :-1]
+    result[:, :-1] |= mask[:, 1:]
+    return result
+
+
+def connected_to_border(candidates, scale=CONNECTIVITY_SCALE):
+    """与边缘连通的候选像素
+
+    在缩小的网格上传播：一格内全部是候选像素才算候选，不会越过细的前景边界；
+    在网格上向外扩展一格，补回前景边缘所在格中的背景像素，再放大回原尺寸
+    （不能整除时最后一行、一列沿用相邻的格）。
+    """
+    height, width = candidates.shape
+    rows, columns = height // scale, width // scale
+    if min(rows, columns) < 2:
+        return propagate_from_border(candidates)
+    blocks = np.ones((rows, columns), dtype=bool)
+    for dy in range(scale):
+        for dx in range(scale):
+            blocks &= candidates[dy:rows * scale:scale, dx:columns * scale:scale]
+    grid = dilate(propagate_from_border(blocks))
+    row_index = np.minimum(np.arange(height) // scale, rows - 1)
+    column_index = np.minimum(np.arange(width) // scale, columns - 1)
+    return grid.take(row_index, axis=0).take(column_index, axis=1) & candidates
+
+
+def alpha_table(tolerance):
+    """距离平方 → 蒙版值的查找表：容差以内 255，容差的 BACKGROUND_FEATHER 倍以外 0，中间按距离线性过渡
+
+    返回 (查找表, 表的最大下标)；更大的距离平方截断到最大下标（蒙版值为 0）。
+    """
+    outer = tolerance * BACKGROUND_FEATHER
+    limit = math.ceil(outer * outer)
+    distances = np.sqrt(np.arange(limit + 1, dtype=np.float32))
+    alpha = (outer - distances) * np.float32(255 / (outer - tolerance))
+    return np.clip(alpha, 0, 255).astype(np.uint8), limit
+
+
+def rgb(image):
+    """转换为 RGB；已经是 RGB 时原样返回，不复制"""
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def background_mask(image, border=BACKGROUND_BORDER):
+    """背景蒙版（L 模式，255 为背景），柔和过渡且只包含与边缘连通的背景"""
+    pixels = np.asarray(rgb(image))
+    color, tolerance = estimate_background(pixels, border)
+    table, limit = alpha_table(tolerance)
+    # 每个通道的平方差先截断到 limit，三个通道之和（容差上限时不超过 3 * 120²）可以用 uint16 累加
+    tables = np.minimum(squared_distance_tables(color), limit).astype(np.uint16)
+    distances = squared_distances(pixels, tables)
+    np.minimum(distances, limit, out=distances)
+    alpha = np.take(table, distances)
+    alpha *= connected_to_border(alpha > 0)
+    return Image.fromarray(alpha, 'L').filter(ImageFilter.BoxBlur(1))
+
+
+def replace_background(image, background):
+    """把背景替换为 BACKGROUND_COLORS 中的颜色；background 为 None 时原样返回"""
+    if background is None:
+        return image
+    image = rgb(image)
+    color = Image.new('RGB', image.size, BACKGROUND_COLORS[background])
+    return Image.composite(color, image, background_mask(image))
@@ -0,0 +1,380 @@
+import io
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import zipfile
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import (BATCH_DIR, BATCH_WORKERS, BATCH_JOB_CONCURRENCY, BATCH_MAX_FILES,
+                    BATCH_JOB_TTL, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE)
+from image_processor import ImageProcessor
+from ingest import ingest_stream
+
+logger = logging.getLogger('BatchJobs')
+
+# 批处理任务 ID：uuid4 的十六进制形式
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+# 任务状态；服务停止时尚未开始的图片记为失败，任务记为 CANCELLED
+RUNNING, COMPLETED, CANCELLED = 'running', 'completed', 'cancelled'
+
+
+class BatchItem:
+    """批处理中的一张图片：源文件、处理状态和输出文件"""
+
+    def __init__(self, index, name, stem, source=None, status=PENDING, error=None, outputs=()):
+        self.index = index
+        self.name = name
+        self.stem = stem
+        self.source = source
+        self.status = status
+        self.error = error
+        # [(ZIP 内文件名, 文件路径)]
+        self.outputs = list(outputs)
+
+    def to_dict(self):
+        return {'name': self.name, 'status': self.status, 'error': self.error,
+                'outputs': [name for name, _ in self.outputs]}
+
+
+class BatchJob:
+    """一个批处理任务：源文件和结果保存在 job_dir，状态写入 job.json 供其他服务进程读取"""
+
+    def __init__(self, job_id, job_dir, specs, concurrency=BATCH_JOB_CONCURRENCY):
+        self.id = job_id
+        self.dir = job_dir
+        self.specs = list(specs)
+        self.concurrency = concurrency
+        self.items = []
+        self.created = time.time()
+        self.state = RUNNING
+        self._pending = deque()
+        self._stems = set()
+        self._condition = threading.Condition()
+
+    @property
+    def source_dir(self):
+        return os.path.join(self.dir, 'sources')
+
+    @property
+    def result_dir(self):
+        return os.path.join(self.dir, 'results')
+
+    def _add_item(self, filename, **fields):
+        if len(self.items) >= BATCH_MAX_FILES:
+            raise ValueError(f"Too many files, at most {BATCH_MAX_FILES}")
+        name = os.path.basename(filename.replace('\\', '/')) or f"image_{len(self.items)}"
+        stem = os.path.splitext(name)[0]
+        # 同名文件（ZIP 中不同目录）的结果文件名加序号区分
+        if stem in self._stems:
+            stem = f"{stem}_{len(self.items)}"
+        self._stems.add(stem)
+        item = BatchItem(len(self.items), name, stem, **fields)
+        self.items.append(item)
+        return item
+
+    def add_file(self, filename, stream):
+        """加入一个上传文件；不受支持或过大的文件记为失败，不影响其他图片"""
+        # 只做扩展名和大小检查，文件头在处理时由 ingest 校验
+        if not ImageProcessor.is_valid_file(filename, 0):
+            return self._add_item(filename, status=FAILED, error='Unsupported file type')
+
+        item = self._add_item(filename)
+        item.source = os.path.join(self.source_dir, str(item.index))
+        size = 0
+        with open(item.source, 'wb') as f:
+            while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    break
+                f.write(chunk)
+        if size > MAX_FILE_SIZE:
+            os.remove(item.source)
+            item.source, item.status, item.error = None, FAILED, 'File too large'
+        else:
+            self._pending.append(item)
+        return item
+
+    def add_archive(self, fileobj):
+        """加入 ZIP 中的全部图片；不是有效的 ZIP 时抛出 ValueError"""
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"Invalid archive: {e}") from e
+        with archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                # 跳过目录、隐藏文件和 macOS 生成的资源文件
+                if info.is_dir() or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                    continue
+                if info.file_size > MAX_FILE_SIZE:
+                    self._add_item(info.filename, status=FAILED, error='File too large')
+                    continue
+                with archive.open(info) as entry:
+                    self.add_file(info.filename, entry)
+
+    def seal(self):
+        """图片加入完毕，返回待处理数；没有待处理的图片时任务直接完成"""
+        with self._condition:
+            if not self._pending:
+                self.state = COMPLETED
+            return len(self._pending)
+
+    def next_pending(self):
+        """取出下一张待处理的图片，没有时返回 None"""
+        with self._condition:
+            return self._pending.popleft() if self._pending else None
+
+    def finish(self, item, status, error=None, outputs=()):
+        """记录一张图片的处理结果，全部完成时任务结束"""
+        with self._condition:
+            item.status, item.error, item.outputs = status, error, list(outputs)
+            if self.state == RUNNING and all(other.status != PENDING for other in self.items):
+                self.state = COMPLETED
+            self._condition.notify_all()
+        self.save()
+
+    def cancel(self, error):
+        """放弃尚未开始的图片（记为失败并删除源文件），任务记为 CANCELLED；返回放弃的图片数
+
+        正在处理的图片仍按原样完成。
+        """
+        with self._condition:
+            cancelled = list(self._pending)
+            self._pending.clear()
+            for item in cancelled:
+                item.status, item.error = FAILED, error
+            self.state = CANCELLED
+            self._condition.notify_all()
+        for item in cancelled:
+            try:
+                os.remove(item.source)
+            except FileNotFoundError:
+                pass
+        self.save()
+        return len(cancelled)
+
+    def wait(self, item, timeout=None):
+        """等待图片处理完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: item.status != PENDING, timeout)
+
+    def status(self):
+        """任务进度：总数、完成数、失败数和失败原因"""
+        with self._condition:
+            counts = {PENDING: 0, DONE: 0, FAILED: 0}
+            for item in self.items:
+                counts[item.status] += 1
+            return {
+                'id': self.id,
+                'state': self.state,
+                'total': len(self.items),
+                'done': counts[DONE],
+                'failed': counts[FAILED],
+                'pending': counts[PENDING],
+                'errors': [{'name': item.name, 'error': item.error}
+                           for item in self.items if item.status == FAILED]
+            }
+
+    def save(self):
+        """原子写入 job.json；持有锁写入，避免较旧的状态覆盖较新的状态"""
+        path = os.path.join(self.dir, 'job.json')
+        with self._condition:
+            data = {
+                'id': self.id,
+                'state': self.state,
+                'created': self.created,
+                'items': [dict(item.to_dict(), stem=item.stem) for item in self.items]
+            }
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, job_dir):
+        """从 job.json 读取任务（其他服务进程创建的任务），只用于查询状态和下载"""
+        with open(os.path.join(job_dir, 'job.json'), encoding='utf-8') as f:
+            data = json.load(f)
+        job = cls(data['id'], job_dir, [])
+        job.created = data['created']
+        job.state = data['state']
+        for index, item in enumerate(data['items']):
+            outputs = [(name, os.path.join(job.result_dir, name)) for name in item['outputs']]
+            job.items.append(BatchItem(index, item['name'], item['stem'], status=item['status'],
+                                       error=item['error'], outputs=outputs))
+        return job
+
+
+class _ZipStream(io.RawIOBase):
+    """只能追加写入的流：zipfile 写入的数据在每个文件块之后取出发送"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        """取出已写入的数据"""
+        chunks, self._chunks = self._chunks, []
+        yield from chunks
+
+
+def iter_zip(job):
+    """边生成边输出结果 ZIP；任务仍在运行时按顺序等待每张图片完成
+
+    JPEG 已经是压缩格式，ZIP 只存储不压缩。末尾附带 report.json 记录每张图片的状态。
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for item in job.items:
+            job.wait(item)
+            for archive_name, path in item.outputs:
+                with archive.open(archive_name, 'w') as entry, open(path, 'rb') as f:
+                    while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                        entry.write(chunk)
+                        yield from stream.drain()
+                yield from stream.drain()
+        report = {'status': job.status(), 'items': [item.to_dict() for item in job.items]}
+        archive.writestr('report.json', json.dumps(report, ensure_ascii=False, indent=2))
+    yield from stream.drain()
+
+
+class BatchManager:
+    """批处理任务管理：在独立的线程池中驱动任务，图片处理共用处理器的执行引擎
+
+    线程池大小 workers 限制了所有批处理同时占用的引擎任务数，每个任务最多 job_concurrency
+    张图片同时处理，批处理不会占满引擎而拖慢交互请求。
+    """
+
+    def __init__(self, processor, batch_dir=BATCH_DIR, workers=BATCH_WORKERS,
+                 job_concurrency=BATCH_JOB_CONCURRENCY, ttl=BATCH_JOB_TTL):
+        self.processor = processor
+        self.batch_dir = batch_dir
+        self.job_concurrency = job_concurrency
+        self.ttl = ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+
+    def create(self, specs):
+        """创建任务目录，之后通过 job.add_file/add_archive 加入图片，再调用 start"""
+        self.sweep()
+        job_id = uuid.uuid4().hex
+        job = BatchJob(job_id, os.path.join(self.batch_dir, job_id), specs, self.job_concurrency)
+        os.makedirs(job.source_dir)
+        os.makedirs(job.result_dir)
+        return job
+
+    def start(self, job):
+        """开始处理；任务的并发数不超过 job.concurrency"""
+        pending = job.seal()
+        job.save()
+        with self._lock:
+            self.jobs[job.id] = job
+        for _ in range(min(job.concurrency, pending)):
+            self._executor.submit(self._run, job)
+        logger.info("Batch %s started: %d images, %d sizes", job.id, len(job.items), len(job.specs))
+
+    def discard(self, job):
+        """放弃尚未开始的任务"""
+        shutil.rmtree(job.dir, ignore_errors=True)
+
+    def submit(self, specs, files=(), archives=()):
+        """创建并开始任务：files 为 [(文件名, 文件对象)]，archives 为 ZIP 文件对象
+
+        上传无效（ZIP 损坏、图片数超过上限）时抛出 ValueError，任务不会创建。
+        """
+        job = self.create(specs)
+        try:
+            for filename, stream in files:
+                job.add_file(filename, stream)
+            for archive in archives:
+                job.add_archive(archive)
+        except BaseException:
+            self.discard(job)
+            raise
+        self.start(job)
+        return job
+
+    def get(self, job_id):
+        """返回任务；本进程没有时从 job.json 读取，不存在时返回 None"""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return BatchJob.load(os.path.join(self.batch_dir, job_id))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def is_local(self, job):
+        with self._lock:
+            return self.jobs.get(job.id) is job
+
+    def _run(self, job):
+        while not self._stopping.is_set() and (item := job.next_pending()) is not None:
+            self._process(job, item)
+
+    def _process(self, job, item):
+        """处理一张图片；失败时记录原因，不影响同一任务中的其他图片"""
+        try:
+            with open(item.source, 'rb') as f:
+                upload = ingest_stream(f)
+            result_ids = self.processor.process_upload(upload, job.specs)
+            outputs = []
+            for spec in job.specs:
+                archive_name = f"{item.stem}_{spec.size_name}.{spec.extension}"
+                path = os.path.join(job.result_dir, archive_name)
+                # 硬链接到任务目录，缓存淘汰后任务结果仍然可以下载
+                self.processor.cache.export(result_ids[spec.size_name], path, link=True)
+                outputs.append((archive_name, path))
+        except Exception as e:
+            logger.warning("Batch %s item %s failed: %s", job.id, item.name, e)
+            job.finish(item, FAILED, str(e))
+        else:
+            job.finish(item, DONE, outputs=outputs)
+        finally:
+            os.remove(item.source)
+
+    def sweep(self):
+        """删除创建超过 ttl 秒且不在运行中（已完成或已取消）的任务"""
+        now = time.time()
+        try:
+            names = os.listdir(self.batch_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            job_dir = os.path.join(self.batch_dir, name)
+            try:
+                job = BatchJob.load(job_dir)
+            except (OSError, ValueError, KeyError):
+                continue
+            if job.state != RUNNING and now - job.created > self.ttl:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                with self._lock:
+                    self.jobs.pop(job.id, None)
+
+    def shutdown(self, wait=True):
+        """停止领取新的图片，等待正在处理的图片完成；尚未开始的图片记为失败，任务记为已取消"""
+        self._stopping.set()
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if job.state == RUNNING]
+        for job in jobs:
+            cancelled = job.cancel('Cancelled: server shutting down')
+            logger.info("Batch %s cancelled on shutdown: %d images not started", job.id, cancelled)
@@ -0,0 +1,59 @@
+"""背景替换延迟基准测试
+
+在一寸照片尺寸（413x579）的模拟证件照上重复执行背景替换，输出估计背景色、生成蒙版和
+完整替换（蒙版 + 合成）的 p50/p95 延迟。
+
+参考：在单 CPU、负载波动较大的测试环境中，完整替换的 p50 为 9–13 ms，其中 Pillow 的
+模糊和合成各约 1.5–2 ms。这里没有达到“几毫秒”的目标，也没有在其他 CPU 上测量过。
+
+运行：python -m benchmarks.background_latency [次数]
+"""
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from background import background_mask, estimate_background, replace_background
+
+
+def create_portrait(size=(413, 579), background=(236, 238, 242)):
+    """带噪声背景、脸部和深色衣服的模拟证件照"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    pixels = np.array(background, dtype=np.int16) + rng.integers(-6, 7, (height, width, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.29, height * 0.14, width * 0.7, height * 0.52), fill=(225, 180, 150))
+    draw.rectangle((width * 0.15, height * 0.66, width * 0.85, height), fill=(40, 40, 60))
+    return image
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(func, iterations):
+    """预热一次后执行 iterations 次，返回耗时列表（秒）"""
+    func()
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main(iterations=200):
+    image = create_portrait()
+    pixels = np.asarray(image)
+    print(f"{'stage':<10}{'p50':>10}{'p95':>10}")
+    for name, func in (('estimate', lambda: estimate_background(pixels)),
+                       ('mask', lambda: background_mask(image)),
+                       ('replace', lambda: replace_background(image, 'blue'))):
+        durations = measure(func, iterations)
+        print(f"{name:<10}{percentile(durations, 0.5) * 1000:>8.2f}ms"
+              f"{percentile(durations, 0.95) * 1000:>8.2f}ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""缓存命中路径基准测试
+
+比较以下几种方式返回同一张已处理图片的耗时：
+- 静态文件：Flask 发送 static 目录下的文件（参照基准）
+- 结果 URL：GET /api/result/<结果 ID>，直接发送缓存文件
+- 结果 URL 304：带 If-None-Match 的 GET
+- 解码重编码：旧的命中路径，Image.open 后以 quality=95 重新编码
+
+运行：python -m benchmarks.cache_hit [次数]
+"""
+import io
+import sys
+import time
+from PIL import Image
+from app import app, processor
+
+
+def measure(name, func, iterations):
+    """执行 iterations 次并打印平均耗时"""
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"{name:<16}{elapsed * 1000:>10.3f} ms")
+    return elapsed
+
+
+def main(iterations=500):
+    client = app.test_client()
+
+    image = Image.new('RGB', (3000, 4000), 'white')
+    upload = io.BytesIO()
+    image.save(upload, format='JPEG')
+    response = client.post('/api/process', data={
+        'image': (io.BytesIO(upload.getvalue()), 'bench.jpg'),
+        'size': '二寸'
+    }, content_type='multipart/form-data')
+    url = response.get_json()['url']
+    etag = client.get(url).headers['ETag']
+    cache_path = processor.get_result_path(response.get_json()['id'])
+
+    def reencode():
+        with Image.open(cache_path) as cached:
+            cached.save(io.BytesIO(), format='JPEG', quality=95)
+
+    print(f"{'path':<16}{'mean':>13}")
+    static = measure('static file', lambda: client.get('/static/css/style.css').close(), iterations)
+    result = measure('result url', lambda: client.get(url).close(), iterations)
+    measure('result 304', lambda: client.get(url, headers={'If-None-Match': etag}).close(), iterations)
+    measure('decode+encode', reencode, iterations)
+    print(f"result url / static file: {result / static:.2f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
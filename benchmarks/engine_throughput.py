@@ -0,0 +1,52 @@
+"""执行引擎吞吐量基准测试
+
+用不同模式（thread/process）和工作数处理同一批互不相同的 12MP JPEG，
+请求线程数为工作数的两倍，输出每秒处理张数及相对单工作数的加速比。
+
+运行：python -m benchmarks.engine_throughput [图片数] [最大工作数]
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from engine import create_engine
+from image_processor import ImageProcessor, init_worker
+from result_cache import ResultCache
+from benchmarks.preview_latency import create_source
+
+
+def run(mode, workers, sources):
+    """返回处理全部图片的吞吐量（张/秒）"""
+    cache_dir = tempfile.mkdtemp()
+    engine = create_engine(mode, workers, init_worker)
+    try:
+        processor = ImageProcessor(ResultCache(cache_dir=cache_dir), engine)
+        # 预热进程池
+        processor.process_results(io.BytesIO(sources[0]), ['二寸'])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2 * workers) as requests:
+            list(requests.map(lambda source: processor.process_results(io.BytesIO(source), ['二寸']),
+                              sources[1:]))
+        return (len(sources) - 1) / (time.perf_counter() - start)
+    finally:
+        engine.shutdown()
+        shutil.rmtree(cache_dir)
+
+
+def main(count=24, max_workers=os.cpu_count()):
+    sources = [create_source(seed) for seed in range(count + 1)]
+    worker_counts = sorted({1, 2, 4, max_workers} & set(range(1, max_workers + 1)))
+    print(f"{'mode':<10}{'workers':>8}{'img/s':>10}{'speedup':>10}")
+    for mode in ('thread', 'process'):
+        baseline = None
+        for workers in worker_counts:
+            throughput = run(mode, workers, sources)
+            baseline = baseline or throughput
+            print(f"{mode:<10}{workers:>8}{throughput:>10.1f}{throughput / baseline:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
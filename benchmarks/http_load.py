@@ -0,0 +1,119 @@
+"""HTTP 请求开销负载测试
+
+分别启动 Flask 服务（app.py，每个请求 asyncio.run 一次）和 aiohttp 服务（server.py，
+单个长期运行的事件循环），用并发客户端请求：
+- sizes：GET /api/sizes，只有框架和路由开销
+- process：POST /api/process 上传一张已缓存的小图，包括上传读取、哈希和缓存命中路径
+
+输出每种服务的吞吐量和 p50/p95 延迟。
+
+运行：python -m benchmarks.http_load [请求数] [并发数]
+"""
+import asyncio
+import io
+import socket
+import subprocess
+import sys
+import time
+import aiohttp
+from PIL import Image
+
+SERVERS = {
+    'flask': "from app import app; app.run(port={port}, threaded=True)",
+    'aiohttp': "from aiohttp import web; from server import create_app; "
+               "web.run_app(create_app(), port={port}, print=None, access_log=None)",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, port):
+    """在子进程中启动服务，避免和客户端争抢 GIL"""
+    return subprocess.Popen([sys.executable, '-c', SERVERS[name].format(port=port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(session, base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(base_url + '/api/sizes') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientConnectionError:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.2)
+
+
+def create_upload():
+    upload = io.BytesIO()
+    Image.new('RGB', (800, 600), 'white').save(upload, format='JPEG')
+    return upload.getvalue()
+
+
+async def run_scenario(session, request, count, concurrency):
+    """以 concurrency 个并发客户端共发送 count 个请求，返回 (吞吐量, 延迟列表)"""
+    latencies = []
+    remaining = iter(range(count))
+
+    async def client():
+        for _ in remaining:
+            start = time.perf_counter()
+            async with request() as response:
+                await response.read()
+                assert response.status == 200, response.status
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return count / (time.perf_counter() - start), sorted(latencies)
+
+
+async def benchmark(name, count, concurrency, upload):
+    """启动服务并依次运行各场景，返回 {场景: (吞吐量, 延迟列表)}"""
+    results = {}
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(name, port)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_ready(session, base_url)
+
+            def process():
+                form = aiohttp.FormData()
+                form.add_field('image', upload, filename='bench.jpg', content_type='image/jpeg')
+                form.add_field('size', '一寸')
+                return session.post(base_url + '/api/process', data=form)
+
+            scenarios = {
+                'sizes': lambda: session.get(base_url + '/api/sizes'),
+                'process': process,
+            }
+            for scenario, request in scenarios.items():
+                # 预热：生成缓存结果
+                await run_scenario(session, request, concurrency, concurrency)
+                results[scenario] = await run_scenario(session, request, count, concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main(count=2000, concurrency=16):
+    upload = create_upload()
+    print(f"{'server':<10}{'scenario':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name in SERVERS:
+        results = asyncio.run(benchmark(name, count, concurrency, upload))
+        for scenario, (throughput, latencies) in results.items():
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[int(len(latencies) * 0.95)]
+            print(f"{name:<10}{scenario:<10}{throughput:>10.1f}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
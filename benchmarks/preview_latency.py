@@ -0,0 +1,60 @@
+"""预览模式延迟基准测试
+
+对 12MP（4000x3000）带纹理的 JPEG 分别执行预览和完整质量处理，
+每次使用不同的源图片以避开缓存，输出 p50/p95 延迟。
+
+运行：python -m benchmarks.preview_latency [次数]
+"""
+import io
+import sys
+import time
+import shutil
+import tempfile
+from PIL import Image
+from image_processor import ImageProcessor
+from result_cache import ResultCache
+from spec import ProcessingSpec
+
+
+def create_source(seed, size=(4000, 3000)):
+    """生成带渐变和噪声的测试 JPEG（约 2MB，接近手机照片），seed 用于保证每张图片内容不同"""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 8 + seed % 4)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.ROTATE_180)))
+    buffered = io.BytesIO()
+    image.save(buffered, format='JPEG', quality=85)
+    return buffered.getvalue()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(processor, sources, spec):
+    """逐张处理并返回耗时列表（秒）"""
+    durations = []
+    for source in sources:
+        start = time.perf_counter()
+        processor.process_results(io.BytesIO(source), [spec])
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main(iterations=20):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        processor = ImageProcessor(ResultCache(cache_dir=cache_dir))
+        sources = [create_source(seed) for seed in range(iterations)]
+        print(f"{'mode':<10}{'p50':>10}{'p95':>10}")
+        for name, spec in (('preview', ProcessingSpec.create('二寸', preview=True)),
+                           ('full', ProcessingSpec.create('二寸'))):
+            durations = measure(processor, sources, spec)
+            print(f"{name:<10}{percentile(durations, 0.5) * 1000:>8.1f}ms"
+                  f"{percentile(durations, 0.95) * 1000:>8.1f}ms")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,312 @@
+"""处理性能基准套件与回归检查
+
+生成确定性的测试图片集（0.3–48MP；JPEG/PNG/GIF；全部 8 种 EXIF 方向；RGB/RGBA/调色板/CMYK），
+用 ImageProcessor.process_image 逐张处理：
+- 冷缓存：每张图片使用空的结果缓存和中间结果缓存，记录端到端和各阶段（metrics.stage）耗时
+- 热缓存：再次处理同一张图片，命中结果缓存
+- HTTP：对 Flask 服务（app.py）运行 benchmarks.http_load 的负载场景
+
+输出每组的吞吐量、p50/p95/p99 延迟和进程峰值 RSS，写入 JSON；指定基准文件时与之比较，
+延迟增加或吞吐量下降超过阈值的指标视为回归，退出码为 1。
+
+运行：
+    python -m benchmarks.suite -o bench.json                       # 运行并与 benchmarks/baseline.json 比较
+    python -m benchmarks.suite --save-baseline                     # 更新基准文件
+    python -m benchmarks.suite --max-megapixels 12 --no-http --threshold 0.3
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import metrics
+from engine import InlineEngine
+from geometry import ORIENTATION_TAG
+from image_processor import ImageProcessor
+from result_cache import ResultCache
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# 尺寸等级 → 像素尺寸（横向）
+SIZE_CLASSES = {
+    '0.3MP': (640, 480),
+    '2MP': (1632, 1224),
+    '12MP': (4000, 3000),
+    '48MP': (8000, 6000),
+}
+
+Case = namedtuple('Case', 'name size_class format mode orientation')
+
+
+def build_cases():
+    """测试图片清单：每个维度（尺寸、格式、方向、模式）都覆盖，不做全组合"""
+    cases = [Case(f'{size_class}-jpeg-rgb', size_class, 'JPEG', 'RGB', 1) for size_class in SIZE_CLASSES]
+    cases += [Case(f'2MP-jpeg-rgb-o{orientation}', '2MP', 'JPEG', 'RGB', orientation)
+              for orientation in range(2, 9)]
+    cases += [
+        Case('0.3MP-png-rgba', '0.3MP', 'PNG', 'RGBA', 1),
+        Case('2MP-png-rgba-o6', '2MP', 'PNG', 'RGBA', 6),
+        Case('12MP-png-rgb', '12MP', 'PNG', 'RGB', 1),
+        Case('2MP-png-palette', '2MP', 'PNG', 'P', 1),
+        Case('0.3MP-gif-palette', '0.3MP', 'GIF', 'P', 1),
+        Case('2MP-gif-palette', '2MP', 'GIF', 'P', 1),
+        Case('2MP-jpeg-cmyk', '2MP', 'JPEG', 'CMYK', 1),
+        Case('12MP-jpeg-cmyk-o8', '12MP', 'JPEG', 'CMYK', 8),
+        Case('48MP-png-rgb', '48MP', 'PNG', 'RGB', 1),
+    ]
+    return cases
+
+
+def megapixels(case):
+    width, height = SIZE_CLASSES[case.size_class]
+    return width * height / 1e6
+
+
+def render_case(case):
+    """按清单生成一张图片的字节；内容只由名称决定，每次运行完全相同"""
+    rng = random.Random(case.name)
+    size = SIZE_CLASSES[case.size_class]
+    if case.orientation in (5, 6, 7, 8):
+        # 这些方向的像素是转置存储的，显示时为竖向
+        size = size[::-1]
+    # 低分辨率噪声放大成纹理，接近照片的压缩率，避免纯噪声图片过大
+    texture_size = (max(1, size[0] // 8), max(1, size[1] // 8))
+    bands = [Image.frombytes('L', texture_size, rng.randbytes(texture_size[0] * texture_size[1]))
+             .resize(size, Image.Resampling.BICUBIC) for _ in range(3)]
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.merge('RGB', [Image.blend(band, gradient, 0.5) for band in bands])
+    if case.mode == 'RGBA':
+        image.putalpha(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    elif case.mode == 'P':
+        image = image.quantize(256)
+    elif case.mode != 'RGB':
+        image = image.convert(case.mode)
+
+    options = {}
+    if case.orientation != 1:
+        exif = Image.Exif()
+        exif[ORIENTATION_TAG] = case.orientation
+        options['exif'] = exif
+    if case.format == 'JPEG':
+        options['quality'] = 85
+    buffered = io.BytesIO()
+    image.save(buffered, format=case.format, **options)
+    return buffered.getvalue()
+
+
+def write_corpus(directory, cases):
+    """把缺少的测试图片写入 directory，返回 {名称: 路径}"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for case in cases:
+        path = os.path.join(directory, f'{case.name}.{case.format.lower()}')
+        if not os.path.exists(path):
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(render_case(case))
+            os.replace(temp_path, path)
+        paths[case.name] = path
+    return paths
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(durations, megapixels_total=None):
+    """耗时列表（秒）→ 吞吐量和延迟分位数（毫秒）"""
+    total = sum(durations)
+    summary = {
+        'count': len(durations),
+        'throughput': len(durations) / total if total else 0.0,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p95_ms': percentile(durations, 0.95) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+    }
+    if megapixels_total is not None:
+        summary['megapixels_per_second'] = megapixels_total / total if total else 0.0
+    return summary
+
+
+def peak_rss_mb():
+    """本进程的峰值常驻内存（Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_processing(cases, paths, repeat, size='二寸'):
+    """逐张冷缓存、热缓存处理，返回 {分组: 汇总}"""
+    cold, warm = [], []
+    by_size = defaultdict(list)
+    stages = defaultdict(list)
+    cold_megapixels = 0.0
+    for _ in range(repeat):
+        for case in cases:
+            with open(paths[case.name], 'rb') as f:
+                data = f.read()
+            cache_dir = tempfile.mkdtemp()
+            try:
+                # 同步执行，各阶段的耗时都在当前线程中记录
+                processor = ImageProcessor(ResultCache(cache_dir=cache_dir), InlineEngine())
+                with metrics.record_timings() as timings:
+                    start = time.perf_counter()
+                    processor.process_image(io.BytesIO(data), size)
+                    elapsed = time.perf_counter() - start
+                cold.append(elapsed)
+                by_size[case.size_class].append(elapsed)
+                cold_megapixels += megapixels(case)
+                for stage, seconds in timings.stages.items():
+                    stages[stage].append(seconds)
+
+                start = time.perf_counter()
+                processor.process_image(io.BytesIO(data), size)
+                warm.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(cache_dir)
+
+    results = {
+        'e2e.cold': summarize(cold, cold_megapixels),
+        'e2e.warm': summarize(warm),
+    }
+    for size_class in SIZE_CLASSES:
+        if by_size[size_class]:
+            results[f'e2e.cold.{size_class}'] = summarize(by_size[size_class])
+    for stage, durations in sorted(stages.items()):
+        results[f'stage.{stage}'] = summarize(durations)
+    return results
+
+
+def run_http(count, concurrency):
+    """对 Flask 服务运行 HTTP 负载场景"""
+    from benchmarks import http_load
+    upload = http_load.create_upload()
+    scenarios = asyncio.run(http_load.benchmark('flask', count, concurrency, upload))
+    results = {}
+    for scenario, (throughput, latencies) in scenarios.items():
+        summary = summarize(latencies)
+        # 并发请求时吞吐量以墙钟时间计，不是延迟之和
+        summary['throughput'] = throughput
+        results[f'http.flask.{scenario}'] = summary
+    return results
+
+
+# 比较的指标 → 变大是否为回归
+COMPARED_METRICS = {
+    'throughput': False,
+    'megapixels_per_second': False,
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+}
+
+# 基准 p95 低于该值（毫秒）的分组不比较：计时抖动会超过阈值
+MIN_COMPARED_MS = 5.0
+
+
+def compare(results, baseline, threshold):
+    """返回 [(分组, 指标, 基准值, 当前值, 变化比例)]，只包含超过阈值的回归"""
+    regressions = []
+    for group, summary in results.items():
+        base = baseline.get(group)
+        if base is None or base['p95_ms'] < MIN_COMPARED_MS:
+            continue
+        for name, higher_is_worse in COMPARED_METRICS.items():
+            if not base.get(name) or name not in summary:
+                continue
+            change = summary[name] / base[name] - 1
+            if (change > threshold) if higher_is_worse else (change < -threshold):
+                regressions.append((group, name, base[name], summary[name], change))
+    return regressions
+
+
+def print_results(results, stream=sys.stdout):
+    stream.write(f"{'group':<24}{'n':>6}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}\n")
+    for group, summary in results.items():
+        stream.write(f"{group:<24}{summary['count']:>6}{summary['throughput']:>10.1f}{summary['p50_ms']:>10.2f}"
+                     f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='处理性能基准套件')
+    parser.add_argument('-o', '--output', default='bench.json', help='结果 JSON 路径')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='比较的基准 JSON')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写为基准文件')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='回归阈值：延迟增加或吞吐量下降超过该比例时失败（默认 0.2）')
+    parser.add_argument('--repeat', type=int, default=3, help='每张图片的冷/热缓存处理次数')
+    parser.add_argument('--max-megapixels', type=float, help='跳过更大的图片（快速运行）')
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'photo-bench-corpus'),
+                        help='测试图片目录，已生成的图片直接复用')
+    parser.add_argument('--no-http', action='store_true', help='不运行 HTTP 负载场景')
+    parser.add_argument('--http-requests', type=int, default=1000)
+    parser.add_argument('--http-concurrency', type=int, default=16)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = [case for case in build_cases()
+             if args.max_megapixels is None or megapixels(case) <= args.max_megapixels]
+    # 在子进程中生成图片，生成 48MP 图片的内存不计入本进程的峰值 RSS
+    with ProcessPoolExecutor(max_workers=1) as generator:
+        paths = generator.submit(write_corpus, args.corpus, cases).result()
+
+    results = run_processing(cases, paths, args.repeat)
+    rss = peak_rss_mb()
+    if not args.no_http:
+        results.update(run_http(args.http_requests, args.http_concurrency))
+    print_results(results)
+    print(f"peak RSS: {rss:.1f} MB")
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': Image.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'cases': [case.name for case in cases],
+            'repeat': args.repeat,
+            'peak_rss_mb': rss,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"基准已更新：{args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"没有基准文件 {args.baseline}，跳过比较")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline['results'], args.threshold)
+    # 峰值内存与延迟同样按阈值比较
+    base_rss = baseline['meta'].get('peak_rss_mb')
+    if base_rss and rss / base_rss - 1 > args.threshold:
+        regressions.append(('process', 'peak_rss_mb', base_rss, rss, rss / base_rss - 1))
+    for group, name, base, current, change in regressions:
+        print(f"回归：{group} {name} {base:.2f} -> {current:.2f} ({change:+.0%})")
+    if baseline['meta'].get('machine') != platform.machine() or baseline['meta'].get('cpus') != os.cpu_count():
+        print('注意：基准在不同的机器上生成，比较结果仅供参考')
+    if baseline['meta'].get('cases') != report['meta']['cases']:
+        print('注意：测试图片与基准不同（--max-megapixels），汇总分组不可直接比较')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
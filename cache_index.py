@@ -0,0 +1,274 @@
+"""结果缓存的共享索引
+
+同一缓存目录的所有进程（gunicorn 服务进程、引擎工作进程、命令行）共用缓存目录下的一个
+SQLite 文件（WAL 模式，读写互不阻塞）：每个结果的路径、大小、创建和最后访问时间、命中次数，
+以及全部进程合计的命中、未命中和淘汰次数。
+
+写入结果时立即提交（进程池的工作进程退出时不会执行清理，未提交的新结果将无法被淘汰）；
+命中刷新的访问时间和计数只累积在进程内存中，请求线程不等待 SQLite 写锁，由后台清理线程
+每 CACHE_INDEX_FLUSH_INTERVAL 秒（累积 CACHE_INDEX_BATCH_SIZE 条时提前唤醒）在一个事务中写入。
+
+淘汰和统计都来自带索引的查询，不再遍历目录。索引文件不存在时（首次启动或被删除）由第一个
+打开的进程扫描缓存目录重建。打开索引（包括清除残留的日志文件和重建）由索引旁的锁文件串行化，
+其他进程等待锁，随后直接使用重建的结果，不会删除别的进程刚创建的日志文件。
+锁文件在 POSIX 上使用 fcntl.flock，在 Windows 上使用 msvcrt.locking；两者都不可用时不加
+跨进程锁（单进程使用仍然安全）。
+"""
+import os
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from config import CACHE_INDEX_BATCH_SIZE, CACHE_INDEX_FLUSH_INTERVAL, CACHE_INDEX_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger('CacheIndex')
+
+# 索引文件名（位于缓存目录下，以 . 开头，与结果文件区分）和串行化打开索引的锁文件
+INDEX_FILE = '.index.sqlite3'
+LOCK_SUFFIX = '.lock'
+# 全部进程合计的计数，以及协调清理的时间戳，保存在 meta 表中
+COUNTERS = ('hits', 'misses', 'evictions')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    result_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('hits', 0), ('misses', 0), ('evictions', 0), ('last_sweep', 0);
+"""
+
+UPSERT_ENTRY = """
+INSERT INTO entries (result_id, path, size, created, accessed) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (result_id) DO UPDATE SET
+    path = excluded.path, size = excluded.size, created = excluded.created,
+    accessed = MAX(accessed, excluded.accessed)
+"""
+
+
+def is_index_file(name):
+    """索引文件及其 -wal、-shm 文件"""
+    return name.startswith(INDEX_FILE)
+
+
+# 没有跨进程文件锁时，至少串行化同一进程的不同线程
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程（及同一进程的不同线程）互斥：在 path 上加独占锁，进程退出时自动释放"""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            # 锁定文件的第一个字节；LK_LOCK 重试约 10 秒后抛出 OSError，继续等待
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            with _thread_lock:
+                yield
+
+
+class CacheIndex:
+    """缓存目录的 SQLite 索引；每个线程使用自己的连接，进程内的待写记录由锁保护
+
+    scan 为重建时调用的函数，返回缓存目录中的 [(结果 ID, 路径, 大小, 创建时间, 访问时间)]。
+    待写记录累积到 batch_size 条时设置 flush_wanted，由后台线程调用 flush 写入。
+    """
+
+    def __init__(self, cache_dir, scan, batch_size=CACHE_INDEX_BATCH_SIZE,
+                 flush_interval=CACHE_INDEX_FLUSH_INTERVAL):
+        self.path = os.path.join(cache_dir, INDEX_FILE)
+        self.scan = scan
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 索引文件被替换时递增，各线程据此重新连接
+        self._generation = 0
+        self._inode = None
+        self._touches = {}
+        self._counts = dict.fromkeys(COUNTERS, 0)
+        self._pending = 0
+        self.flush_wanted = threading.Event()
+
+    def _connect(self):
+        """本线程的连接；进程分叉或索引文件被替换后重新连接"""
+        local = self._local
+        key = (os.getpid(), self._generation)
+        if getattr(local, 'key', None) != key:
+            local.connection = self._open()
+            local.key = key
+        return local.connection
+
+    def _open(self):
+        """打开（必要时新建并重建）索引；持有锁文件期间进行，多个进程不会同时新建"""
+        with file_lock(self.path + LOCK_SUFFIX):
+            if not os.path.exists(self.path):
+                # 残留的旧日志文件不能用于新建的索引
+                for suffix in ('-wal', '-shm'):
+                    try:
+                        os.remove(self.path + suffix)
+                    except FileNotFoundError:
+                        pass
+            connection = sqlite3.connect(self.path, timeout=CACHE_INDEX_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with transaction(connection):
+                # executescript 会先提交当前事务，逐条执行
+                for statement in SCHEMA.split(';'):
+                    if statement.strip():
+                        connection.execute(statement)
+                if connection.execute("SELECT 1 FROM meta WHERE name = 'built'").fetchone() is None:
+                    self._rebuild(connection)
+            self._inode = os.stat(self.path).st_ino
+        return connection
+
+    def _rebuild(self, connection):
+        """扫描缓存目录重建索引（在调用方的事务中）"""
+        rows = list(self.scan())
+        connection.executemany(UPSERT_ENTRY, rows)
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('built', ?)", (time.time(),))
+        logger.info("Rebuilt cache index with %d entries", len(rows))
+
+    def _check_replaced(self):
+        """索引文件被删除或替换时让各线程重新连接（并在需要时重建）"""
+        try:
+            replaced = os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            replaced = True
+        if replaced and self._inode is not None:
+            self._generation += 1
+            self._inode = None
+
+    def lookup(self, result_id):
+        """索引中结果的路径，不在索引中时返回 None"""
+        row = self._connect().execute('SELECT path FROM entries WHERE result_id = ?', (result_id,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, result_id, path, size, created):
+        """记录新写入的结果并立即提交"""
+        self._connect().execute(UPSERT_ENTRY, (result_id, path, size, created, created))
+
+    def remove(self, result_id):
+        self._connect().execute('DELETE FROM entries WHERE result_id = ?', (result_id,))
+
+    def record_hit(self, result_id):
+        """只在内存中记录命中，不访问 SQLite"""
+        with self._lock:
+            _, hits = self._touches.get(result_id, (0, 0))
+            self._touches[result_id] = (time.time(), hits + 1)
+            self._counts['hits'] += 1
+            self._record_pending()
+
+    def record_miss(self):
+        with self._lock:
+            self._counts['misses'] += 1
+            self._record_pending()
+
+    def _record_pending(self):
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush_wanted.set()
+
+    def flush(self):
+        """在一个事务中写入累积的访问时间和计数（可能等待其他进程的写锁，不在请求线程中调用）"""
+        with self._lock:
+            self._check_replaced()
+            touches, self._touches = self._touches, {}
+            counts, self._counts = self._counts, dict.fromkeys(COUNTERS, 0)
+            self._pending = 0
+            self.flush_wanted.clear()
+        if not touches and not any(counts.values()):
+            return
+        connection = self._connect()
+        with transaction(connection):
+            connection.executemany(
+                'UPDATE entries SET accessed = MAX(accessed, ?), hits = hits + ? WHERE result_id = ?',
+                [(accessed, hits, result_id) for result_id, (accessed, hits) in touches.items()])
+            connection.executemany('UPDATE meta SET value = value + ? WHERE name = ?',
+                                   [(value, name) for name, value in counts.items() if value])
+
+    def claim_sweep(self, interval):
+        """多个进程中只有一个执行定期清理：距上次清理超过 interval 秒时返回 True 并记录本次时间"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE meta SET value = ? WHERE name = 'last_sweep' AND value <= ?", (now, now - interval))
+        return cursor.rowcount == 1
+
+    def evict(self, expiry, max_bytes):
+        """从索引中删除访问时间早于 expiry 的结果，总大小仍超出 max_bytes 时按访问时间从旧到新删除
+
+        返回被删除的 [(路径, 大小)]，由调用方删除文件。
+        """
+        self.flush()
+        connection = self._connect()
+        with transaction(connection):
+            victims = connection.execute(
+                'SELECT result_id, path, size FROM entries WHERE accessed < ?', (expiry,)).fetchall()
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            remaining = total - sum(size for _, _, size in victims)
+            if remaining > max_bytes:
+                for result_id, path, size in connection.execute(
+                        'SELECT result_id, path, size FROM entries WHERE accessed >= ? ORDER BY accessed',
+                        (expiry,)):
+                    if remaining <= max_bytes:
+                        break
+                    victims.append((result_id, path, size))
+                    remaining -= size
+            connection.executemany('DELETE FROM entries WHERE result_id = ?',
+                                   [(result_id,) for result_id, _, _ in victims])
+            connection.execute("UPDATE meta SET value = value + ? WHERE name = 'evictions'", (len(victims),))
+        return [(path, size) for _, path, size in victims]
+
+    def stats(self):
+        """全部进程合计的条目数、总大小和命中、未命中、淘汰次数（先写入本进程累积的记录）"""
+        self.flush()
+        connection = self._connect()
+        entries, total = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        counters = dict(connection.execute(
+            f"SELECT name, value FROM meta WHERE name IN ({', '.join('?' * len(COUNTERS))})", COUNTERS))
+        return dict({name: int(counters.get(name, 0)) for name in COUNTERS}, entries=entries, bytes=total)
+
+
+@contextmanager
+def transaction(connection):
+    """立即获取写锁的事务，避免读后升级写锁时与其他进程死锁"""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
@@ -0,0 +1,273 @@
+"""命令行批量处理
+
+把目录或通配符匹配的图片按一个或多个尺寸处理到输出目录，在进程池中并行处理，
+并显示吞吐量和预计剩余时间。每处理完一张图片向清单（manifest.jsonl）追加一行
+（源文件 → 哈希和输出文件），中断后重新运行会跳过已完成的图片。
+
+示例：
+    python cli.py photos/ -s 一寸 -s 二寸 -o out/
+    python cli.py "photos/**/*.jpg" -s 295x413 -o out/ -j 8
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, wait
+from config import ALLOWED_EXTENSIONS, CACHE_DIR, OUTPUT_FORMATS, JPEG_SUBSAMPLING, BACKGROUND_COLORS
+from engine import InlineEngine, create_engine
+from image_processor import ImageProcessor
+from ingest import ingest_stream
+from log_setup import configure_logging, forward_logging, worker_log_queue
+from memory_cache import MemoryCache
+from result_cache import ResultCache
+from spec import ProcessingSpec, parse_size
+
+# 每个工作进程内的处理器
+_processor = None
+
+
+def init_worker(cache_dir, log_queue=None):
+    """工作进程初始化：处理器在本进程内同步执行，结果写入共享的磁盘缓存，日志交给主进程写入"""
+    global _processor
+    forward_logging(log_queue)
+    _processor = ImageProcessor(ResultCache(cache_dir=cache_dir), InlineEngine())
+    # 命中记录由后台线程写入共享索引
+    _processor.cache.start_sweeper()
+    # 每张图片只处理一次，不保留几何中间结果
+    _processor.intermediates = MemoryCache(0)
+
+
+def process_file(path, specs, output_paths):
+    """在工作进程中处理一张图片并复制结果到输出路径，返回 (源文件哈希, {缓存键: 输出路径})"""
+    with open(path, 'rb') as f:
+        upload = ingest_stream(f)
+    result_ids = _processor.process_upload(upload, specs)
+    outputs = {}
+    for spec, output_path in zip(specs, output_paths):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        _processor.cache.export(result_ids[spec.size_name], output_path)
+        outputs[spec.cache_key] = output_path
+    return upload.file_hash, outputs
+
+
+def collect_sources(inputs):
+    """展开输入目录和通配符，返回 [(源文件路径, 相对路径)]；相对路径决定输出目录结构"""
+    sources = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = glob.glob(os.path.join(glob.escape(pattern), '**', '*'), recursive=True)
+        else:
+            root = glob_root(pattern)
+            paths = glob.glob(pattern, recursive=True)
+        for path in paths:
+            extension = os.path.splitext(path)[1][1:].lower()
+            if extension in ALLOWED_EXTENSIONS and os.path.isfile(path):
+                sources.setdefault(os.path.abspath(path), os.path.relpath(path, root))
+    return sorted(sources.items(), key=lambda source: source[1])
+
+
+def glob_root(pattern):
+    """通配符中第一个含通配字符的部分之前的目录"""
+    parts = []
+    for part in pattern.split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    else:
+        # 不含通配符：单个文件，相对于所在目录
+        return os.path.dirname(pattern) or '.'
+    return os.sep.join(parts) or '.'
+
+
+def output_path(output_dir, relative_path, spec):
+    """输出文件路径：保持源文件的相对目录，文件名追加尺寸名称"""
+    stem = os.path.splitext(relative_path)[0]
+    return os.path.join(output_dir, f"{stem}_{spec.size_name}.{spec.extension}")
+
+
+class Manifest:
+    """追加写入的处理清单（JSON Lines），每行记录一个完成的源文件
+
+    源文件按路径、大小和修改时间识别，不必重新读取和计算哈希就能判断是否已完成。
+    中断时最后一行可能不完整，读取时忽略。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    previous = self.entries.get(entry['source'])
+                    if previous and (previous['size'], previous['mtime_ns']) == (entry['size'], entry['mtime_ns']):
+                        entry['outputs'] = {**previous['outputs'], **entry['outputs']}
+                    self.entries[entry['source']] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_complete(self, source, stat, specs, output_paths):
+        """源文件未改变，且每个处理参数的输出都已存在"""
+        entry = self.entries.get(source)
+        if entry is None or (entry['size'], entry['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            return False
+        return all(entry['outputs'].get(spec.cache_key) == path and os.path.exists(path)
+                   for spec, path in zip(specs, output_paths))
+
+    def record(self, source, stat, file_hash, outputs):
+        entry = {'source': source, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                 'hash': file_hash, 'outputs': outputs}
+        self.entries[source] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        # 每行立即写入，中断后已完成的图片不会丢失
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    """在标准错误输出显示完成数、吞吐量和预计剩余时间"""
+
+    def __init__(self, total, stream=sys.stderr, interval=1.0):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._last_report = 0
+
+    def update(self, failed=False):
+        self.done += 1
+        self.failed += failed
+        now = time.monotonic()
+        if now - self._last_report >= self.interval or self.done == self.total:
+            self._last_report = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed else 0
+        remaining = (self.total - self.done) / rate if rate else 0
+        eta = time.strftime('%H:%M:%S', time.gmtime(remaining))
+        end = '\r' if self.stream.isatty() and self.done < self.total else '\n'
+        self.stream.write(f"{self.done}/{self.total}  {rate:.1f} 张/秒  剩余 {eta}  失败 {self.failed}{end}")
+        self.stream.flush()
+
+
+def run(sources, specs, output_dir, workers, cache_dir, manifest_path, stream=sys.stderr):
+    """处理全部源文件，返回失败的 [(源文件, 错误)]"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(manifest_path)
+    pending = []
+    for source, relative_path in sources:
+        paths = [output_path(output_dir, relative_path, spec) for spec in specs]
+        stat = os.stat(source)
+        if not manifest.is_complete(source, stat, specs, paths):
+            pending.append((source, stat, paths))
+    skipped = len(sources) - len(pending)
+    stream.write(f"共 {len(sources)} 张，跳过已完成的 {skipped} 张，使用 {workers} 个进程处理 {len(pending)} 张\n")
+
+    if workers == 1:
+        init_worker(cache_dir)
+        engine = InlineEngine()
+    else:
+        engine = create_engine('process', workers, partial(init_worker, cache_dir, worker_log_queue()))
+    progress = Progress(len(pending), stream)
+    failures = []
+    # 同时提交的任务数有限，5 万张图片时不会一次创建全部任务
+    window = workers * 4
+    queue = iter(pending)
+    inflight = {}
+    try:
+        while True:
+            while len(inflight) < window and (task := next(queue, None)) is not None:
+                source, stat, paths = task
+                inflight[engine.submit(process_file, source, specs, paths)] = task
+            if not inflight:
+                break
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                source, stat, paths = inflight.pop(future)
+                try:
+                    file_hash, outputs = future.result()
+                except Exception as e:
+                    failures.append((source, str(e)))
+                    progress.update(failed=True)
+                else:
+                    manifest.record(source, stat, file_hash, outputs)
+                    progress.update()
+    finally:
+        manifest.close()
+        engine.shutdown()
+        if workers == 1:
+            _processor.cache.stop_sweeper()
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='批量处理证件照')
+    parser.add_argument('inputs', nargs='+', help='输入目录或通配符（如 "photos/**/*.jpg"）')
+    parser.add_argument('-s', '--size', dest='sizes', action='append', required=True,
+                        help='尺寸名称或 宽x高，可重复指定')
+    parser.add_argument('-o', '--output', required=True, help='输出目录')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='进程数')
+    parser.add_argument('--brightness', type=float, default=1.0)
+    parser.add_argument('--contrast', type=float, default=1.0)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, type=str.upper, help='输出格式，默认 JPEG')
+    parser.add_argument('--quality', type=int, help='有损格式的编码质量（1–100）')
+    parser.add_argument('--max-bytes', type=int, help='结果文件的最大字节数，自动降低编码质量以满足')
+    parser.add_argument('--subsampling', choices=JPEG_SUBSAMPLING, help='JPEG 色度抽样')
+    parser.add_argument('--progressive', action='store_true', default=None, help='输出渐进式 JPEG')
+    parser.add_argument('--optimize', action='store_true', default=None,
+                        help='优化编码（文件更小、编码更慢）')
+    parser.add_argument('--background', choices=BACKGROUND_COLORS, help='替换背景颜色')
+    parser.add_argument('--manifest', help='处理清单路径，默认为 输出目录/manifest.jsonl')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='结果缓存目录，与服务共用时相同图片不再处理')
+    parser.add_argument('--no-cache', action='store_true', help='使用临时缓存目录，结束后删除')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging()
+    sizes = [parse_size(value) for value in args.sizes]
+    if None in sizes:
+        sys.exit(f"无效的尺寸：{', '.join(value for value, size in zip(args.sizes, sizes) if size is None)}")
+    options = {name: value for name, value in (('format', args.format), ('quality', args.quality),
+                                                ('max_bytes', args.max_bytes), ('subsampling', args.subsampling),
+                                                ('progressive', args.progressive), ('optimize', args.optimize),
+                                                ('background', args.background))
+               if value is not None}
+    try:
+        specs = list(dict.fromkeys(ProcessingSpec.create(size, args.brightness, args.contrast, **options)
+                                   for size in sizes))
+    except ValueError as e:
+        sys.exit(f"无效的输出选项：{e}")
+    sources = collect_sources(args.inputs)
+    if not sources:
+        sys.exit('没有找到图片')
+
+    cache_dir = tempfile.mkdtemp() if args.no_cache else args.cache_dir
+    manifest_path = args.manifest or os.path.join(args.output, 'manifest.jsonl')
+    try:
+        failures = run(sources, specs, args.output, max(1, args.workers), cache_dir, manifest_path)
+    finally:
+        if args.no_cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    for source, error in failures:
+        print(f"失败：{source}：{error}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,11 +16,94 @@ PHOTO_SIZES = {
 }
 
 # 图片处理配置
-INITIAL_COMPRESSION_SIZE = (1000, 1000)  # 大图片初始压缩尺寸
 JPEG_QUALITY = 95
-CACHE_EXPIRY_DAYS = 7  # 缓存过期时间（天）
+# 解码时缩小的过采样倍数：解码后的裁剪区域至少为目标尺寸的该倍数，
+# 保证 LANCZOS 缩放后的结果与全分辨率解码的差异在每通道平均 2 级灰度以内
+DECODE_OVERSAMPLE = 2
+# 预览模式：最长边、JPEG 质量、解码过采样倍数（1 表示解码到刚好覆盖输出尺寸）
+PREVIEW_MAX_EDGE = 350
+PREVIEW_QUALITY = 70
+PREVIEW_OVERSAMPLE = 1
+# 输出格式；指定 max_bytes 时查找满足字节数的最高质量：质量下限、每个结果最多编码次数
+OUTPUT_FORMATS = ('JPEG', 'WEBP', 'PNG')
+JPEG_SUBSAMPLING = ('4:4:4', '4:2:2', '4:2:0')
+ENCODE_MIN_QUALITY = 10
+ENCODE_MAX_ATTEMPTS = 8
+# 冲印排版：相纸尺寸（毫米）、默认相纸、默认和最高分辨率（DPI）、预设尺寸的像素对应的打印分辨率、
+# 页边距和照片间距（毫米）、裁切线颜色
+PAPER_SIZES = {
+    "5寸": (88.9, 127),
+    "6寸": (101.6, 152.4),
+    "7寸": (127, 177.8),
+    "A4": (210, 297)
+}
+SHEET_PAPER = "6寸"
+SHEET_DPI = 300
+SHEET_MAX_DPI = 600
+PHOTO_DPI = 300
+SHEET_MARGIN_MM = 3
+SHEET_GAP_MM = 2
+SHEET_GUIDE_COLOR = (160, 160, 160)
+# 背景替换：可选的背景色、边缘取样宽度（占宽高的比例）、背景色距离容差的上下限、
+# 柔和过渡的外边界（容差的倍数）、决定容差的样本距离百分位数
+BACKGROUND_COLORS = {
+    "white": (255, 255, 255),
+    "blue": (67, 142, 219),
+    "red": (255, 0, 0)
+}
+BACKGROUND_BORDER = 0.04
+BACKGROUND_MIN_TOLERANCE = 20
+BACKGROUND_MAX_TOLERANCE = 60
+BACKGROUND_FEATHER = 2.0
+BACKGROUND_SAMPLE_PERCENTILE = 95
+TONE_LUT_CACHE_SIZE = 256  # 亮度/对比度查找表的缓存数量
+CACHE_EXPIRY_DAYS = 7  # 缓存过期时间（天，按最后访问时间）
+CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 结果缓存容量预算（字节），超出时按最近最少访问淘汰
+CACHE_SWEEP_INTERVAL = 600  # 后台清理缓存的间隔（秒），多个进程共用缓存目录时合计每个间隔清理一次
+# 缓存目录的共享索引（SQLite）：访问记录累积的条数和时间（秒）上限、等待其他进程写锁的时间（秒）
+CACHE_INDEX_BATCH_SIZE = 256
+CACHE_INDEX_FLUSH_INTERVAL = 1.0
+CACHE_INDEX_TIMEOUT = 30
+INTERMEDIATE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 内存中几何中间结果的容量预算（字节）
+RESULT_MAX_AGE = 365 * 24 * 3600  # 结果 URL 的浏览器缓存时间（秒），内容寻址可长期缓存
+
+# 执行引擎：inline（调用线程内）、thread（线程池）或 process（进程池，上传内容经共享内存传递）
+ENGINE_MODE = os.environ.get('ENGINE_MODE', 'thread')
+ENGINE_WORKERS = int(os.environ.get('ENGINE_WORKERS', 0)) or os.cpu_count() or 1
+# 处理请求的线程数（计算哈希、读写缓存、等待执行引擎），应不少于引擎工作数
+REQUEST_WORKERS = max(4, 2 * ENGINE_WORKERS)
+
+# 准入控制：进行中（排队 + 处理中）的请求上限、按图片头估算的解码内存预算（字节）、
+# 拒绝时建议客户端重试的等待时间（秒）、请求默认截止时间（秒）
+ADMISSION_MAX_INFLIGHT = 4 * REQUEST_WORKERS
+ADMISSION_MAX_MEMORY = 512 * 1024 * 1024
+ADMISSION_RETRY_AFTER = 2
+REQUEST_TIMEOUT = 30
+
+# 上传按块流式接收，边接收边计算哈希；文件头在前 HEADER_PROBE_BYTES 字节内解析，
+# 像素数超过 MAX_IMAGE_PIXELS 的图片在解码之前拒绝
+UPLOAD_CHUNK_SIZE = 64 * 1024
+HEADER_PROBE_BYTES = 256 * 1024
+MAX_IMAGE_PIXELS = 64 * 1000 * 1000
+
+# 批处理任务：任务目录、所有批处理同时占用的引擎任务数上限（不超过引擎的一半，保留给交互请求）、
+# 每个任务的并发数、每个任务的图片数和上传总大小上限、完成的任务保留时间（秒）
+BATCH_DIR = 'batches'
+BATCH_WORKERS = max(1, ENGINE_WORKERS // 2)
+BATCH_JOB_CONCURRENCY = 2
+BATCH_MAX_FILES = 1000
+BATCH_MAX_BYTES = 1024 * 1024 * 1024
+BATCH_JOB_TTL = 24 * 3600
+
+# 日志：由后台线程写入按大小轮转的文件；每个请求一条 JSON 记录，按 LOG_SAMPLE_RATE 采样
+# （0–1，失败的请求总是记录）
+LOG_FILE = os.path.join(LOG_DIR, 'image_processor.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
 
-# 创建必要的目录
+# 创建必要的目录（批处理任务目录在创建第一个任务时生成）
 for directory in [CACHE_DIR, LOG_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory) 
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""按输出参数编码结果图片
+
+指定 max_bytes 时在 [ENCODE_MIN_QUALITY, spec.quality] 内查找不超过目标字节数的最高质量：
+先以 spec.quality 编码，超出时按这次的大小校准体积模型预测满足目标的质量；此后在已知的
+“满足 / 超出”区间内用实际大小插值（对数大小上的割线法，见 next_quality）。每次编码都
+复用同一张已解码、调整好的图片；内容与模型接近时 3 次左右即可，噪点多的图片通常 4–5 次，
+最多 ENCODE_MAX_ATTEMPTS 次。
+
+查找得到的质量写入结果的 EXIF ImageDescription（quality=<质量>），缓存命中时
+只需解析文件头即可读出（read_quality）。
+"""
+import io
+import math
+from dataclasses import dataclass
+from PIL import Image
+from config import ENCODE_MIN_QUALITY, ENCODE_MAX_ATTEMPTS
+
+# EXIF ImageDescription
+DESCRIPTION_TAG = 0x010E
+
+# 体积模型：质量 0, 5, ..., 100 时的文件大小相对于质量 95 的比例（证件照尺寸的照片和合成图的几何平均）
+SIZE_MODELS = {
+    'JPEG': (0.048, 0.066, 0.112, 0.147, 0.176, 0.204, 0.231, 0.255, 0.276, 0.298, 0.316,
+             0.336, 0.358, 0.386, 0.419, 0.457, 0.511, 0.583, 0.711, 1.000, 1.953),
+    'WEBP': (0.089, 0.142, 0.178, 0.204, 0.230, 0.254, 0.274, 0.293, 0.310, 0.324, 0.340,
+             0.356, 0.374, 0.392, 0.410, 0.427, 0.485, 0.571, 0.684, 1.000, 1.253),
+}
+# 有损格式：支持质量参数和字节数目标
+LOSSY_FORMATS = set(SIZE_MODELS)
+
+
+class TargetTooSmall(ValueError):
+    """最低质量编码仍超过 max_bytes"""
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """编码结果和实际使用的质量（无损格式为 None）"""
+    data: bytes
+    quality: int
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+def relative_size(image_format, quality):
+    """体积模型：质量为 quality 时的相对大小，在相邻两个采样点之间按对数插值"""
+    model = SIZE_MODELS[image_format]
+    position = min(max(quality, 0), 100) / 5
+    index = min(int(position), len(model) - 2)
+    fraction = position - index
+    return math.exp(math.log(model[index]) * (1 - fraction) + math.log(model[index + 1]) * fraction)
+
+
+def size_curve(image_format, points):
+    """由一或两次编码的 [(质量, 大小)] 预测任意质量的对数大小
+
+    以体积模型的对数相对大小为横轴：一个点时按该点校准模型（斜率为 1），
+    两个点时取过两点的直线（对数大小上的割线）。
+    """
+    (q0, s0), *rest = points
+    x0, y0 = math.log(relative_size(image_format, q0)), math.log(s0)
+    slope = 1.0
+    if rest:
+        (q1, s1), = rest
+        slope = (math.log(s1) - y0) / (math.log(relative_size(image_format, q1)) - x0)
+    return lambda quality: y0 + slope * (math.log(relative_size(image_format, quality)) - x0)
+
+
+def highest_fitting(curve, low, high, max_bytes):
+    """(low, high) 内预测大小不超过 max_bytes 的最高质量，都预计超出时返回 low + 1"""
+    limit = math.log(max_bytes)
+    for quality in range(high - 1, low + 1, -1):
+        if curve(quality) <= limit:
+            return quality
+    return low + 1
+
+
+def next_quality(image_format, attempts, fitting, too_large, low, max_bytes):
+    """下一次编码的质量，结果总在 (low, too_large) 内
+
+    基本做法是在“满足 / 超出”区间两端之间插值；区间一端长期不动时，端点插值每次只前进一点，
+    因此同时用最近两次编码做割线，割线结果落在端点插值和区间中点之间时采用割线
+    （与 Brent 方法相同的保护）。两次编码在同一侧且插值紧贴这一侧时，改用二分。
+    """
+    points = [(quality, len(data)) for quality, data in attempts.items()]
+    if len(points) == 1:
+        return highest_fitting(size_curve(image_format, points), low, too_large, max_bytes)
+    recent = points[-2:]
+    secant = highest_fitting(size_curve(image_format, recent), low, too_large, max_bytes)
+    if fitting is None:
+        return secant
+    bracket = highest_fitting(size_curve(image_format, [(fitting, len(attempts[fitting])),
+                                                        (too_large, len(attempts[too_large]))]),
+                              low, too_large, max_bytes)
+    middle = (low + too_large + 1) // 2
+    if {quality for quality, _ in recent} == {fitting, too_large}:
+        return bracket
+    if min(bracket, middle) <= secant <= max(bracket, middle):
+        return secant
+    # 插值不能缩小区间：最近两次在同一侧，且插值只让这一侧再前进一点
+    same_side = (recent[0][1] <= max_bytes) == (recent[1][1] <= max_bytes)
+    if same_side and too_large - low > 3 and bracket in (low + 1, too_large - 1):
+        return middle
+    return bracket
+
+
+def save_options(spec, quality):
+    """Pillow save() 的格式参数"""
+    image_format = spec.format.upper()
+    if image_format == 'JPEG':
+        options = {'quality': quality, 'progressive': spec.progressive, 'optimize': spec.optimize}
+        if spec.subsampling:
+            options['subsampling'] = spec.subsampling
+        return options
+    if image_format == 'WEBP':
+        # method 越大压缩越充分、编码越慢
+        return {'quality': quality, 'method': 6 if spec.optimize else 4}
+    return {'optimize': spec.optimize}
+
+
+def quality_exif(quality):
+    exif = Image.Exif()
+    exif[DESCRIPTION_TAG] = f'quality={quality}'
+    return exif.tobytes()
+
+
+def encode_at(image, spec, quality, stamp=False):
+    """以指定质量编码一次；stamp 时把质量写入 EXIF"""
+    options = save_options(spec, quality)
+    if stamp:
+        options['exif'] = quality_exif(quality)
+    buffered = io.BytesIO()
+    image.save(buffered, format=spec.format, **options)
+    return buffered.getvalue()
+
+
+def encode(image, spec):
+    """按处理参数编码，返回 EncodedImage；无法满足 max_bytes 时抛出 TargetTooSmall"""
+    image_format = spec.format.upper()
+    if image_format not in LOSSY_FORMATS:
+        return EncodedImage(encode_at(image, spec, None), None)
+    if not spec.max_bytes:
+        return EncodedImage(encode_at(image, spec, spec.quality), spec.quality)
+
+    max_bytes = spec.max_bytes
+    lowest = min(ENCODE_MIN_QUALITY, spec.quality)
+    attempts = {}
+
+    def fits(quality):
+        attempts[quality] = encode_at(image, spec, quality, stamp=True)
+        return len(attempts[quality]) <= max_bytes
+
+    # fitting：已知满足目标的最高质量；too_large：已知超出目标的最低质量
+    fitting, too_large = None, spec.quality + 1
+    quality = spec.quality
+    while len(attempts) < ENCODE_MAX_ATTEMPTS:
+        if fits(quality):
+            fitting = quality
+        else:
+            too_large = quality
+            if quality == lowest:
+                break
+        low = fitting if fitting is not None else lowest - 1
+        if too_large - low <= 1:
+            break
+        quality = next_quality(image_format, attempts, fitting, too_large, low, max_bytes)
+
+    if fitting is None:
+        if lowest not in attempts and fits(lowest):
+            fitting = lowest
+        else:
+            raise TargetTooSmall(f'Cannot encode {spec.size_name} within {max_bytes} bytes '
+                                 f'(quality {lowest} needs {len(attempts[lowest])} bytes)')
+    return EncodedImage(attempts[fitting], fitting)
+
+
+def read_quality(path, spec):
+    """结果文件的编码质量：max_bytes 的结果从 EXIF 读取，其他（包括排版结果）为处理参数中的质量"""
+    if spec.format.upper() not in LOSSY_FORMATS:
+        return None
+    if not getattr(spec, 'max_bytes', None):
+        return spec.quality
+    with Image.open(path) as image:
+        description = image.getexif().get(DESCRIPTION_TAG, '')
+    if isinstance(description, str) and description.startswith('quality='):
+        return int(description.split('=', 1)[1])
+    return None
@@ -0,0 +1,133 @@
+import io
+import contextvars
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+
+class InlineEngine:
+    """在调用线程中直接执行任务（调试和单元测试用）"""
+    mode = 'inline'
+
+    def __init__(self, workers=1, initializer=None):
+        self.workers = 1
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ThreadEngine:
+    """在线程池中执行任务，Pillow 只在部分操作中释放 GIL"""
+    mode = 'thread'
+
+    def __init__(self, workers, initializer=None):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='engine')
+
+    def submit(self, fn, *args, **kwargs):
+        # 在提交方的上下文副本中执行，调用方的计时记录（metrics.record_timings）随任务传递
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class ProcessEngine:
+    """在进程池中执行任务，CPU 密集的处理可以用满所有核心
+
+    任务函数和参数必须可以 pickle；大块输入通过 share_bytes 放入共享内存传递。
+    """
+    mode = 'process'
+
+    def __init__(self, workers, initializer=None):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=process_context(),
+                                             initializer=initializer)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def process_context():
+    """工作进程的启动方式；传给工作进程的队列等对象须由同一上下文创建
+
+    避免 fork 时复制父进程中持有锁的线程（缓存清理、日志等）。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+ENGINES = {engine.mode: engine for engine in (InlineEngine, ThreadEngine, ProcessEngine)}
+
+
+def create_engine(mode, workers, initializer=None):
+    """按模式（inline/thread/process）创建执行引擎"""
+    if mode not in ENGINES:
+        raise ValueError(f"Unknown engine mode: {mode}")
+    return ENGINES[mode](workers, initializer)
+
+
+def share_bytes(data):
+    """把数据复制到新建的共享内存块中，调用方负责 close() 和 unlink()"""
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    return block
+
+
+class _SharedReader(io.RawIOBase):
+    """以只读文件的方式读取 memoryview，不复制整块数据"""
+
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self._view) - self._position)
+        buffer[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+@contextmanager
+def open_shared(name, length):
+    """在工作进程中挂载共享内存块，返回可读取前 length 字节的文件对象"""
+    # 工作进程与主进程共用资源跟踪器，共享内存由主进程 unlink 释放
+    block = shared_memory.SharedMemory(name=name)
+    view = block.buf[:length]
+    reader = io.BufferedReader(_SharedReader(view))
+    try:
+        yield reader
+    finally:
+        reader.close()
+        view.release()
+        block.close()
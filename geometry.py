@@ -0,0 +1,132 @@
+from collections import namedtuple
+from PIL import Image
+import metrics
+
+T = Image.Transpose
+
+# EXIF 方向标签
+ORIENTATION_TAG = 0x0112
+
+# EXIF 方向值对应的变换序列
+EXIF_TRANSPOSES = {
+    2: [T.FLIP_LEFT_RIGHT],
+    3: [T.ROTATE_180],
+    4: [T.FLIP_TOP_BOTTOM],
+    5: [T.FLIP_LEFT_RIGHT, T.ROTATE_90],
+    6: [T.ROTATE_270],
+    7: [T.FLIP_LEFT_RIGHT, T.ROTATE_270],
+    8: [T.ROTATE_90]
+}
+
+# 每种变换在以图片中心为原点、y 轴向下的坐标系中的矩阵 (a, b, c, d)：
+# x' = a*x + b*y, y' = c*x + d*y
+_MATRICES = {
+    None: (1, 0, 0, 1),
+    T.FLIP_LEFT_RIGHT: (-1, 0, 0, 1),
+    T.FLIP_TOP_BOTTOM: (1, 0, 0, -1),
+    T.ROTATE_90: (0, 1, -1, 0),
+    T.ROTATE_180: (-1, 0, 0, -1),
+    T.ROTATE_270: (0, -1, 1, 0),
+    T.TRANSPOSE: (0, 1, 1, 0),
+    T.TRANSVERSE: (0, -1, -1, 0)
+}
+_TRANSPOSES = {matrix: op for op, matrix in _MATRICES.items()}
+
+# 几何方案：在解码图片上的裁剪框、缩放尺寸，以及缩放后的单次变换（可能为 None）
+GeometryPlan = namedtuple('GeometryPlan', ['box', 'resize_size', 'transpose'])
+
+
+def read_orientation(image):
+    """从图片头读取 EXIF 方向，没有时返回 1"""
+    try:
+        return image.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def compose_transposes(operations):
+    """把按顺序执行的变换序列合成为单个变换，恒等变换返回 None"""
+    a, b, c, d = _MATRICES[None]
+    for operation in operations:
+        oa, ob, oc, od = _MATRICES[operation]
+        a, b, c, d = (oa * a + ob * c, oa * b + ob * d,
+                      oc * a + od * c, oc * b + od * d)
+    return _TRANSPOSES[(a, b, c, d)]
+
+
+def swaps_axes(transpose):
+    """判断变换是否交换宽高"""
+    return _MATRICES[transpose][0] == 0
+
+
+def transposed_size(size, transpose):
+    """计算变换后的图片尺寸"""
+    return (size[1], size[0]) if swaps_axes(transpose) else tuple(size)
+
+
+def plan_orientation(size, orientation):
+    """计算修正 EXIF 方向所需的变换序列（与 fix_image_orientation 的规则一致）"""
+    operations = list(EXIF_TRANSPOSES.get(orientation, []))
+    final_size = transposed_size(size, compose_transposes(operations))
+
+    # 如果宽高比发生显著变化且图片变窄，额外旋转 90 度修正
+    orig_ratio = size[0] / size[1]
+    final_ratio = final_size[0] / final_size[1]
+    if abs(orig_ratio - final_ratio) > 0.01 and final_ratio < 1 and orig_ratio > 1:
+        operations.append(T.ROTATE_90)
+    return operations
+
+
+def plan_auto_rotation(size, target_size):
+    """图片与目标方向（横/竖）不一致时旋转，使用 ROTATE_270 避免上下颠倒"""
+    is_portrait = size[1] > size[0]
+    is_target_portrait = target_size[1] > target_size[0]
+    return [T.ROTATE_270] if is_portrait != is_target_portrait else []
+
+
+def center_crop_box(size, target_size):
+    """计算与目标宽高比一致的居中裁剪框"""
+    width, height = size
+    target_ratio = target_size[0] / target_size[1]
+    if width / height > target_ratio:
+        new_width = int(height * target_ratio)
+        left = (width - new_width) // 2
+        return (left, 0, left + new_width, height)
+    new_height = int(width / target_ratio)
+    top = (height - new_height) // 2
+    return (0, top, width, top + new_height)
+
+
+def map_box(box, size, transpose):
+    """把变换后图片上的框映射回变换前（尺寸为 size）的图片坐标"""
+    a, b, c, d = _MATRICES[transpose]
+    final_width, final_height = transposed_size(size, transpose)
+    xs, ys = [], []
+    for x, y in ((box[0], box[1]), (box[2], box[3])):
+        # 转到中心坐标系后乘以逆矩阵（正交矩阵的逆即转置）
+        cx, cy = x - final_width / 2, y - final_height / 2
+        xs.append(a * cx + c * cy + size[0] / 2)
+        ys.append(b * cx + d * cy + size[1] / 2)
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def plan_geometry(size, orientation, target_size):
+    """根据图片尺寸、EXIF 方向和目标尺寸计算一次缩放加至多一次变换的方案"""
+    operations = plan_orientation(size, orientation)
+    oriented_size = transposed_size(size, compose_transposes(operations))
+    operations += plan_auto_rotation(oriented_size, target_size)
+
+    transpose = compose_transposes(operations)
+    final_size = transposed_size(size, transpose)
+    box = map_box(center_crop_box(final_size, target_size), size, transpose)
+    return GeometryPlan(box, transposed_size(target_size, transpose), transpose)
+
+
+def apply_geometry(image, plan, resample=Image.Resampling.LANCZOS):
+    """执行几何方案：带裁剪框的单次缩放，再做至多一次变换"""
+    with metrics.stage('resize'):
+        image = image.resize(plan.resize_size, resample, box=plan.box)
+    if plan.transpose is not None:
+        with metrics.stage('orientation'):
+            image = image.transpose(plan.transpose)
+    return image
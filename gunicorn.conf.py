@@ -0,0 +1,29 @@
+"""生产环境启动配置：gunicorn -c gunicorn.conf.py server:create_app
+
+每个服务进程运行一个 aiohttp 事件循环，只负责收发请求；CPU 密集的图片处理交给
+进程模式的执行引擎。服务进程数只需要覆盖网络 I/O（默认 2 个，一个重启时另一个继续服务），
+引擎工作进程按服务进程数平分 CPU 核心，避免超额订阅。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+worker_class = 'aiohttp.GunicornWebWorker'
+
+# 必须在导入 config 之前设置：每个服务进程各有一个引擎进程池
+os.environ.setdefault('ENGINE_MODE', 'process')
+os.environ.setdefault('ENGINE_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+from config import REQUEST_TIMEOUT  # noqa: E402
+
+# 请求最长处理 REQUEST_TIMEOUT 秒，超过后由准入控制返回 504，这里只兜底卡死的进程
+timeout = REQUEST_TIMEOUT * 2
+graceful_timeout = REQUEST_TIMEOUT
+keepalive = 5
+# 定期重启服务进程，限制内存碎片的累积
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
+errorlog = '-'
@@ -1,26 +1,56 @@
 import os
-import hashlib
-from datetime import datetime, timedelta
-from PIL import Image, ImageEnhance, ExifTags
+import io
+import re
+import math
+from PIL import Image
 import logging
+from functools import partial
 from config import *
+from admission import check_deadline, run_before_deadline
+from background import replace_background
+from encoder import encode, read_quality
+from engine import InlineEngine, create_engine, open_shared, share_bytes
+from geometry import (apply_geometry, compose_transposes, plan_geometry,
+                      plan_orientation, read_orientation)
+from ingest import new_hash
+from log_setup import forward_logging, request_log, worker_log_queue
+import metrics
+from memory_cache import MemoryCache
+from result_cache import ResultCache
+from sheet import compose_sheet, encode_sheet
+from singleflight import SingleFlight
+from spec import ProcessingSpec
+from tone import apply_tone
 
-# 配置日志
-logging.basicConfig(
-    filename=os.path.join(LOG_DIR, 'image_processor.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# 日志由入口（app.py、server.py、cli.py）调用 log_setup.configure_logging 配置，
+# 每个请求一条结构化记录，处理细节只在 DEBUG 级别输出
 logger = logging.getLogger('ImageProcessor')
 
+# 结果 ID：32 位源文件哈希 + 16 位处理参数缓存键 + 扩展名
+RESULT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}_[0-9a-f]{16}\.(jpg|png|webp)$')
+
 class ImageProcessor:
-    def __init__(self):
-        self.cleanup_cache()
+    def __init__(self, cache=None, engine=None):
+        # 缓存清理由服务进程调用 cache.start_sweeper() 在后台线程中进行，不阻塞构造；
+        # 共用缓存目录的各服务进程通过共享索引协调，每个清理间隔只有一个进程清理
+        self.cache = cache or ResultCache()
+        # 执行 CPU 密集处理的引擎（inline/thread/process）
+        if engine is None:
+            # 进程模式的工作进程把日志交给本进程写入
+            log_queue = worker_log_queue() if ENGINE_MODE == 'process' else None
+            engine = create_engine(ENGINE_MODE, ENGINE_WORKERS, partial(init_worker, log_queue))
+        self.engine = engine
+        # 几何阶段（方向、裁剪、缩放）的中间结果，调整亮度/对比度时无需重新解码
+        self.intermediates = MemoryCache(INTERMEDIATE_CACHE_MAX_BYTES)
+        # 相同源图片和处理参数的并发请求共享一次计算
+        self.flights = SingleFlight()
 
     @staticmethod
     def get_file_hash(file_data):
-        """计算文件的MD5哈希值"""
-        return hashlib.md5(file_data).hexdigest()
+        """计算文件的哈希值（BLAKE2b-128，与上传时增量计算的结果相同）"""
+        file_hash = new_hash()
+        file_hash.update(file_data)
+        return file_hash.hexdigest()
 
     @staticmethod
     def is_valid_file(filename, filesize):
@@ -30,189 +60,413 @@ class ImageProcessor:
                 filesize <= MAX_FILE_SIZE)
 
     def cleanup_cache(self):
-        """清理过期的缓存文件"""
-        try:
-            expiry = datetime.now() - timedelta(days=CACHE_EXPIRY_DAYS)
-            for filename in os.listdir(CACHE_DIR):
-                filepath = os.path.join(CACHE_DIR, filename)
-                if os.path.getctime(filepath) < expiry.timestamp():
-                    os.remove(filepath)
-        except Exception as e:
-            logger.error(f"Cache cleanup error: {str(e)}")
+        """立即清理过期和超出容量预算的缓存文件"""
+        self.cache.sweep()
+
+    @staticmethod
+    def get_result_id(file_hash, spec):
+        """结果 ID（即缓存文件名），由源文件哈希和处理参数的缓存键组成，内容不变"""
+        return f"{file_hash}_{spec.cache_key}.{spec.extension}"
+
+    def get_result_path(self, result_id):
+        """由结果 ID 得到缓存文件路径，ID 无效或文件不存在时返回 None"""
+        if not RESULT_ID_PATTERN.match(result_id):
+            return None
+        return self.cache.get(result_id)
+
+    def get_cached_image(self, file_hash, spec):
+        """获取缓存的图片（读入内存并关闭文件）
+
+        只在调用方需要 Image 对象时使用；HTTP 结果直接以文件发送，不经过解码。
+        """
+        with metrics.stage('cache_io'):
+            cache_path = self.cache.get(self.get_result_id(file_hash, spec))
+            if cache_path is None:
+                return None
+            image = Image.open(cache_path)
+            # 单帧图片 load() 后 Pillow 会关闭自己打开的文件
+            image.load()
+        return image
 
-    def get_cached_image(self, file_hash, size_name):
-        """获取缓存的图片"""
-        cache_path = os.path.join(CACHE_DIR, f"{file_hash}_{size_name}.jpg")
-        if os.path.exists(cache_path):
-            return Image.open(cache_path)
-        return None
+    @staticmethod
+    def encode_image(image, spec):
+        """按处理参数的输出格式编码图片，返回字节
+
+        指定 max_bytes 时查找满足字节数的最高质量，无法满足时抛出 encoder.TargetTooSmall。
+        """
+        with metrics.stage('encode'):
+            data = encode(image, spec).data
+        metrics.count('result_bytes', len(data))
+        return data
 
-    def cache_image(self, image, file_hash, size_name):
-        """缓存处理后的图片"""
+    def cache_image(self, image, file_hash, spec):
+        """缓存处理后的图片（原子写入）"""
+        data = self.encode_image(image, spec)
         try:
-            cache_path = os.path.join(CACHE_DIR, f"{file_hash}_{size_name}.jpg")
-            image.save(cache_path, quality=JPEG_QUALITY)
+            with metrics.stage('cache_io'):
+                self.cache.put(self.get_result_id(file_hash, spec), data)
         except Exception as e:
-            logger.error(f"Cache save error: {str(e)}")
+            logger.error("Cache save error: %s", e)
 
-    def compress_image(self, image):
-        """压缩大图片"""
-        if max(image.size) > max(INITIAL_COMPRESSION_SIZE):
-            image.thumbnail(INITIAL_COMPRESSION_SIZE, Image.Resampling.LANCZOS)
+    def result_info(self, result_id, spec):
+        """结果的字节数和编码质量，结果不存在时返回 None"""
+        path = self.cache.path(result_id)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        return {'bytes': size, 'quality': read_quality(path, spec)}
+
+    @staticmethod
+    def calculate_decode_scale(image_size, target_size, oversample=DECODE_OVERSAMPLE):
+        """计算解码时允许的最大整数缩小倍数
+
+        自动旋转后图片方向总与目标一致，因此居中裁剪区域相对目标尺寸的倍数为
+        长边比与短边比中的较小值；再除以 oversample 留出缩放余量。
+        """
+        long_ratio = max(image_size) / max(target_size)
+        short_ratio = min(image_size) / min(target_size)
+        return max(1, int(min(long_ratio, short_ratio) / oversample))
+
+    def open_image(self, image_file, target_sizes, oversample=DECODE_OVERSAMPLE):
+        """打开图片并在解码阶段按目标尺寸缩小，避免构建全分辨率图像
+
+        多个目标尺寸时以需要分辨率最高的尺寸为准。
+        """
+        image = Image.open(image_file)
+        scale = min(self.calculate_decode_scale(image.size, target_size, oversample)
+                    for target_size in target_sizes)
+        if scale == 1:
+            return image
+
+        if image.format == 'JPEG':
+            # JPEG 在 DCT 域按 1/2、1/4、1/8 缩放解码，draft 选取不小于请求尺寸的最小比例
+            requested = (math.ceil(image.width / scale), math.ceil(image.height / scale))
+            image.draft('RGB', requested)
+            logger.debug("JPEG draft decode: %s -> %s", requested, image.size)
+        else:
+            # 其他格式无法按比例解码，在任何转换和复制之前先缩小
+            if image.mode in ('1', 'P'):
+                image = image.convert('RGB')
+            image = image.reduce(scale)
+            logger.debug("Reduced image by factor %d: %s", scale, image.size)
         return image
 
+    def replace_background(self, image, background):
+        """替换背景色（background 为 None 时原样返回），在几何中间结果上进行"""
+        if background is None:
+            return image
+        with metrics.stage('background'):
+            return replace_background(image, background)
+
+    def finish_image(self, intermediate, spec):
+        """几何中间结果之后的阶段：替换背景、调整亮度和对比度"""
+        image = self.replace_background(intermediate, spec.background)
+        return self.adjust_image(image, spec.brightness, spec.contrast)
+
     def adjust_image(self, image, brightness=1.0, contrast=1.0):
-        """调整图片亮度和对比度"""
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(brightness)
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(contrast)
-        return image
+        """调整图片亮度和对比度（合成为一张查找表，一次 point 完成）"""
+        with metrics.stage('enhance'):
+            return apply_tone(image, brightness, contrast)
 
     @staticmethod
     def fix_image_orientation(image):
         """修复图片方向"""
         try:
-            # 复制图片以保留原始数据
-            image = image.copy()
-            original_size = image.size
-            logger.info(f"Original image size: {original_size}")
-            
-            if hasattr(image, '_getexif'):  # 只处理有EXIF信息的图片
-                exif = image._getexif()
-                if exif is not None:
-                    logger.info(f"EXIF data found")
-                    orientation_key = None
-                    for key, value in ExifTags.TAGS.items():
-                        if value == 'Orientation':
-                            orientation_key = key
-                            break
-                    
-                    if orientation_key is not None and orientation_key in exif:
-                        orientation = exif[orientation_key]
-                        logger.info(f"Found orientation: {orientation}")
-                        
-                        rotation_map = {
-                            2: [Image.Transpose.FLIP_LEFT_RIGHT],
-                            3: [Image.Transpose.ROTATE_180],
-                            4: [Image.Transpose.FLIP_TOP_BOTTOM],
-                            5: [Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.ROTATE_90],
-                            6: [Image.Transpose.ROTATE_270],
-                            7: [Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.ROTATE_270],
-                            8: [Image.Transpose.ROTATE_90]
-                        }
-                        
-                        if orientation in rotation_map:
-                            for operation in rotation_map[orientation]:
-                                image = image.transpose(operation)
-                                logger.info(f"Applied transformation: {operation}")
-                    else:
-                        logger.info("No orientation data in EXIF")
-                else:
-                    logger.info("No EXIF data found")
-            else:
-                logger.info("Image does not support EXIF")
-            
-            # 检查处理后的尺寸是否发生变化
-            final_size = image.size
-            logger.info(f"Final image size: {final_size}")
-            
-            # 如果宽高比发生了变化（可能是不当的旋转导致），尝试修正
-            orig_ratio = original_size[0] / original_size[1]
-            final_ratio = final_size[0] / final_size[1]
-            
-            if abs(orig_ratio - final_ratio) > 0.01:  # 允许一点点误差
-                logger.warning(f"Aspect ratio changed significantly: {orig_ratio:.2f} -> {final_ratio:.2f}")
-                # 如果宽高比发生显著变化，可能需要额外的旋转修正
-                if final_ratio < 1 and orig_ratio > 1:  # 如果图片变得太窄
-                    image = image.transpose(Image.Transpose.ROTATE_90)
-                    logger.info("Applied additional 90 degree rotation to correct aspect ratio")
-            
-            return image
-            
+            orientation = read_orientation(image)
+            transpose = compose_transposes(plan_orientation(image.size, orientation))
+            logger.debug("Orientation: %s, transform: %s", orientation, transpose)
+            if transpose is None:
+                return image.copy()
+            return image.transpose(transpose)
+
         except Exception as e:
-            logger.error(f"Error fixing image orientation: {str(e)}")
+            logger.error("Error fixing image orientation: %s", e)
             # 如果出错，返回原始图片
             return image.copy()
 
-    def process_image(self, image_file, size_name, brightness=1.0, contrast=1.0):
-        """处理图片的主要方法"""
-        try:
-            # 计算文件哈希
-            file_data = image_file.read()
-            file_hash = self.get_file_hash(file_data)
-            image_file.seek(0)
+    def estimate_memory(self, upload, target_sizes, oversample=DECODE_OVERSAMPLE):
+        """由上传时解析的文件头估算处理时解码图片占用的内存（字节）加上传内容大小"""
+        header = upload.header
+        width, height = header.size
+        bands = max(3, header.bands)
+        scale = min(self.calculate_decode_scale(header.size, target_size, oversample)
+                    for target_size in target_sizes)
+        if header.format == 'JPEG':
+            # draft 只能按 1/2、1/4、1/8 缩放
+            scale = min(8, 1 << (scale.bit_length() - 1))
+        return math.ceil(width / scale) * math.ceil(height / scale) * bands + len(upload)
+
+    def decode_image(self, image_file, target_sizes, oversample=DECODE_OVERSAMPLE):
+        """解码源图片一次，返回 RGB 图片和 EXIF 方向，供各目标尺寸共用"""
+        with metrics.stage('decode'):
+            image = self.open_image(image_file, target_sizes, oversample)
+            # Image.open 是惰性的，在这里完成解码，解码耗时不计入后续阶段
+            image.load()
+            logger.debug("Original image mode: %s, size: %s", image.mode, image.size)
+
+            # 在转换前读取 EXIF 方向，方向修正与缩放在 render_geometry 中一并完成
+            orientation = read_orientation(image)
 
-            # 检查缓存
-            cached_image = self.get_cached_image(file_hash, size_name)
-            if cached_image:
-                logger.info(f"Cache hit for {file_hash}_{size_name}")
-                return cached_image
-
-            # 处理图片
-            image = Image.open(image_file)
-            logger.info(f"Original image mode: {image.mode}, size: {image.size}")
-            
             # 转换为RGB模式（如果不是的话）
             if image.mode != 'RGB':
                 image = image.convert('RGB')
-                logger.info("Converted image to RGB mode")
-            
-            # 修复图片方向
-            image = self.fix_image_orientation(image)
-            logger.info(f"After orientation fix - size: {image.size}")
-            
-            # 获取目标尺寸
-            target_width, target_height = PHOTO_SIZES[size_name]
-            logger.info(f"Target size: {target_width}x{target_height}")
-            
-            # 压缩大图片
-            original_size = image.size
-            image = self.compress_image(image)
-            if original_size != image.size:
-                logger.info(f"Image compressed from {original_size} to {image.size}")
-            
-            # 计算裁剪尺寸
-            original_ratio = image.width / image.height
-            target_ratio = target_width / target_height
-            logger.info(f"Original ratio: {original_ratio:.2f}, Target ratio: {target_ratio:.2f}")
-            
-            # 如果原始图片和目标方向不一致，进行旋转
-            is_original_portrait = image.height > image.width
-            is_target_portrait = target_height > target_width
-            
-            if is_original_portrait != is_target_portrait:
-                logger.info("Rotating image to match target orientation")
-                # 使用ROTATE_270代替ROTATE_90来避免上下颠倒
-                image = image.transpose(Image.Transpose.ROTATE_270)
-                # 重新计算比例
-                original_ratio = image.width / image.height
-            
-            if original_ratio > target_ratio:
-                new_width = int(image.height * target_ratio)
-                left = (image.width - new_width) // 2
-                image = image.crop((left, 0, left + new_width, image.height))
-                logger.info(f"Cropped width to: {new_width}")
-            else:
-                new_height = int(image.width / target_ratio)
-                top = (image.height - new_height) // 2
-                image = image.crop((0, top, image.width, top + new_height))
-                logger.info(f"Cropped height to: {new_height}")
-            
-            # 调整到目标尺寸
-            image = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            logger.info(f"Resized to target: {image.size}")
-            
-            # 调整亮度和对比度
-            image = self.adjust_image(image, brightness, contrast)
-            
-            # 缓存处理后的图片
-            self.cache_image(image, file_hash, size_name)
-            
-            return image
+                logger.debug("Converted image to RGB mode")
+        metrics.count('decoded_megapixels', image.width * image.height / 1e6)
+        return image, orientation
+
+    def render_geometry(self, image, orientation, target_size, resample=Image.Resampling.LANCZOS):
+        """从解码后的图片生成目标尺寸的几何中间结果（尚未调整亮度和对比度）"""
+        # 方向修正、自动旋转、居中裁剪和缩放合成为一次带裁剪框的缩放，加至多一次变换
+        plan = plan_geometry(image.size, orientation, target_size)
+        logger.debug("Geometry plan: orientation=%s, box=%s, resize=%s, transpose=%s",
+                     orientation, plan.box, plan.resize_size, plan.transpose)
+        return apply_geometry(image, plan, resample)
+
+    def hash_file(self, image_file):
+        """分块计算上传文件的哈希并把读取位置复位"""
+        file_hash = new_hash()
+        while chunk := image_file.read(UPLOAD_CHUNK_SIZE):
+            file_hash.update(chunk)
+        image_file.seek(0)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def build_specs(sizes, brightness=1.0, contrast=1.0):
+        """把 ProcessingSpec、尺寸名称或 (宽, 高) 统一为处理参数列表"""
+        return [size if isinstance(size, ProcessingSpec)
+                else ProcessingSpec.create(size, brightness, contrast)
+                for size in sizes]
+
+    def render_geometries(self, image_file, file_hash, geometry_keys):
+        """返回 {几何参数: 几何中间结果}
+
+        中间结果按 (源文件哈希, 几何参数) 保存在内存中，缺少的共用一次解码生成；
+        缺少且没有 image_file 时抛出 KeyError。预览使用刚好覆盖输出尺寸的解码比例和双线性缩放。
+        """
+        intermediates = {key: self.intermediates.get((file_hash, key)) for key in geometry_keys}
+        missing = [key for key, intermediate in intermediates.items() if intermediate is None]
+        if missing:
+            if image_file is None:
+                raise KeyError(f"Source {file_hash} is no longer available for {missing}")
+            all_preview = all(preview for _, preview in missing)
+            image, orientation = self.decode_image(
+                image_file, [size for size, _ in missing],
+                PREVIEW_OVERSAMPLE if all_preview else DECODE_OVERSAMPLE)
+            for key in missing:
+                size, preview = key
+                resample = Image.Resampling.BILINEAR if preview else Image.Resampling.LANCZOS
+                intermediates[key] = self.render_geometry(image, orientation, size, resample)
+                self.intermediates.put((file_hash, key), intermediates[key])
+        return intermediates
+
+    def render_specs(self, image_file, file_hash, specs):
+        """在当前线程中生成全部处理参数的结果并写入缓存，返回 {处理参数: 图片}
+
+        几何中间结果都在内存中时不再解码源图片，只做亮度/对比度调整和编码。
+        """
+        try:
+            logger.debug("Processing specs: %s", specs)
+            intermediates = self.render_geometries(image_file, file_hash, [spec.geometry_key for spec in specs])
+
+            results = {}
+            for spec in specs:
+                # 替换背景，调整亮度和对比度
+                results[spec] = self.finish_image(intermediates[spec.geometry_key], spec)
+                # 缓存处理后的图片
+                self.cache_image(results[spec], file_hash, spec)
+            return results
 
         except Exception as e:
-            logger.error(f"Image processing error: {str(e)}")
-            raise 
\ No newline at end of file
+            logger.error("Image processing error: %s", e)
+            raise
+
+    def render_in_worker(self, image_file, file_hash, specs, deadline=None):
+        """进程模式：上传内容经共享内存交给工作进程，工作进程返回编码后的结果和几何中间结果"""
+        file_data = image_file.read()
+        image_file.seek(0)
+        block = share_bytes(file_data)
+        try:
+            encoded, geometries, timings = self.engine.submit(
+                run_before_deadline, deadline,
+                render_shared, block.name, len(file_data), file_hash, specs).result()
+        finally:
+            block.close()
+            block.unlink()
+        # 工作进程中的阶段耗时和计数计入本进程的指标
+        metrics.merge(timings)
+
+        for key, (mode, size, pixels) in geometries.items():
+            self.intermediates.put((file_hash, key), Image.frombytes(mode, size, pixels))
+        results = {}
+        for spec, data in encoded.items():
+            with metrics.stage('cache_io'):
+                self.cache.put(self.get_result_id(file_hash, spec), data)
+            results[spec] = Image.open(io.BytesIO(data))
+        return results
+
+    def render_in_engine(self, image_file, file_hash, specs, deadline=None):
+        """在执行引擎中生成结果；任务开始执行时已超过 deadline 则直接放弃"""
+        check_deadline(deadline)
+        if self.engine.mode != 'process':
+            return self.engine.submit(
+                run_before_deadline, deadline, self.render_specs, image_file, file_hash, specs).result()
+        if image_file is None:
+            # 只需调整亮度/对比度和编码，直接在当前线程中完成
+            return self.render_specs(None, file_hash, specs)
+        return self.render_in_worker(image_file, file_hash, specs, deadline)
+
+    def render_once(self, image_file, file_hash, specs, deadline=None):
+        """合并相同 (源文件哈希, 处理参数) 的并发计算，只有第一个请求真正交给执行引擎"""
+        return self.flights.do((file_hash, tuple(specs)), self.render_in_engine,
+                               image_file, file_hash, specs, deadline)
+
+    def process_specs(self, image_file, file_hash, specs):
+        """按处理参数生成结果，返回 {处理参数: 图片}，未命中缓存的结果共用一次解码"""
+        with request_log(logger, 'process', source=file_hash,
+                         sizes=[spec.size_name for spec in specs]) as record:
+            # 检查缓存
+            results = {}
+            for spec in specs:
+                cached_image = self.get_cached_image(file_hash, spec)
+                if cached_image:
+                    results[spec] = cached_image
+            record['cached'] = len(results)
+
+            pending = [spec for spec in specs if spec not in results]
+            if pending:
+                results.update(self.render_once(image_file, file_hash, pending))
+            return results
+
+    def process_many(self, image_file, sizes, brightness=1.0, contrast=1.0):
+        """一次上传生成多个结果，返回 {尺寸名称: 图片}
+
+        sizes 中每项为 ProcessingSpec、PHOTO_SIZES 中的名称或 (宽, 高)；
+        后两者使用 brightness/contrast 创建处理参数。
+        """
+        specs = self.build_specs(sizes, brightness, contrast)
+        results = self.process_specs(image_file, self.hash_file(image_file), specs)
+        return {spec.size_name: results[spec] for spec in specs}
+
+    def process_image(self, image_file, size, brightness=1.0, contrast=1.0):
+        """处理图片的主要方法，size 为 ProcessingSpec、尺寸名称或 (宽, 高)"""
+        results = self.process_many(image_file, [size], brightness, contrast)
+        return next(iter(results.values()))
+
+    def collect_results(self, image_file, file_hash, specs, deadline=None):
+        """确保每个处理参数的结果都在缓存中，返回 {尺寸名称: 结果 ID}"""
+        with request_log(logger, 'results', source=file_hash, sizes=[spec.size_name for spec in specs],
+                         readjust=image_file is None) as record:
+            # 命中缓存的结果只检查文件是否存在，不打开也不解码
+            with metrics.stage('cache_io'):
+                pending = [spec for spec in specs
+                           if self.cache.get(self.get_result_id(file_hash, spec)) is None]
+            record['cached'] = len(specs) - len(pending)
+            if pending:
+                self.render_once(image_file, file_hash, pending, deadline)
+
+            result_ids = {}
+            for spec in specs:
+                result_id = self.get_result_id(file_hash, spec)
+                if not self.cache.contains(result_id):
+                    raise IOError(f"Result was not cached: {result_id}")
+                result_ids[spec.size_name] = result_id
+            return result_ids
+
+    def process_results(self, image_file, sizes, brightness=1.0, contrast=1.0, deadline=None):
+        """处理图片并返回 {尺寸名称: 结果 ID}，结果文件通过 get_result_path 读取
+
+        deadline 为 time.time() 时间戳，开始处理前已过期时抛出 DeadlineExceeded。
+        在 metrics.record_timings() 中调用时，返回后可从计时记录读取本次各阶段的耗时。
+        """
+        check_deadline(deadline)
+        file_hash = self.hash_file(image_file)
+        specs = self.build_specs(sizes, brightness, contrast)
+        return self.collect_results(image_file, file_hash, specs, deadline)
+
+    def process_upload(self, upload, sizes, brightness=1.0, contrast=1.0, deadline=None):
+        """处理 ingest 接收的上传：哈希已在接收时计算，解码器直接读取内存中的内容"""
+        check_deadline(deadline)
+        specs = self.build_specs(sizes, brightness, contrast)
+        return self.collect_results(upload.open(), upload.file_hash, specs, deadline)
+
+    def estimate_sheet_memory(self, upload, sheet):
+        """排版占用的内存：画布，加上需要解码时的源图片（upload 为 None 时只用已有的结果）"""
+        width, height = sheet.canvas_size
+        cost = width * height * 3
+        if upload is not None:
+            cost += self.estimate_memory(upload, [spec.output_size for spec in sheet.tile_specs])
+        return cost
+
+    def render_sheet(self, image_file, file_hash, sheet, deadline=None):
+        """生成排版并写入缓存：每个尺寸的照片由 collect_results 生成或命中缓存，只读取一次"""
+        specs = sheet.tile_specs
+        self.collect_results(image_file, file_hash, specs, deadline)
+        tiles = {}
+        for spec in specs:
+            tiles[spec] = self.get_cached_image(file_hash, spec)
+            if tiles[spec] is None:
+                raise IOError(f"Result was not cached: {self.get_result_id(file_hash, spec)}")
+        with metrics.stage('compose'):
+            image = compose_sheet(sheet, tiles)
+        with metrics.stage('encode'):
+            data = encode_sheet(image, sheet)
+        metrics.count('result_bytes', len(data))
+        with metrics.stage('cache_io'):
+            self.cache.put(self.get_result_id(file_hash, sheet), data)
+
+    def process_sheet(self, image_file, file_hash, sheet, deadline=None):
+        """生成冲印排版，返回结果 ID
+
+        image_file 为 None 时只使用已缓存的结果或内存中的几何中间结果，都不可用时抛出 KeyError。
+        """
+        check_deadline(deadline)
+        with request_log(logger, 'sheet', source=file_hash, paper=sheet.paper,
+                         sizes=[spec.size_name for spec, _ in sheet.items]) as record:
+            result_id = self.get_result_id(file_hash, sheet)
+            with metrics.stage('cache_io'):
+                record['cached'] = self.cache.get(result_id) is not None
+            if not record['cached']:
+                self.flights.do((file_hash, sheet), self.render_sheet, image_file, file_hash, sheet, deadline)
+            return result_id
+
+    def readjust_results(self, file_hash, sizes, brightness=1.0, contrast=1.0, deadline=None):
+        """不重新上传，基于内存中的几何中间结果按新的亮度/对比度生成结果
+
+        返回 {尺寸名称: 结果 ID}；中间结果已被淘汰时抛出 KeyError，调用方需要重新上传。
+        """
+        check_deadline(deadline)
+        specs = self.build_specs(sizes, brightness, contrast)
+        return self.collect_results(None, file_hash, specs, deadline)
+
+
+# 进程模式下每个工作进程内的处理器
+_worker_processor = None
+
+def init_worker(log_queue=None):
+    """进程池工作进程初始化：创建本进程内使用的处理器，几何中间结果由主进程保存
+
+    log_queue 为主进程的 log_setup.worker_log_queue()，日志经它交给主进程写入。
+    """
+    global _worker_processor
+    forward_logging(log_queue)
+    _worker_processor = ImageProcessor(engine=InlineEngine())
+    _worker_processor.intermediates = MemoryCache(0)
+
+def render_shared(name, length, file_hash, specs):
+    """工作进程入口：从共享内存读取上传内容并生成结果
+
+    返回 ({处理参数: 编码后的字节}, {几何参数: (模式, 尺寸, 像素字节)}, 计时记录)。
+    """
+    processor = _worker_processor
+    with metrics.record_timings() as timings:
+        with open_shared(name, length) as image_file:
+            intermediates = processor.render_geometries(
+                image_file, file_hash, [spec.geometry_key for spec in specs])
+
+        encoded = {}
+        for spec in specs:
+            image = processor.finish_image(intermediates[spec.geometry_key], spec)
+            encoded[spec] = processor.encode_image(image, spec)
+    geometries = {key: (image.mode, image.size, image.tobytes()) for key, image in intermediates.items()}
+    return encoded, geometries, timings
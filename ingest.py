@@ -0,0 +1,141 @@
+import io
+import hashlib
+from dataclasses import dataclass
+from PIL import Image
+from config import MAX_FILE_SIZE, MAX_IMAGE_PIXELS, HEADER_PROBE_BYTES, UPLOAD_CHUNK_SIZE
+from geometry import read_orientation
+import metrics
+
+# 文件头魔数 → Pillow 格式名
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+MAGIC_LENGTH = max(len(magic) for magic, _ in MAGIC_NUMBERS)
+
+
+class InvalidImage(ValueError):
+    """上传内容不是受支持的图片，或像素数超过限制"""
+
+
+class ImageTooLarge(InvalidImage):
+    """文件或图片像素数超过限制"""
+
+
+def new_hash():
+    """源文件哈希：BLAKE2b，128 位摘要（32 个十六进制字符，与源图片 ID 格式一致）"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def sniff_format(head):
+    """按文件头魔数识别格式，无法识别时返回 None"""
+    for magic, image_format in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return image_format
+    return None
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+    """只解析文件头得到的图片信息，不解码像素"""
+    format: str
+    size: tuple
+    mode: str
+    orientation: int
+
+    @property
+    def pixels(self):
+        return self.size[0] * self.size[1]
+
+    @property
+    def bands(self):
+        return Image.getmodebands(self.mode)
+
+
+def read_header(data, max_pixels=MAX_IMAGE_PIXELS):
+    """解析格式、尺寸、模式和 EXIF 方向，像素数超过 max_pixels 时抛出 InvalidImage"""
+    image_format = sniff_format(bytes(data[:MAGIC_LENGTH]))
+    if image_format is None:
+        raise InvalidImage('Unsupported file signature')
+    try:
+        # Image.open 只读取文件头，像素数据在 load() 时才解码
+        with Image.open(io.BytesIO(data), formats=[image_format]) as image:
+            header = ImageHeader(image.format, image.size, image.mode, read_orientation(image))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+    except (OSError, SyntaxError) as e:
+        raise InvalidImage(f'Unreadable {image_format} header: {e}') from e
+    if header.pixels > max_pixels:
+        raise ImageTooLarge(f'Image too large: {header.size[0]}x{header.size[1]}')
+    return header
+
+
+@dataclass(frozen=True)
+class IngestedImage:
+    """接收完成的上传：内容、源文件哈希和文件头信息"""
+    data: bytes
+    file_hash: str
+    header: ImageHeader
+
+    def open(self):
+        """以文件对象读取上传内容；BytesIO 直接共享 bytes 的缓冲区，不复制"""
+        return io.BytesIO(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class UploadIngest:
+    """边接收边处理上传：增量计算哈希，收到文件头后立即检查格式和像素数
+
+    无效的上传在收到前几十 KB 时就被拒绝，不必读取完整请求体。
+    """
+
+    def __init__(self, max_bytes=MAX_FILE_SIZE, max_pixels=MAX_IMAGE_PIXELS):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.size = 0
+        self.header = None
+        self._hash = new_hash()
+        self._chunks = []
+
+    def write(self, chunk):
+        """追加一块上传内容，无效时抛出 InvalidImage"""
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ImageTooLarge(f'Upload exceeds {self.max_bytes} bytes')
+        self._hash.update(chunk)
+        self._chunks.append(bytes(chunk))
+        if self.header is None and self.size - len(chunk) < HEADER_PROBE_BYTES:
+            self._probe()
+
+    def _probe(self):
+        """用已收到的内容尝试解析文件头"""
+        head = b''.join(self._chunks)
+        if len(head) >= MAGIC_LENGTH and sniff_format(head[:MAGIC_LENGTH]) is None:
+            raise InvalidImage('Unsupported file signature')
+        try:
+            self.header = read_header(head, self.max_pixels)
+        except ImageTooLarge:
+            raise
+        except InvalidImage:
+            # 文件头可能还没有收完，接收完成后再确定是否有效
+            pass
+
+    def finish(self):
+        """结束接收，返回 IngestedImage；拼接是唯一一次复制，之后交给解码器不再复制"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        header = self.header or read_header(data, self.max_pixels)
+        metrics.count('upload_bytes', self.size)
+        return IngestedImage(data, self._hash.hexdigest(), header)
+
+
+def ingest_stream(stream, max_bytes=MAX_FILE_SIZE, chunk_size=UPLOAD_CHUNK_SIZE):
+    """按块读取文件对象（上传流、本地文件），返回 IngestedImage"""
+    ingest = UploadIngest(max_bytes)
+    while chunk := stream.read(chunk_size):
+        ingest.write(chunk)
+    return ingest.finish()
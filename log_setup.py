@@ -0,0 +1,133 @@
+"""日志配置：请求线程只把记录放入队列，由后台线程格式化并写入按大小轮转的文件
+
+进程池的工作进程通过 worker_log_queue() 返回的跨进程队列把记录交给主进程写入，
+不会有多个进程同时轮转同一个文件。
+
+每个请求的处理细节合并为一条 JSON 记录（request_log），按 LOG_SAMPLE_RATE 采样，
+JSON 在写日志的后台线程中才序列化。
+"""
+import json
+import time
+import atexit
+import random
+import logging
+import queue
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import metrics
+from engine import process_context
+from config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_SAMPLE_RATE
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_file_handler = None
+_listeners = []
+_worker_queue = None
+
+
+class JsonMessage:
+    """结构化日志消息：字段在记录时收集，序列化推迟到格式化时"""
+    __slots__ = ('fields', 'timings')
+
+    def __init__(self, fields, timings=None):
+        self.fields = fields
+        self.timings = timings
+
+    def as_dict(self):
+        if self.timings is None:
+            return self.fields
+        return dict(self.fields, stages_ms=self.timings.as_dict(), counts=self.timings.counts)
+
+    def __str__(self):
+        return json.dumps(self.as_dict(), ensure_ascii=False, default=str)
+
+
+class JsonFormatter(logging.Formatter):
+    """JsonMessage 记录输出为一行 JSON，其他记录使用文本格式"""
+
+    def format(self, record):
+        if isinstance(record.msg, JsonMessage):
+            entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name}
+            entry.update(record.msg.as_dict())
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        return super().format(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """进程内队列：记录原样入队，消息由后台线程格式化
+
+    标准 QueueHandler 在调用线程中格式化消息以便跨进程传递；同一进程内无需如此。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(path=LOG_FILE, level=LOG_LEVEL):
+    """配置本进程的根日志器，重复调用不会重复添加处理器"""
+    global _file_handler
+    if _file_handler is not None:
+        return
+    _file_handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                        encoding='utf-8', delay=True)
+    _file_handler.setFormatter(JsonFormatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    start_listener(log_queue)
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    atexit.register(stop_logging)
+
+
+def start_listener(log_queue):
+    listener = QueueListener(log_queue, _file_handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def worker_log_queue():
+    """供进程池工作进程使用的跨进程日志队列；本进程未配置日志时返回 None"""
+    global _worker_queue
+    if _file_handler is not None and _worker_queue is None:
+        _worker_queue = process_context().Queue()
+        start_listener(_worker_queue)
+    return _worker_queue
+
+
+def forward_logging(log_queue, level=LOG_LEVEL):
+    """工作进程初始化时调用：日志记录全部交给主进程写入"""
+    if log_queue is None:
+        return
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+
+def stop_logging():
+    """写完队列中剩余的记录并停止后台线程"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def sampled(rate=LOG_SAMPLE_RATE):
+    return rate >= 1 or random.random() < rate
+
+
+@contextmanager
+def request_log(logger, event, rate=LOG_SAMPLE_RATE, **fields):
+    """一次请求的结构化日志：with 块内收集字段和各阶段耗时，结束时输出一条 JSON 记录
+
+    成功的请求按 rate 采样，失败的请求总是以 WARNING 记录。with 块可向返回的字典中添加字段。
+    """
+    start = time.perf_counter()
+    with metrics.record_timings() as timings:
+        try:
+            yield fields
+        except Exception as e:
+            fields['error'] = f'{type(e).__name__}: {e}'
+            fields['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            logger.warning(JsonMessage(dict(event=event, **fields), timings))
+            raise
+    if logger.isEnabledFor(logging.INFO) and sampled(rate):
+        fields['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        logger.info(JsonMessage(dict(event=event, **fields), timings))
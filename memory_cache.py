@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+
+def image_nbytes(image):
+    """估算图片占用的内存字节数"""
+    return image.width * image.height * len(image.getbands())
+
+
+class MemoryCache:
+    """按字节预算限制容量的内存 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_bytes, sizeof=image_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """取出缓存项并标记为最近使用，不存在时返回 None"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        """放入缓存项，超出预算时淘汰最久未使用的项；单项超过预算时不缓存"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            self._items[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """命中、未命中、淘汰次数和当前容量"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._items),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,182 @@
+"""处理阶段计时和 Prometheus 文本格式的指标
+
+stage() 计时一个处理阶段：耗时计入本进程的直方图，同时累加到当前调用的计时记录。
+record_timings() 为一次调用创建计时记录（Timings），记录沿 contextvars 传递，
+线程引擎提交任务时复制上下文，进程引擎的工作进程返回自己的记录由 merge() 合并。
+
+每个服务进程有各自的指标，gunicorn 多进程部署时按进程分别抓取。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 阶段耗时直方图的桶上限（秒）
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 计数器：名称 → 说明
+COUNTERS = {
+    'upload_bytes': '接收的上传内容字节数',
+    'result_bytes': '编码生成的结果字节数',
+    'decoded_megapixels': '解码的像素数（百万），按解码时缩小后的尺寸计',
+}
+
+
+class Histogram:
+    """固定桶的累计直方图，线程安全"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """返回 ([(桶上限, 累计次数)], 总和, 次数)，最后一个桶上限为 +Inf"""
+        with self._lock:
+            cumulative, total = [], 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                total += count
+                cumulative.append((bound, total))
+            return cumulative, self.sum, self.count
+
+
+class Timings:
+    """一次调用的计时记录：{阶段: 累计耗时（秒）} 和 {计数器: 增量}"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def as_dict(self):
+        """各阶段耗时（毫秒），用于日志和 JSON"""
+        return {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+
+
+_stage_histograms = {}
+_counters = dict.fromkeys(COUNTERS, 0)
+_lock = threading.Lock()
+_current = ContextVar('timings', default=None)
+
+
+def observe_stage(name, seconds):
+    """把一个阶段的耗时计入直方图和当前调用的计时记录"""
+    histogram = _stage_histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _stage_histograms.setdefault(name, Histogram())
+    histogram.observe(seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add_stage(name, seconds)
+
+
+def count(name, value):
+    """累加计数器和当前调用的计时记录"""
+    with _lock:
+        _counters[name] += value
+    timings = _current.get()
+    if timings is not None:
+        timings.add_count(name, value)
+
+
+@contextmanager
+def stage(name):
+    """计时一个处理阶段；出错的阶段同样计时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def record_timings():
+    """为 with 块内的调用创建计时记录；嵌套时内层记录的内容在退出时累加到外层"""
+    parent = _current.get()
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            for name, seconds in timings.stages.items():
+                parent.add_stage(name, seconds)
+            for name, value in timings.counts.items():
+                parent.add_count(name, value)
+
+
+def merge(timings):
+    """合并其他进程返回的计时记录：计入本进程的直方图、计数器和当前调用的记录"""
+    for name, seconds in timings.stages.items():
+        observe_stage(name, seconds)
+    for name, value in timings.counts.items():
+        count(name, value)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=()):
+    """以 Prometheus 文本格式（0.0.4）输出本进程的指标
+
+    gauges 为 [(名称, 说明, 数值)]，由调用方在抓取时读取（缓存命中率、队列深度等）。
+    """
+    lines = [
+        '# HELP photo_stage_duration_seconds 各处理阶段的耗时',
+        '# TYPE photo_stage_duration_seconds histogram',
+    ]
+    with _lock:
+        histograms = sorted(_stage_histograms.items())
+        counters = dict(_counters)
+    for name, histogram in histograms:
+        buckets, total, observations = histogram.snapshot()
+        for bound, cumulative in buckets:
+            lines.append(f'photo_stage_duration_seconds_bucket{{stage="{name}",le="{format_value(bound)}"}} '
+                         f'{cumulative}')
+        lines.append(f'photo_stage_duration_seconds_sum{{stage="{name}"}} {format_value(total)}')
+        lines.append(f'photo_stage_duration_seconds_count{{stage="{name}"}} {observations}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP photo_{name}_total {help_text}',
+                  f'# TYPE photo_{name}_total counter',
+                  f'photo_{name}_total {format_value(counters[name])}']
+    for name, help_text, value in gauges:
+        lines += [f'# HELP photo_{name} {help_text}',
+                  f'# TYPE photo_{name} gauge',
+                  f'photo_{name} {format_value(value)}']
+    return '\n'.join(lines) + '\n'
+
+
+def service_gauges(processor, admission, executor):
+    """服务抓取时读取的瞬时指标：缓存命中率、排队请求数和进行中的请求"""
+    cache = processor.cache.stats()
+    inflight = admission.stats()
+    return [
+        ('cache_hit_ratio', '结果缓存命中率', cache['hit_ratio']),
+        ('queue_depth', '等待请求线程池空闲线程的请求数', executor._work_queue.qsize()),
+        ('inflight_requests', '通过准入控制、正在处理的请求数', inflight['inflight']),
+        ('inflight_memory_bytes', '进行中的请求预计占用的内存', inflight['memory']),
+    ]
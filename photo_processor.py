@@ -1,27 +1,121 @@
 import sys
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, 
                             QVBoxLayout, QHBoxLayout, QWidget, QComboBox, 
-                            QFileDialog, QMessageBox, QFrame)
-from PyQt6.QtCore import Qt
+                            QFileDialog, QMessageBox, QFrame, QProgressBar)
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt6.QtGui import QImage, QPixmap, QFont, QIcon
-from PIL import Image
 import os
+from cli import collect_sources, output_path
+from config import ALLOWED_EXTENSIONS, ENGINE_WORKERS, PHOTO_SIZES
+from engine import InlineEngine
+from image_processor import ImageProcessor
+from ingest import ingest_stream
+from spec import ProcessingSpec
+
+# Pillow 模式 → (tobytes 的 raw 模式, QImage 格式)
+# RGB 在 Pillow 内部按每像素 4 字节存储，以 RGBX 取出是逐行内存复制，不需要重新打包
+QIMAGE_FORMATS = {
+    'RGB': ('RGBX', QImage.Format.Format_RGBX8888),
+    'RGBA': ('RGBA', QImage.Format.Format_RGBA8888),
+    'L': ('L', QImage.Format.Format_Grayscale8),
+}
+
+# 背景颜色选项 → ProcessingSpec 的 background
+BACKGROUND_CHOICES = {
+    '原背景': None,
+    '白色': 'white',
+    '蓝色': 'blue',
+    '红色': 'red',
+}
+
+
+def image_buffer(image):
+    """把 Pillow 图片转为 QImage 可以直接引用的像素缓冲区
+
+    返回 (字节, 宽, 高, 每行字节数, QImage 格式)。调色板、CMYK 等模式先转换为 RGB，
+    带透明度的转换为 RGBA。
+    """
+    if image.mode not in QIMAGE_FORMATS:
+        transparent = image.mode in ('LA', 'PA', 'RGBa') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+    raw_mode, image_format = QIMAGE_FORMATS[image.mode]
+    data = image.tobytes('raw', raw_mode)
+    return data, image.width, image.height, len(data) // image.height, image_format
+
+
+def render_preview(processor, path, spec):
+    """在工作线程中生成预览（解码时按预览尺寸缩小）并转为像素缓冲区
+
+    预览只用于显示，不写入磁盘上的结果缓存；几何中间结果保存在内存中，切换背景时不重新解码。
+    """
+    with open(path, 'rb') as f:
+        file_hash = processor.hash_file(f)
+        intermediate = processor.render_geometries(f, file_hash, [spec.geometry_key])[spec.geometry_key]
+    return image_buffer(processor.finish_image(intermediate, spec))
+
+
+def save_result(processor, path, spec, save_path):
+    """在工作线程中处理一张图片并把缓存的结果复制到 save_path"""
+    with open(path, 'rb') as f:
+        upload = ingest_stream(f)
+    result_ids = processor.process_upload(upload, [spec])
+    os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+    processor.cache.export(result_ids[spec.size_name], save_path)
+    return save_path
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class Task(QRunnable):
+    """在 QThreadPool 中执行 fn(*args)，结果或错误通过信号交回 UI 线程"""
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+        # 由 PhotoProcessor 持有引用，线程池执行完毕后不删除底层对象，取消时可以安全地调用 tryTake
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
 
 class PhotoProcessor(QMainWindow):
     def __init__(self):
         super().__init__()
         
-        # 预设尺寸（宽x高，单位：像素）
+        # 预设尺寸：显示名称 → PHOTO_SIZES 中的名称
         self.sizes = {
-            "一寸（295x413）": (295, 413),
-            "二寸（413x579）": (413, 579),
-            "小一寸（260x378）": (260, 378),
-            "护照（330x420）": (330, 420),
-            "身份证（358x441）": (358, 441)
+            f"{name}（{width}x{height}）": name
+            for name, (width, height) in PHOTO_SIZES.items()
         }
-        
-        self.image_path = None
+
+        # 处理在线程池中同步执行，与服务共用结果缓存
+        self.processor = ImageProcessor(engine=InlineEngine())
+        # 与服务一样在后台写入访问记录并淘汰过期结果
+        self.processor.cache.start_sweeper()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(ENGINE_WORKERS)
+        # 已提交、尚未完成的任务，保持引用直到信号处理完毕
+        self.tasks = set()
+
+        # [(源文件路径, 相对路径)]，相对路径决定批量输出的目录结构
+        self.sources = []
         self.preview_pixmap = None
+        # 每次请求预览递增，忽略过时的预览结果
+        self.preview_generation = 0
+        self.batch_total = 0
+        self.batch_done = 0
+        self.batch_failures = []
+        self.batch_tasks = []
         
         # 移到最后调用
         self.initUI()
@@ -78,20 +172,40 @@ class PhotoProcessor(QMainWindow):
         title_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(title_label)
 
-        # 选择图片按钮
+        # 选择图片（可多选）或整个文件夹
+        select_layout = QHBoxLayout()
         self.select_btn = QPushButton('选择图片')
         self.select_btn.clicked.connect(self.select_image)
-        layout.addWidget(self.select_btn, alignment=Qt.AlignmentFlag.AlignCenter)
+        select_layout.addWidget(self.select_btn)
+        self.select_folder_btn = QPushButton('选择文件夹')
+        self.select_folder_btn.clicked.connect(self.select_folder)
+        select_layout.addWidget(self.select_folder_btn)
+        layout.addLayout(select_layout)
+
+        self.source_label = QLabel('未选择图片')
+        self.source_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.source_label)
 
         # 尺寸选择
         size_layout = QHBoxLayout()
         size_label = QLabel('选择尺寸:')
         self.size_combo = QComboBox()
         self.size_combo.addItems(self.sizes.keys())
+        self.size_combo.currentTextChanged.connect(self.show_preview)
         size_layout.addWidget(size_label)
         size_layout.addWidget(self.size_combo)
         layout.addLayout(size_layout)
 
+        # 背景色
+        background_layout = QHBoxLayout()
+        background_label = QLabel('背景颜色:')
+        self.background_combo = QComboBox()
+        self.background_combo.addItems(BACKGROUND_CHOICES.keys())
+        self.background_combo.currentTextChanged.connect(self.show_preview)
+        background_layout.addWidget(background_label)
+        background_layout.addWidget(self.background_combo)
+        layout.addLayout(background_layout)
+
         # 预览区域
         preview_container = QFrame()
         preview_container.setObjectName("previewFrame")
@@ -108,84 +222,176 @@ class PhotoProcessor(QMainWindow):
         
         layout.addWidget(preview_container)
 
+        # 批量处理进度
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
         # 处理按钮
+        button_layout = QHBoxLayout()
         self.process_btn = QPushButton('处理并保存')
         self.process_btn.clicked.connect(self.process_image)
-        layout.addWidget(self.process_btn, alignment=Qt.AlignmentFlag.AlignCenter)
+        button_layout.addWidget(self.process_btn)
+        self.cancel_btn = QPushButton('取消')
+        self.cancel_btn.clicked.connect(self.cancel_batch)
+        self.cancel_btn.setVisible(False)
+        button_layout.addWidget(self.cancel_btn)
+        layout.addLayout(button_layout)
 
     def select_image(self):
-        file_path, _ = QFileDialog.getOpenFileName(
+        file_paths, _ = QFileDialog.getOpenFileNames(
             self,
             "选择图片",
             "",
-            "图片文件 (*.png *.jpg *.jpeg *.bmp *.gif)"
+            f"图片文件 ({' '.join(f'*.{extension}' for extension in sorted(ALLOWED_EXTENSIONS))})"
         )
-        if file_path:
-            self.image_path = file_path
-            self.show_preview()
+        if file_paths:
+            self.set_sources([(path, os.path.basename(path)) for path in file_paths])
+
+    def select_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "选择文件夹")
+        if folder:
+            sources = collect_sources([folder])
+            if not sources:
+                QMessageBox.warning(self, "警告", "文件夹中没有图片")
+                return
+            self.set_sources(sources)
+
+    def set_sources(self, sources):
+        self.sources = sources
+        if len(sources) == 1:
+            self.source_label.setText(os.path.basename(sources[0][0]))
+        else:
+            self.source_label.setText(f"已选择 {len(sources)} 张图片（预览第一张）")
+        self.show_preview()
+
+    def current_spec(self, preview=False):
+        return ProcessingSpec.create(self.sizes[self.size_combo.currentText()], preview=preview,
+                                     background=BACKGROUND_CHOICES[self.background_combo.currentText()])
+
+    def submit(self, fn, *args, finished, failed):
+        """在线程池中执行 fn，完成后在 UI 线程中调用 finished(结果) 或 failed(错误信息)"""
+        task = Task(fn, self.processor, *args)
+        self.tasks.add(task)
+
+        def on_finished(result):
+            self.tasks.discard(task)
+            finished(result)
+
+        def on_failed(error):
+            self.tasks.discard(task)
+            failed(error)
+
+        task.signals.finished.connect(on_finished)
+        task.signals.failed.connect(on_failed)
+        self.pool.start(task)
+        return task
 
     def show_preview(self):
-        if self.image_path:
-            image = Image.open(self.image_path)
-            # 调整预览图片大小
-            preview_size = (350, 350)
-            image.thumbnail(preview_size)
-            # 转换为QPixmap显示
-            qimage = QImage(image.tobytes(), 
-                          image.width, 
-                          image.height, 
-                          QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(qimage)
-            self.preview_label.setPixmap(pixmap)
-            self.preview_label.setScaledContents(True)
+        """在线程池中生成所选尺寸的裁剪预览，UI 线程只负责显示"""
+        if not self.sources:
+            return
+        self.preview_generation += 1
+        generation = self.preview_generation
+        self.submit(render_preview, self.sources[0][0], self.current_spec(preview=True),
+                    finished=lambda buffer: self.display_preview(generation, buffer),
+                    failed=lambda error: self.preview_failed(generation, error))
+
+    def display_preview(self, generation, buffer):
+        if generation != self.preview_generation:
+            return
+        data, width, height, bytes_per_line, image_format = buffer
+        # QImage 直接引用工作线程生成的缓冲区，fromImage 复制到显示用的 QPixmap 后不再需要
+        qimage = QImage(data, width, height, bytes_per_line, image_format)
+        self.preview_pixmap = QPixmap.fromImage(qimage)
+        self.preview_label.setPixmap(self.preview_pixmap)
+
+    def preview_failed(self, generation, error):
+        if generation == self.preview_generation:
+            self.preview_label.clear()
+            QMessageBox.critical(self, "错误", f"无法预览图片：{error}")
 
     def process_image(self):
-        if not self.image_path:
+        if not self.sources:
             QMessageBox.warning(self, "警告", "请先选择图片")
             return
-            
-        selected_size = self.size_combo.currentText()
-        target_width, target_height = self.sizes[selected_size]
-        
-        try:
-            # 打开原图
-            image = Image.open(self.image_path)
-            
-            # 计算裁剪尺寸
-            original_ratio = image.width / image.height
-            target_ratio = target_width / target_height
-            
-            if original_ratio > target_ratio:
-                # 图片太宽，需要裁剪宽度
-                new_width = int(image.height * target_ratio)
-                left = (image.width - new_width) // 2
-                image = image.crop((left, 0, left + new_width, image.height))
-            else:
-                # 图片太高，需要裁剪高度
-                new_height = int(image.width / target_ratio)
-                top = (image.height - new_height) // 2
-                image = image.crop((0, top, image.width, top + new_height))
-            
-            # 调整到目标尺寸
-            image = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            
-            # 保存处理后的图片
+
+        spec = self.current_spec()
+        if len(self.sources) == 1:
             save_path, _ = QFileDialog.getSaveFileName(
                 self,
                 "保存图片",
-                f"证件照_{selected_size}.jpg",
+                f"证件照_{spec.size_name}.{spec.extension}",
                 "JPEG文件 (*.jpg)"
             )
-            
-            if save_path:
-                image.save(save_path, quality=95)
-                QMessageBox.information(self, "成功", "照片处理完成！")
-        
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"处理图片时出错：{str(e)}")
+            if not save_path:
+                return
+            targets = [(self.sources[0][0], save_path)]
+        else:
+            output_dir = QFileDialog.getExistingDirectory(self, "选择保存文件夹")
+            if not output_dir:
+                return
+            targets = [(path, output_path(output_dir, relative_path, spec))
+                       for path, relative_path in self.sources]
+
+        self.start_batch(len(targets))
+        self.batch_tasks = [
+            self.submit(save_result, path, spec, save_path,
+                        finished=lambda _: self.batch_progress(),
+                        failed=lambda error, path=path: self.batch_progress(path, error))
+            for path, save_path in targets
+        ]
+
+    def start_batch(self, total):
+        self.batch_total = total
+        self.batch_done = 0
+        self.batch_failures = []
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(total > 1)
+        self.cancel_btn.setVisible(total > 1)
+        for button in (self.process_btn, self.select_btn, self.select_folder_btn):
+            button.setEnabled(False)
+
+    def batch_progress(self, path=None, error=None):
+        if error is not None:
+            self.batch_failures.append(f"{os.path.basename(path)}：{error}")
+        self.batch_done += 1
+        self.progress_bar.setValue(self.batch_done)
+        if self.batch_done == self.batch_total:
+            self.finish_batch()
+
+    def cancel_batch(self):
+        """移除尚未开始的任务，正在处理的图片完成后结束"""
+        # 已完成的任务在信号处理时从 self.tasks 中移除，只对仍在等待的任务调用 tryTake
+        for task in self.batch_tasks:
+            if task in self.tasks and self.pool.tryTake(task):
+                self.tasks.discard(task)
+                self.batch_total -= 1
+        self.batch_tasks = []
+        if self.batch_done >= self.batch_total:
+            self.finish_batch()
+
+    def finish_batch(self):
+        self.progress_bar.setVisible(False)
+        self.cancel_btn.setVisible(False)
+        for button in (self.process_btn, self.select_btn, self.select_folder_btn):
+            button.setEnabled(True)
+        succeeded = self.batch_done - len(self.batch_failures)
+        if self.batch_failures:
+            QMessageBox.critical(self, "错误", f"{succeeded} 张处理完成，{len(self.batch_failures)} 张出错：\n"
+                                 + "\n".join(self.batch_failures[:10]))
+        else:
+            QMessageBox.information(self, "成功", f"照片处理完成！共 {succeeded} 张")
+
+    def closeEvent(self, event):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.processor.cache.stop_sweeper()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = PhotoProcessor()
     window.show()
-    sys.exit(app.exec()) 
\ No newline at end of file
+    sys.exit(app.exec())
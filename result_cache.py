@@ -0,0 +1,202 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import logging
+from cache_index import CacheIndex, is_index_file
+from config import CACHE_DIR, CACHE_MAX_BYTES, CACHE_EXPIRY_DAYS, CACHE_SWEEP_INTERVAL
+
+logger = logging.getLogger('ResultCache')
+
+# 临时文件前缀，写入完成后原子重命名为正式文件
+TEMP_PREFIX = '.tmp-'
+# 未完成的临时文件超过该时间（秒）视为残留
+TEMP_FILE_MAX_AGE = 3600
+
+
+class ResultCache:
+    """按结果 ID 存放编码后图片的磁盘缓存
+
+    文件按 ID 前两位分片存放；写入先写临时文件再原子重命名；
+    按访问时间过期，并在总大小超过预算时按最近最少访问淘汰。
+    结果的大小、访问时间和命中统计记录在所有进程共用的索引（cache_index）中。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES,
+                 expiry_days=CACHE_EXPIRY_DAYS, sweep_interval=CACHE_SWEEP_INTERVAL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.expiry_seconds = expiry_days * 24 * 3600
+        self.sweep_interval = sweep_interval
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = CacheIndex(cache_dir, self._scan)
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def path(self, result_id):
+        """结果文件路径：cache_dir/<ID 前两位>/<ID>"""
+        return os.path.join(self.cache_dir, result_id[:2], result_id)
+
+    def find(self, result_id):
+        """查找结果文件路径，不计入统计
+
+        先查索引；不在索引中时检查文件（其他进程正在写入、或索引重建之前写入的结果），
+        存在则补入索引。索引中的文件已被外部删除时从索引中移除。
+        """
+        path = self.index.lookup(result_id)
+        if path is not None:
+            if os.path.exists(path):
+                return path
+            self.index.remove(result_id)
+            return None
+        path = self.path(result_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        self.index.add(result_id, path, stat.st_size, stat.st_mtime)
+        return path
+
+    def get(self, result_id):
+        """返回结果文件路径并在索引中刷新访问时间，不存在时返回 None"""
+        path = self.find(result_id)
+        if path is None:
+            self.index.record_miss()
+        else:
+            self.index.record_hit(result_id)
+        return path
+
+    def contains(self, result_id):
+        """只检查结果是否存在，不计入命中统计"""
+        return self.find(result_id) is not None
+
+    def put(self, result_id, data):
+        """原子写入结果：先写同目录下的临时文件，再重命名为正式文件"""
+        path = self.path(result_id)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.index.add(result_id, path, len(data), time.time())
+        return path
+
+    def export(self, result_id, path, link=False):
+        """把结果文件原子地复制到 path；link=True 时尽量使用硬链接（内部目录，不会被修改）
+
+        结果不在缓存中时抛出 FileNotFoundError。
+        """
+        cache_path = self.get(result_id)
+        if cache_path is None:
+            raise FileNotFoundError(f"Result not in cache: {result_id}")
+        temp_path = os.path.join(os.path.dirname(path),
+                                 f"{TEMP_PREFIX}{os.getpid()}-{threading.get_ident()}-{os.path.basename(path)}")
+        try:
+            if link:
+                try:
+                    os.link(cache_path, temp_path)
+                except OSError:
+                    # 跨文件系统等无法硬链接时复制
+                    link = False
+            if not link:
+                shutil.copyfile(cache_path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return path
+
+    def _scan(self):
+        """遍历缓存目录（含分片目录和旧版平铺文件），用于重建索引
+
+        返回 [(结果 ID, 路径, 大小, 创建时间, 访问时间)]，并删除残留的临时文件。
+        """
+        now = time.time()
+        files = []
+        directories = [self.cache_dir]
+        while directories:
+            with os.scandir(directories.pop()) as iterator:
+                for entry in iterator:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if is_index_file(entry.name):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if entry.name.startswith(TEMP_PREFIX):
+                        if now - stat.st_mtime > TEMP_FILE_MAX_AGE:
+                            self._remove(entry.path)
+                        continue
+                    files.append((entry.name, entry.path, stat.st_size, stat.st_mtime,
+                                  max(stat.st_atime, stat.st_mtime)))
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self):
+        """删除过期结果，总大小超出预算时按访问时间从旧到新淘汰；淘汰对象由索引查询得到，不遍历目录"""
+        try:
+            victims = self.index.evict(time.time() - self.expiry_seconds, self.max_bytes)
+            for path, _ in victims:
+                self._remove(path)
+            if victims:
+                logger.info("Cache sweep evicted %d files, %d bytes",
+                            len(victims), sum(size for _, size in victims))
+        except Exception as e:
+            logger.error("Cache sweep error: %s", e)
+
+    def start_sweeper(self):
+        """启动后台清理线程（重复调用无效）"""
+        if self._sweeper is not None:
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """停止后台清理线程，写入累积的访问记录"""
+        self._stop.set()
+        self.index.flush_wanted.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        self.index.flush()
+
+    def _sweep_loop(self):
+        """定期（累积的访问记录达到批量大小时提前）写入访问记录；共用缓存目录的进程中每个清理间隔只有一个进程清理"""
+        while True:
+            try:
+                self.index.flush()
+                if self.index.claim_sweep(self.sweep_interval):
+                    self.sweep()
+            except Exception as e:
+                logger.error("Cache index error: %s", e)
+            self.index.flush_wanted.wait(min(self.sweep_interval, self.index.flush_interval))
+            if self._stop.is_set():
+                break
+
+    def stats(self):
+        """所有共用缓存目录的进程合计的命中、未命中、淘汰次数和当前容量"""
+        stats = self.index.stats()
+        lookups = stats['hits'] + stats['misses']
+        return {
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'evictions': stats['evictions'],
+            'hit_ratio': stats['hits'] / lookups if lookups else 0.0,
+            'entries': stats['entries'],
+            'bytes': stats['bytes'],
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,492 @@
+"""异步服务入口（aiohttp）
+
+与 app.py 提供相同的接口，但整个进程只有一个长期运行的事件循环：
+上传内容按块流式接收（边接收边计算哈希、解析文件头），图片处理交给线程池和执行引擎，不阻塞事件循环。
+
+开发运行：python server.py
+生产运行：gunicorn -c gunicorn.conf.py server:create_app
+"""
+import asyncio
+import json
+import logging
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from aiohttp import web
+from multidict import MultiDict
+from admission import AdmissionController, DeadlineExceeded, Overloaded, deadline_after
+from batch import BatchManager, RUNNING, iter_zip
+from image_processor import ImageProcessor
+from ingest import ImageTooLarge, InvalidImage, UploadIngest
+import metrics
+from log_setup import configure_logging
+from encoder import TargetTooSmall
+from sheet import parse_sheet
+from spec import ProcessingSpec, parse_output_options, parse_size
+from config import (PHOTO_SIZES, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, RESULT_MAX_AGE,
+                    REQUEST_WORKERS, UPLOAD_CHUNK_SIZE, BATCH_MAX_BYTES)
+
+logger = logging.getLogger('AsyncServer')
+routes = web.RouteTableDef()
+
+# 源图片 ID：上传文件的 BLAKE2b-128 哈希
+SOURCE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+INVALID_FILE_MESSAGE = (f'无效的文件。允许的格式：{", ".join(ALLOWED_EXTENSIONS)}，'
+                        f'最大大小：{MAX_FILE_SIZE/1024/1024}MB')
+
+
+def json_error(message, status=400, **headers):
+    return web.json_response({'error': message}, status=status, headers=headers)
+
+
+def bad_request(message):
+    """在读取上传的过程中中止请求用的 400 异常，响应体与 json_error 相同"""
+    return web.HTTPBadRequest(text=json.dumps({'error': message}), content_type='application/json')
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """统一的错误响应：与 app.py 的状态码和错误信息一致"""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Overloaded as e:
+        return json_error('服务繁忙，请稍后重试', 503, **{'Retry-After': str(e.retry_after)})
+    except DeadlineExceeded:
+        return json_error('请求超时', 504)
+    except TargetTooSmall:
+        return json_error('无法在指定的字节数内编码图片，请增大 max_bytes')
+    except ValueError:
+        return json_error('无效的参数')
+    except Exception as e:
+        logger.error(f"Error handling {request.path}: {str(e)}")
+        return json_error(str(e), 500)
+
+
+class Upload:
+    """流式读取的 multipart 表单：图片边接收边计算哈希和解析文件头，其余字段保存为文本"""
+
+    def __init__(self):
+        self.form = MultiDict()
+        self.filename = None
+        self.image = None
+
+    @classmethod
+    async def read(cls, request):
+        """按块读取请求体；文件头无效、像素数或文件过大时立即停止读取"""
+        upload = cls()
+        if request.content_type != 'multipart/form-data':
+            upload.form = MultiDict(await request.post())
+            return upload
+        reader = await request.multipart()
+        while (part := await reader.next()) is not None:
+            if part.name != 'image':
+                upload.form.add(part.name, await part.text())
+                continue
+            upload.filename = part.filename or ''
+            if not ImageProcessor.is_valid_file(upload.filename, 0):
+                raise bad_request(INVALID_FILE_MESSAGE)
+            ingest = UploadIngest()
+            try:
+                while chunk := await part.read_chunk(UPLOAD_CHUNK_SIZE):
+                    ingest.write(chunk)
+                upload.image = ingest.finish()
+            except ImageTooLarge:
+                raise bad_request(INVALID_FILE_MESSAGE)
+            except InvalidImage as e:
+                logger.info(f"Rejected upload {upload.filename}: {e}")
+                raise bad_request('无效的图片文件')
+        return upload
+
+    def validate(self):
+        """返回错误信息，上传有效时返回 None"""
+        if self.filename is None:
+            return '没有上传图片'
+        if not self.filename:
+            return '没有选择文件'
+        return None
+
+
+async def read_upload(request, required=True):
+    """读取并验证上传，无效时抛出 400；required=False 时允许没有图片，只读取表单"""
+    if (request.content_length or 0) > MAX_FILE_SIZE + UPLOAD_CHUNK_SIZE:
+        raise bad_request(INVALID_FILE_MESSAGE)
+    upload = await Upload.read(request)
+    error = upload.validate()
+    if error and (required or upload.filename is not None):
+        raise bad_request(error)
+    return upload
+
+
+def result_payload(request, spec, result_id, info):
+    """结果的 JSON 描述：图片通过 /api/result/<结果 ID> 以二进制获取，附带字节数和编码质量"""
+    return {
+        'id': result_id,
+        'url': str(request.app.router['get_result'].url_for(result_id=result_id)),
+        'size': spec.size_name,
+        'source': result_id.split('_', 1)[0],
+        **(info or {})
+    }
+
+
+def read_result_infos(processor, specs, result_ids):
+    return [processor.result_info(result_ids[spec.size_name], spec) for spec in specs]
+
+
+async def result_payloads(request, specs, result_ids):
+    """每个处理参数的结果描述；字节数和编码质量在线程池中读取"""
+    loop = asyncio.get_running_loop()
+    infos = await loop.run_in_executor(request.app['executor'], read_result_infos,
+                                       request.app['processor'], specs, result_ids)
+    return [result_payload(request, spec, result_ids[spec.size_name], info)
+            for spec, info in zip(specs, infos)]
+
+
+async def run_admitted(request, cost, func, *args):
+    """通过准入控制后在线程池中执行 func(*args, deadline=...)"""
+    app = request.app
+    deadline = deadline_after(request.headers.get('X-Request-Timeout'))
+    with app['admission'].admit(cost):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(app['executor'], partial(func, *args, deadline=deadline))
+
+
+async def process_upload(request, upload, specs):
+    """按图片头估算内存后处理上传的图片，返回 {尺寸名称: 结果 ID}"""
+    processor = request.app['processor']
+    cost = processor.estimate_memory(upload.image, [spec.output_size for spec in specs])
+    return await run_admitted(request, cost, processor.process_upload, upload.image, specs)
+
+
+async def respond_with_spec(request, upload, spec):
+    result_ids = await process_upload(request, upload, [spec])
+    payloads = await result_payloads(request, [spec], result_ids)
+    return web.json_response(payloads[0])
+
+
+def tone_options(form):
+    return float(form.get('brightness', 1.0)), float(form.get('contrast', 1.0))
+
+
+@routes.get('/')
+async def index(request):
+    return web.FileResponse('static/index.html')
+
+
+@routes.get('/api/sizes')
+async def get_sizes(request):
+    """获取所有支持的尺寸"""
+    return web.json_response({name: f"{dims[0]}x{dims[1]}" for name, dims in PHOTO_SIZES.items()})
+
+
+@routes.post('/api/process')
+async def process(request):
+    """处理预设尺寸"""
+    upload = await read_upload(request)
+    size_name = upload.form.get('size')
+    brightness, contrast = tone_options(upload.form)
+    if size_name not in PHOTO_SIZES:
+        return json_error('无效的尺寸选择')
+    spec = ProcessingSpec.create(size_name, brightness, contrast, **parse_output_options(upload.form))
+    return await respond_with_spec(request, upload, spec)
+
+
+@routes.post('/api/custom-size')
+async def process_custom_size(request):
+    """处理自定义尺寸"""
+    upload = await read_upload(request)
+    try:
+        width = int(upload.form.get('width', 0))
+        height = int(upload.form.get('height', 0))
+    except ValueError:
+        return json_error('无效的尺寸参数')
+    brightness, contrast = tone_options(upload.form)
+    if width <= 0 or height <= 0:
+        return json_error('无效的尺寸')
+    spec = ProcessingSpec.create((width, height), brightness, contrast, **parse_output_options(upload.form))
+    return await respond_with_spec(request, upload, spec)
+
+
+@routes.post('/api/preview')
+async def preview(request):
+    """交互编辑用的低延迟预览"""
+    upload = await read_upload(request)
+    size = parse_size(upload.form.get('size', ''))
+    brightness, contrast = tone_options(upload.form)
+    if size is None:
+        return json_error('无效的尺寸选择')
+    spec = ProcessingSpec.create(size, brightness, contrast, preview=True,
+                                 background=upload.form.get('background') or None)
+    return await respond_with_spec(request, upload, spec)
+
+
+@routes.post('/api/process-all')
+async def process_all(request):
+    """一次上传生成多个尺寸（默认全部预设尺寸），源图片只解码一次"""
+    upload = await read_upload(request)
+    sizes = [parse_size(value) for value in upload.form.getall('sizes', None) or PHOTO_SIZES]
+    brightness, contrast = tone_options(upload.form)
+    if None in sizes:
+        return json_error('无效的尺寸选择')
+    options = parse_output_options(upload.form)
+    specs = list(dict.fromkeys(ProcessingSpec.create(size, brightness, contrast, **options) for size in sizes))
+    result_ids = await process_upload(request, upload, specs)
+    return web.json_response({'images': await result_payloads(request, specs, result_ids)})
+
+
+@routes.post('/api/adjust')
+async def adjust(request):
+    """基于已上传的源图片调整亮度和对比度，只执行调整和编码"""
+    form = await request.post()
+    source = form.get('source', '')
+    size = parse_size(form.get('size', ''))
+    brightness, contrast = tone_options(form)
+    if not SOURCE_ID_PATTERN.match(source):
+        return json_error('无效的源图片')
+    if size is None:
+        return json_error('无效的尺寸选择')
+
+    spec = ProcessingSpec.create(size, brightness, contrast, **parse_output_options(form))
+    try:
+        result_ids = await run_admitted(request, 0, request.app['processor'].readjust_results,
+                                        source, [spec])
+    except KeyError:
+        return json_error('源图片已过期，请重新上传', 404)
+    payloads = await result_payloads(request, [spec], result_ids)
+    return web.json_response(payloads[0])
+
+
+def sheet_payload(request, sheet, result_id, info):
+    """排版结果的 JSON 描述：结果描述加上相纸、分辨率和每个尺寸实际排入的份数"""
+    return dict(result_payload(request, sheet, result_id, info), paper=sheet.paper, dpi=sheet.dpi,
+                items=[{'size': size_name, 'copies': copies} for size_name, copies in sheet.placed_copies()])
+
+
+@routes.post('/api/sheet')
+async def make_sheet(request):
+    """冲印排版：上传图片（image）或引用已上传的源图片（source），把 sizes 的照片按 copies 份排到相纸上"""
+    upload = await read_upload(request, required=False)
+    source = upload.form.get('source')
+    if upload.image is not None:
+        source = upload.image.file_hash
+    elif not SOURCE_ID_PATTERN.match(source or ''):
+        return json_error('没有上传图片' if source is None else '无效的源图片')
+
+    try:
+        sheet = parse_sheet(upload.form, upload.form.getall('sizes', []), upload.form.getall('copies', []))
+        # 放不下时在处理之前返回 400
+        sheet.layout()
+    except ValueError:
+        return json_error('无效的排版参数')
+    processor = request.app['processor']
+    try:
+        result_id = await run_admitted(request, processor.estimate_sheet_memory(upload.image, sheet),
+                                       processor.process_sheet, upload.image and upload.image.open(),
+                                       source, sheet)
+    except KeyError:
+        return json_error('源图片已过期，请重新上传', 404)
+    loop = asyncio.get_running_loop()
+    info = await loop.run_in_executor(request.app['executor'], processor.result_info, result_id, sheet)
+    return web.json_response(sheet_payload(request, sheet, result_id, info))
+
+
+def batch_payload(request, job):
+    """批处理任务的 JSON 描述：进度和失败原因，以及查询和下载 URL"""
+    router = request.app.router
+    return dict(job.status(),
+                status_url=str(router['get_batch'].url_for(job_id=job.id)),
+                download_url=str(router['download_batch'].url_for(job_id=job.id)))
+
+
+@routes.post('/api/batch')
+async def create_batch(request):
+    """提交批处理任务：多个 images 文件和/或 archive ZIP，处理参数同 /api/process-all"""
+    if (request.content_length or 0) > BATCH_MAX_BYTES:
+        return json_error(f'上传过大，最大大小：{BATCH_MAX_BYTES/1024/1024}MB')
+    form, files, archives = MultiDict(), [], []
+    try:
+        # 上传先写入临时文件，表单字段可能在文件之后
+        reader = await request.multipart()
+        received = 0
+        while (part := await reader.next()) is not None:
+            if part.name not in ('images', 'archive'):
+                form.add(part.name, await part.text())
+                continue
+            if not part.filename:
+                continue
+            spool = tempfile.TemporaryFile()
+            if part.name == 'images':
+                files.append((part.filename, spool))
+            else:
+                archives.append(spool)
+            while chunk := await part.read_chunk(UPLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > BATCH_MAX_BYTES:
+                    return json_error(f'上传过大，最大大小：{BATCH_MAX_BYTES/1024/1024}MB')
+                spool.write(chunk)
+            spool.seek(0)
+        if not files and not archives:
+            return json_error('没有上传图片')
+
+        sizes = [parse_size(value) for value in form.getall('sizes', None) or PHOTO_SIZES]
+        brightness, contrast = tone_options(form)
+        if None in sizes:
+            return json_error('无效的尺寸选择')
+        options = parse_output_options(form)
+        specs = list(dict.fromkeys(ProcessingSpec.create(size, brightness, contrast, **options)
+                                   for size in sizes))
+
+        loop = asyncio.get_running_loop()
+        try:
+            job = await loop.run_in_executor(
+                None, partial(request.app['batches'].submit, specs, files=files, archives=archives))
+        except ValueError as e:
+            return json_error(f'无效的批处理上传：{str(e)}')
+        return web.json_response(batch_payload(request, job), status=202)
+    finally:
+        for spool in [spool for _, spool in files] + archives:
+            spool.close()
+
+
+@routes.get('/api/batch/{job_id}', name='get_batch')
+async def get_batch(request):
+    """查询批处理进度：total/done/failed/pending 和失败原因"""
+    job = request.app['batches'].get(request.match_info['job_id'])
+    if job is None:
+        return json_error('任务不存在或已过期', 404)
+    return web.json_response(batch_payload(request, job))
+
+
+@routes.get('/api/batch/{job_id}/download', name='download_batch')
+async def download_batch(request):
+    """以流式 ZIP 下载结果；任务仍在运行时随处理进度逐个写入"""
+    batches = request.app['batches']
+    job = batches.get(request.match_info['job_id'])
+    if job is None:
+        return json_error('任务不存在或已过期', 404)
+    # 其他服务进程运行中的任务无法等待其进度，完成后才能下载
+    if job.state == RUNNING and not batches.is_local(job):
+        return json_error('任务仍在处理中，请稍后下载', 409)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/zip',
+        'Content-Disposition': f'attachment; filename=batch_{job.id}.zip'
+    })
+    await response.prepare(request)
+    # 生成 ZIP 时读取文件并等待处理进度，在线程中执行，不阻塞事件循环
+    loop = asyncio.get_running_loop()
+    chunks = iter_zip(job)
+    while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+@routes.get('/api/result/{result_id}', name='get_result')
+async def get_result(request):
+    """返回处理结果的二进制图片；结果 ID 由内容决定，浏览器可永久缓存"""
+    result_id = request.match_info['result_id']
+    # 先确认结果存在（查询共享索引，可能等待其他进程的写锁，放到线程池中），再比较 ETag
+    loop = asyncio.get_running_loop()
+    cache_path = await loop.run_in_executor(request.app['executor'],
+                                            request.app['processor'].get_result_path, result_id)
+    if cache_path is None:
+        return json_error('结果不存在或已过期', 404)
+    headers = {'Cache-Control': f'public, max-age={RESULT_MAX_AGE}, immutable'}
+    if any(etag.value == result_id for etag in request.if_none_match or ()):
+        return web.Response(status=304, headers=dict(headers, ETag=f'"{result_id}"'))
+    return ResultFileResponse(cache_path, result_id, headers=headers)
+
+
+class ResultFileResponse(web.FileResponse):
+    """以 sendfile 发送结果文件；ETag 始终为结果 ID（FileResponse 默认由修改时间和大小生成）"""
+
+    def __init__(self, path, result_id, **kwargs):
+        super().__init__(path, **kwargs)
+        self.result_id = result_id
+
+    @property
+    def etag(self):
+        return web.StreamResponse.etag.fget(self)
+
+    @etag.setter
+    def etag(self, value):
+        web.StreamResponse.etag.fset(self, self.result_id)
+
+
+async def cache_stats(app):
+    """结果缓存统计：先写入累积的访问记录再查询共享索引，可能等待其他进程的写锁，放到线程池中"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app['executor'], app['processor'].cache.stats)
+
+
+@routes.get('/api/cache/stats')
+async def get_cache_stats(request):
+    """结果缓存的命中、未命中、淘汰计数和容量"""
+    return web.json_response(await cache_stats(request.app))
+
+
+@routes.get('/api/stats')
+async def get_stats(request):
+    """结果缓存、几何中间结果缓存、并发请求合并和准入控制的统计"""
+    processor = request.app['processor']
+    return web.json_response({
+        'cache': await cache_stats(request.app),
+        'intermediates': processor.intermediates.stats(),
+        'singleflight': processor.flights.stats(),
+        'admission': request.app['admission'].stats(),
+        'queue_depth': request.app['executor']._work_queue.qsize()
+    })
+
+
+@routes.get('/metrics')
+async def get_metrics(request):
+    """Prometheus 抓取：本服务进程的阶段耗时、计数和瞬时指标"""
+    app = request.app
+    # service_gauges 读取缓存统计，同样放到线程池中
+    loop = asyncio.get_running_loop()
+    gauges = await loop.run_in_executor(app['executor'], metrics.service_gauges,
+                                        app['processor'], app['admission'], app['executor'])
+    body = metrics.render(gauges)
+    return web.Response(body=body.encode('utf-8'), headers={
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'
+    })
+
+
+async def allow_cross_origin(request, response):
+    """与 app.py 的 CORS(app) 一致，允许任意来源"""
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+
+
+async def processing_context(app):
+    """每个服务进程一份处理器、请求线程池、准入控制和批处理任务管理，随应用启动和关闭"""
+    configure_logging()
+    processor = ImageProcessor()
+    processor.cache.start_sweeper()
+    executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix='request')
+    app['processor'] = processor
+    app['executor'] = executor
+    app['admission'] = AdmissionController()
+    app['batches'] = BatchManager(processor)
+    yield
+    app['batches'].shutdown()
+    processor.cache.stop_sweeper()
+    executor.shutdown(wait=True)
+    processor.engine.shutdown()
+
+
+async def create_app():
+    """创建 aiohttp 应用（gunicorn 的 aiohttp.GunicornWebWorker 直接调用）"""
+    app = web.Application(middlewares=[error_middleware])
+    app.add_routes(routes)
+    app.router.add_static('/static', 'static')
+    app.on_response_prepare.append(allow_cross_origin)
+    app.cleanup_ctx.append(processing_context)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=5000)
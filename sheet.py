@@ -0,0 +1,215 @@
+"""冲印排版：把同一张源图片的一个或多个尺寸的照片排到相纸上
+
+每个尺寸的照片只生成一次（与单张结果共用结果缓存），按版面方案粘贴到预先分配的画布上，
+不会为每一格重新处理源图片。排版结果同样以结果 ID 写入结果缓存，重复冲印直接命中。
+
+版面按行排列，同一行只放同一尺寸：指定份数的尺寸按顺序先排满所需的行，未指定份数的尺寸
+再轮流各排一行，直到都排不下。相纸竖放和横放各计算一次，取放下照片更多的方向。
+"""
+import io
+import hashlib
+from collections import namedtuple
+from dataclasses import dataclass, replace
+from PIL import Image, ImageDraw
+from config import (PAPER_SIZES, SHEET_PAPER, SHEET_DPI, SHEET_MAX_DPI, PHOTO_DPI, SHEET_MARGIN_MM,
+                    SHEET_GAP_MM, SHEET_GUIDE_COLOR, JPEG_QUALITY)
+from spec import ProcessingSpec, parse_size
+
+MM_PER_INCH = 25.4
+
+# 版面方案：画布尺寸（像素）和 [(items 中的序号, (x, y))]
+SheetLayout = namedtuple('SheetLayout', ['canvas_size', 'placements'])
+
+
+def mm_to_pixels(mm, dpi):
+    return round(mm * dpi / MM_PER_INCH)
+
+
+@dataclass(frozen=True)
+class SheetSpec:
+    """冲印排版参数（不可变）
+
+    items 为 ((照片的处理参数, 份数), ...)，份数为 None 时排满剩余空间。
+    format、quality 与 ProcessingSpec 的同名字段含义相同；排版结果按固定质量编码，不支持 max_bytes。
+    """
+    paper: str
+    paper_size: tuple
+    dpi: int
+    items: tuple
+    guides: bool = True
+    format: str = 'JPEG'
+    quality: int = JPEG_QUALITY
+
+    @classmethod
+    def create(cls, paper, sizes, copies=(), brightness=1.0, contrast=1.0, dpi=SHEET_DPI, guides=True,
+               background=None):
+        """由相纸名称、尺寸（名称或 (宽, 高)）和对应的份数创建排版参数
+
+        尺寸的像素按 PHOTO_DPI 打印；dpi 不同时按比例换算，照片直接生成为打印所需的像素，
+        不在排版时再缩放。
+        """
+        if paper not in PAPER_SIZES:
+            raise ValueError(f"Unknown paper: {paper}")
+        dpi = int(dpi)
+        if not 0 < dpi <= SHEET_MAX_DPI:
+            raise ValueError(f"Invalid dpi: {dpi}")
+        copies = list(copies)
+        if not sizes or len(copies) > len(sizes):
+            raise ValueError("Sheet needs at least one size and at most one copies value per size")
+        copies += [None] * (len(sizes) - len(copies))
+        items = []
+        for size, count in zip(sizes, copies):
+            if count is not None and count <= 0:
+                raise ValueError(f"Invalid copies: {count}")
+            spec = ProcessingSpec.create(size, brightness, contrast, background=background)
+            if dpi != PHOTO_DPI:
+                # 保留尺寸名称，缓存键只由像素尺寸决定
+                spec = replace(spec, size=tuple(max(1, round(side * dpi / PHOTO_DPI)) for side in spec.size))
+            items.append((spec, count))
+        return cls(paper, tuple(PAPER_SIZES[paper]), dpi, tuple(items), bool(guides))
+
+    @property
+    def size_name(self):
+        return f"sheet_{self.paper}"
+
+    @property
+    def cache_key(self):
+        """由相纸、分辨率、裁切线、编码质量和各照片的缓存键与份数生成"""
+        fields = ('sheet', self.paper_size, self.dpi, self.guides, self.format.upper(), self.quality,
+                  tuple((spec.cache_key, count) for spec, count in self.items))
+        return hashlib.md5(repr(fields).encode()).hexdigest()[:16]
+
+    @property
+    def extension(self):
+        return 'jpg'
+
+    @property
+    def tile_specs(self):
+        """需要生成的照片处理参数（去重）"""
+        return list(dict.fromkeys(spec for spec, _ in self.items))
+
+    @property
+    def canvas_size(self):
+        """竖放时的画布尺寸（像素）"""
+        return tuple(mm_to_pixels(side, self.dpi) for side in self.paper_size)
+
+    def layout(self):
+        """计算版面，放不下时抛出 ValueError"""
+        margin = mm_to_pixels(SHEET_MARGIN_MM, self.dpi)
+        gap = mm_to_pixels(SHEET_GAP_MM, self.dpi)
+        return plan_sheet(self.canvas_size, [(spec.size, count) for spec, count in self.items], margin, gap)
+
+    def placed_copies(self, layout=None):
+        """每个尺寸实际排入的份数：[(尺寸名称, 份数)]"""
+        layout = layout or self.layout()
+        counts = [0] * len(self.items)
+        for index, _ in layout.placements:
+            counts[index] += 1
+        return [(spec.size_name, count) for (spec, _), count in zip(self.items, counts)]
+
+
+def shelf_rows(canvas_size, tiles, margin, gap):
+    """在一个方向的画布上按行分配，返回 [(序号, 本行份数)]；指定的份数放不下时返回 None"""
+    width, height = canvas_size
+    rows = []
+    bottom = height - margin
+    y = margin
+
+    def columns(index):
+        return (width - 2 * margin + gap) // (tiles[index][0][0] + gap)
+
+    def fits(index):
+        return columns(index) > 0 and y + tiles[index][0][1] <= bottom
+
+    for index, (size, copies) in enumerate(tiles):
+        remaining = copies or 0
+        while remaining > 0:
+            if not fits(index):
+                return None
+            count = min(columns(index), remaining)
+            rows.append((index, count))
+            y += size[1] + gap
+            remaining -= count
+
+    filling = [index for index, (_, copies) in enumerate(tiles) if copies is None]
+    while filling:
+        for index in list(filling):
+            if fits(index):
+                rows.append((index, columns(index)))
+                y += tiles[index][0][1] + gap
+            else:
+                filling.remove(index)
+    return rows
+
+
+def place_rows(canvas_size, tiles, rows, gap):
+    """把各行在画布上居中：整体垂直居中，每行水平居中"""
+    width, height = canvas_size
+    block_height = sum(tiles[index][0][1] for index, _ in rows) + gap * (len(rows) - 1)
+    y = (height - block_height) // 2
+    placements = []
+    for index, count in rows:
+        tile_width, tile_height = tiles[index][0]
+        x = (width - (count * tile_width + (count - 1) * gap)) // 2
+        placements += [(index, (x + column * (tile_width + gap), y)) for column in range(count)]
+        y += tile_height + gap
+    return placements
+
+
+def plan_sheet(canvas_size, tiles, margin, gap):
+    """tiles 为 [((宽, 高), 份数或 None)]，返回放下照片最多的方向的 SheetLayout
+
+    指定的份数放不下、或有尺寸一张也放不下时抛出 ValueError。
+    """
+    best = None
+    for size in (canvas_size, canvas_size[::-1]):
+        rows = shelf_rows(size, tiles, margin, gap)
+        if rows is None or {index for index, _ in rows} != set(range(len(tiles))):
+            continue
+        placements = place_rows(size, tiles, rows, gap)
+        if best is None or len(placements) > len(best.placements):
+            best = SheetLayout(size, placements)
+    if best is None:
+        raise ValueError(f"Photos do not fit on a {canvas_size[0]}x{canvas_size[1]} sheet")
+    return best
+
+
+def compose_sheet(sheet, tiles, layout=None):
+    """按版面把照片粘贴到画布上，tiles 为 {处理参数: 图片}，每个尺寸的图片被重复粘贴
+
+    裁切线是每张照片外侧 1 像素的边框，画在间距中，不覆盖照片。
+    """
+    layout = layout or sheet.layout()
+    canvas = Image.new('RGB', layout.canvas_size, 'white')
+    if sheet.guides:
+        draw = ImageDraw.Draw(canvas)
+        for index, (x, y) in layout.placements:
+            width, height = sheet.items[index][0].size
+            draw.rectangle((x - 1, y - 1, x + width, y + height), outline=SHEET_GUIDE_COLOR)
+    for index, position in layout.placements:
+        canvas.paste(tiles[sheet.items[index][0]], position)
+    return canvas
+
+
+def encode_sheet(image, sheet):
+    """编码排版结果，写入 DPI 使打印时为实际尺寸"""
+    buffered = io.BytesIO()
+    image.save(buffered, format=sheet.format, quality=sheet.quality, dpi=(sheet.dpi, sheet.dpi))
+    return buffered.getvalue()
+
+
+def parse_sheet(form, size_values, copies_values):
+    """从表单解析排版参数：paper、dpi、guides、brightness、contrast、background
+
+    size_values、copies_values 为多值字段 sizes、copies 的列表（Flask 和 aiohttp 的取法不同），
+    copies 为空字符串时该尺寸排满剩余空间。参数无效时抛出 ValueError。
+    """
+    sizes = [parse_size(value) for value in size_values]
+    if None in sizes:
+        raise ValueError(f"Invalid sizes: {size_values}")
+    copies = [int(value) if value else None for value in copies_values]
+    return SheetSpec.create(form.get('paper') or SHEET_PAPER, sizes, copies,
+                            float(form.get('brightness', 1.0)), float(form.get('contrast', 1.0)),
+                            form.get('dpi') or SHEET_DPI,
+                            form.get('guides', '1').lower() not in ('0', 'false', 'off', 'no'),
+                            form.get('background') or None)
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """合并相同键的并发计算：同一时刻只执行一次，其余调用等待并共享结果（包括异常）"""
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """执行 func(*args, **kwargs)；已有相同键的计算在进行时等待其结果"""
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._inflight[key] = Future()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        """调用次数、实际执行次数、被合并的次数和进行中的计算数"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'inflight': len(self._inflight)
+            }
@@ -0,0 +1,122 @@
+import hashlib
+from dataclasses import dataclass
+from config import (PHOTO_SIZES, JPEG_QUALITY, PREVIEW_MAX_EDGE, PREVIEW_QUALITY, OUTPUT_FORMATS,
+                    JPEG_SUBSAMPLING, BACKGROUND_COLORS)
+
+# 参与缓存键的可选参数；均为默认值时缓存键与加入这些参数之前相同
+KEY_OPTIONS = ('max_bytes', 'progressive', 'optimize', 'subsampling', 'background')
+
+
+@dataclass(frozen=True)
+class ProcessingSpec:
+    """单次请求的处理参数（不可变），缓存键由全部字段生成"""
+    size_name: str
+    size: tuple
+    brightness: float = 1.0
+    contrast: float = 1.0
+    format: str = 'JPEG'
+    quality: int = JPEG_QUALITY
+    # 预览模式：缩小输出、低成本解码和缩放、低质量编码
+    preview: bool = False
+    # 结果字节数上限：在 quality 以下查找满足上限的最高质量
+    max_bytes: int = None
+    # JPEG 渐进式编码、优化霍夫曼表（WebP 为更慢更充分的压缩）、色度抽样（None 为编码器默认）
+    progressive: bool = False
+    optimize: bool = False
+    subsampling: str = None
+    # 替换背景色：BACKGROUND_COLORS 中的名称，None 为保留原背景
+    background: str = None
+
+    @classmethod
+    def create(cls, size, brightness=1.0, contrast=1.0, **output_options):
+        """由尺寸名称或 (宽, 高) 创建处理参数"""
+        if output_options.get('preview'):
+            output_options.setdefault('quality', PREVIEW_QUALITY)
+        output_options['format'] = output_options.get('format', 'JPEG').upper()
+        if output_options['format'] not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported format: {output_options['format']}")
+        if output_options.get('background') is not None:
+            output_options['background'] = output_options['background'].lower()
+            if output_options['background'] not in BACKGROUND_COLORS:
+                raise ValueError(f"Unknown background: {output_options['background']}")
+        if output_options.get('subsampling') not in (None, *JPEG_SUBSAMPLING):
+            raise ValueError(f"Invalid subsampling: {output_options['subsampling']}")
+        if output_options.get('max_bytes') is not None:
+            output_options['max_bytes'] = int(output_options['max_bytes'])
+            if output_options['max_bytes'] <= 0:
+                raise ValueError(f"Invalid max_bytes: {output_options['max_bytes']}")
+        if not 1 <= output_options.get('quality', JPEG_QUALITY) <= 100:
+            raise ValueError(f"Invalid quality: {output_options['quality']}")
+        if isinstance(size, str):
+            if size not in PHOTO_SIZES:
+                raise ValueError(f"Unknown size: {size}")
+            size_name, dimensions = size, tuple(PHOTO_SIZES[size])
+        else:
+            width, height = int(size[0]), int(size[1])
+            if width <= 0 or height <= 0:
+                raise ValueError(f"Invalid size: {width}x{height}")
+            size_name, dimensions = f"custom_{width}x{height}", (width, height)
+        return cls(size_name, dimensions, float(brightness), float(contrast), **output_options)
+
+    @property
+    def cache_key(self):
+        """由全部参数生成的缓存键；尺寸名称只是显示用，不参与计算"""
+        fields = (self.size, self.brightness, self.contrast, self.format.upper(), self.quality,
+                  self.preview)
+        options = tuple((name, getattr(self, name)) for name in KEY_OPTIONS if getattr(self, name))
+        if options:
+            fields += options
+        return hashlib.md5(repr(fields).encode()).hexdigest()[:16]
+
+    @property
+    def output_size(self):
+        """实际输出尺寸：预览时按比例缩小到最长边不超过 PREVIEW_MAX_EDGE"""
+        if not self.preview or max(self.size) <= PREVIEW_MAX_EDGE:
+            return self.size
+        scale = PREVIEW_MAX_EDGE / max(self.size)
+        return (max(1, round(self.size[0] * scale)), max(1, round(self.size[1] * scale)))
+
+    @property
+    def geometry_key(self):
+        """决定几何中间结果的参数"""
+        return (self.output_size, self.preview)
+
+    @property
+    def extension(self):
+        """输出文件扩展名"""
+        return 'jpg' if self.format.upper() == 'JPEG' else self.format.lower()
+
+
+def parse_size(value):
+    """解析尺寸参数：预设尺寸名称或 "宽x高"，无效时返回 None"""
+    if value in PHOTO_SIZES:
+        return value
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    return (width, height)
+
+
+def parse_output_options(form):
+    """从表单解析输出选项：format、quality、max_bytes、progressive、optimize、subsampling、background
+
+    未提供的选项不出现在结果中；数值无效时抛出 ValueError。
+    """
+    options = {}
+    if form.get('format'):
+        options['format'] = form['format']
+    if form.get('quality'):
+        options['quality'] = int(form['quality'])
+    if form.get('max_bytes'):
+        options['max_bytes'] = int(form['max_bytes'])
+    if form.get('subsampling'):
+        options['subsampling'] = form['subsampling']
+    if form.get('background'):
+        options['background'] = form['background']
+    for flag in ('progressive', 'optimize'):
+        if form.get(flag, '').lower() in ('1', 'true', 'on', 'yes'):
+            options[flag] = True
+    return options
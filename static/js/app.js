@@ -14,6 +14,12 @@ const app = createApp({
     mounted() {
         this.loadSizes();
     },
+    watch: {
+        selectedSize() {
+            this.processedImage = null;
+            this.updatePreview();
+        }
+    },
     methods: {
         async loadSizes() {
             try {
@@ -37,6 +43,32 @@ const app = createApp({
                     this.processedImage = null;
                 };
                 reader.readAsDataURL(file);
+                this.updatePreview();
+            }
+        },
+
+        async updatePreview() {
+            // 低质量快速预览，完整质量的处理只在点击"处理图片"时进行
+            const imageInput = document.getElementById('imageInput');
+            if (!imageInput || !imageInput.files[0] || !this.selectedSize) {
+                return;
+            }
+
+            const formData = new FormData();
+            formData.append('image', imageInput.files[0]);
+            formData.append('size', this.selectedSize);
+
+            try {
+                const response = await fetch('/api/preview', {
+                    method: 'POST',
+                    body: formData
+                });
+                const data = await response.json();
+                if (!data.error && !this.processedImage) {
+                    this.previewImage = data.url;
+                }
+            } catch (error) {
+                console.error('预览失败:', error);
             }
         },
         
@@ -65,8 +97,9 @@ const app = createApp({
                     throw new Error(data.error);
                 }
                 
+                // 结果以二进制 URL 返回，浏览器可直接缓存
                 this.processedImage = data;
-                this.previewImage = data.image;
+                this.previewImage = data.url;
             } catch (error) {
                 console.error('处理失败:', error);
                 this.error = `处理失败: ${error.message}`;
@@ -79,7 +112,7 @@ const app = createApp({
         downloadImage() {
             if (this.processedImage) {
                 const link = document.createElement('a');
-                link.href = this.processedImage.image;
+                link.href = this.processedImage.url;
                 link.download = `证件照_${this.processedImage.size}.jpg`;
                 link.click();
             }
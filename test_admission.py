@@ -0,0 +1,75 @@
+import unittest
+import io
+import time
+from unittest import mock
+from PIL import Image
+from admission import AdmissionController, DeadlineExceeded, Overloaded, run_before_deadline
+from image_processor import ImageProcessor
+from engine import InlineEngine
+from ingest import ingest_stream
+
+
+class TestAdmission(unittest.TestCase):
+    def test_shed_when_queue_full(self):
+        """测试进行中的请求达到上限时立即拒绝"""
+        admission = AdmissionController(max_inflight=1, max_memory=1000)
+        with admission.admit(10):
+            with self.assertRaises(Overloaded) as context:
+                with admission.admit(10):
+                    pass
+            self.assertGreater(context.exception.retry_after, 0)
+        with admission.admit(10):
+            pass
+        stats = admission.stats()
+        self.assertEqual((stats['admitted'], stats['shed_queue'], stats['inflight']), (2, 1, 0))
+
+    def test_shed_when_memory_exhausted(self):
+        """测试内存预算不足时拒绝；空闲时超大请求仍然允许执行"""
+        admission = AdmissionController(max_inflight=10, max_memory=100)
+        with admission.admit(80):
+            with self.assertRaises(Overloaded):
+                with admission.admit(30):
+                    pass
+        with admission.admit(500):
+            pass
+        stats = admission.stats()
+        self.assertEqual((stats['shed_memory'], stats['memory']), (1, 0))
+
+    def test_deadline(self):
+        """测试过期的任务不执行，并计入 expired"""
+        admission = AdmissionController()
+        called = []
+        with self.assertRaises(DeadlineExceeded):
+            with admission.admit(0):
+                run_before_deadline(time.time() - 1, called.append, 1)
+        self.assertEqual(called, [])
+        self.assertEqual(run_before_deadline(time.time() + 60, sum, [1, 2]), 3)
+        self.assertEqual(run_before_deadline(None, sum, [1, 2]), 3)
+        self.assertEqual(admission.stats()['expired'], 1)
+
+    def test_expired_request_is_not_rendered(self):
+        """测试处理前已超过截止时间的请求不解码"""
+        processor = ImageProcessor(engine=InlineEngine())
+        image_file = io.BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(image_file, format='JPEG')
+        image_file.seek(0)
+        with mock.patch.object(processor, 'decode_image') as decode_image:
+            with self.assertRaises(DeadlineExceeded):
+                processor.process_results(image_file, ['一寸'], deadline=time.time() - 1)
+            decode_image.assert_not_called()
+
+    def test_estimate_memory_from_header(self):
+        """测试按图片头和解码缩放估算内存"""
+        processor = ImageProcessor(engine=InlineEngine())
+        image_file = io.BytesIO()
+        Image.new('RGB', (4000, 3000), 'red').save(image_file, format='JPEG')
+        image_file.seek(0)
+        upload = ingest_stream(image_file)
+        full = processor.estimate_memory(upload, [(4000, 3000)])
+        small = processor.estimate_memory(upload, [(100, 75)])
+        self.assertGreaterEqual(full, 4000 * 3000 * 3)
+        self.assertLess(small, full / 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+import unittest
+import os
+import io
+import shutil
+import tempfile
+import zipfile
+from PIL import Image
+from unittest import mock
+import app as app_module
+from app import app, admission
+from result_cache import ResultCache
+from config import PHOTO_SIZES, PREVIEW_MAX_EDGE, BACKGROUND_COLORS
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        # 结果缓存和批处理任务写入临时目录，不改动仓库中的 cache/ 和 batches/
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        for patch in (mock.patch.object(app_module.processor, 'cache',
+                                        ResultCache(cache_dir=os.path.join(work_dir, 'cache'))),
+                      mock.patch.object(app_module.batches, 'batch_dir', os.path.join(work_dir, 'batches'))):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = app.test_client()
+
+    def create_upload(self, size=(800, 600), filename='test.jpg', color='white'):
+        """创建上传用的测试图片"""
+        image = Image.new('RGB', size, color=color)
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='JPEG')
+        img_byte_arr.seek(0)
+        return (img_byte_arr, filename)
+
+    def post(self, url, **form):
+        """以 multipart 表单提交"""
+        form.setdefault('image', self.create_upload())
+        return self.client.post(url, data=form, content_type='multipart/form-data')
+
+    def test_process_returns_result_url(self):
+        """测试处理结果以二进制 URL 返回，并支持 ETag 304"""
+        size_name = list(PHOTO_SIZES.keys())[0]
+        response = self.post('/api/process', size=size_name)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['size'], size_name)
+
+        result = self.client.get(data['url'])
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'image/jpeg')
+        self.assertIn('immutable', result.headers['Cache-Control'])
+        self.assertEqual(Image.open(io.BytesIO(result.data)).size, PHOTO_SIZES[size_name])
+
+        etag = result.headers['ETag']
+        self.assertEqual(etag, f'"{data["url"].rsplit("/", 1)[1]}"')
+        not_modified = self.client.get(data['url'], headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+
+    def test_preview(self):
+        """测试预览缩小到最长边 PREVIEW_MAX_EDGE"""
+        response = self.post('/api/preview', size='二寸', image=self.create_upload((4000, 3000)))
+        self.assertEqual(response.status_code, 200)
+        result = self.client.get(response.get_json()['url'])
+        preview = Image.open(io.BytesIO(result.data))
+        self.assertEqual(max(preview.size), PREVIEW_MAX_EDGE)
+        self.assertEqual(self.post('/api/preview', size='bad').status_code, 400)
+
+    def test_unknown_result(self):
+        """测试无效或不存在的结果 ID"""
+        self.assertEqual(self.client.get('/api/result/../config.py').status_code, 404)
+        self.assertEqual(self.client.get(f"/api/result/{'0' * 32}_{'0' * 16}.jpg").status_code, 404)
+        # ETag 匹配也不能掩盖无效或不存在的结果
+        for result_id in ['bad', f"{'0' * 32}_{'0' * 16}.jpg"]:
+            response = self.client.get(f'/api/result/{result_id}', headers={'If-None-Match': f'"{result_id}"'})
+            self.assertEqual(response.status_code, 404)
+
+    def test_custom_size_and_process_all(self):
+        """测试自定义尺寸与多尺寸处理"""
+        response = self.post('/api/custom-size', width='200', height='300')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['size'], 'custom_200x300')
+
+        response = self.post('/api/process-all', sizes=['一寸', '200x300'])
+        self.assertEqual(response.status_code, 200)
+        sizes = [item['size'] for item in response.get_json()['images']]
+        self.assertEqual(sizes, ['一寸', 'custom_200x300'])
+
+        self.assertEqual(self.post('/api/process-all', sizes=['bad']).status_code, 400)
+
+    def test_adjust_without_upload(self):
+        """测试基于源图片 ID 调整亮度，无需重新上传"""
+        # 使用随机颜色，保证结果不在磁盘缓存中，几何中间结果由本次处理生成
+        color = tuple(os.urandom(3))
+        data = self.post('/api/process', size='一寸', image=self.create_upload(color=color)).get_json()
+        response = self.client.post('/api/adjust', data={
+            'source': data['source'], 'size': '一寸', 'brightness': '1.4'
+        })
+        self.assertEqual(response.status_code, 200)
+        adjusted = response.get_json()
+        self.assertNotEqual(adjusted['id'], data['id'])
+        self.assertEqual(self.client.get(adjusted['url']).status_code, 200)
+
+        response = self.client.post('/api/adjust', data={
+            'source': 'f' * 32, 'size': '一寸', 'brightness': '1.4'
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_image_rejected(self):
+        """测试扩展名正确但内容不是图片的上传返回 400"""
+        response = self.post('/api/process', size='一寸', image=(io.BytesIO(b'<html></html>'), 'test.jpg'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json(), {'error': '无效的图片文件'})
+
+    def test_batch_job(self):
+        """测试提交批处理、查询进度和下载结果 ZIP"""
+        response = self.client.post('/api/batch', data={
+            'images': [self.create_upload(filename='a.jpg'), (io.BytesIO(b'bad'), 'b.jpg')],
+            'sizes': ['一寸']
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertEqual(job['total'], 2)
+
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.mimetype, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(download.data)) as result:
+            self.assertIn('a_一寸.jpg', result.namelist())
+        status = self.client.get(job['status_url']).get_json()
+        self.assertEqual((status['done'], status['failed'], status['state']), (1, 1, 'completed'))
+
+        self.assertEqual(self.client.get(f"/api/batch/{'0' * 32}").status_code, 404)
+        self.assertEqual(self.client.post('/api/batch', data={}).status_code, 400)
+
+    def test_overloaded_and_expired_requests(self):
+        """测试排队已满返回 503 和 Retry-After，已超时的请求返回 504"""
+        with mock.patch.object(admission, 'max_inflight', 0):
+            response = self.post('/api/process', size='一寸')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+        response = self.client.post('/api/process', data={
+            'image': self.create_upload(), 'size': '一寸'
+        }, content_type='multipart/form-data', headers={'X-Request-Timeout': '0'})
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(self.client.get('/api/stats').get_json()['admission']['inflight'], 0)
+
+    def test_output_options(self):
+        """测试 max_bytes 结果不超过目标并返回实际质量，WebP 输出，目标过小返回 400"""
+        noise = Image.effect_noise((1200, 1600), 60).convert('RGB')
+        upload = io.BytesIO()
+        noise.save(upload, format='JPEG', quality=95)
+        response = self.post('/api/process', size='二寸', max_bytes='40000',
+                             image=(io.BytesIO(upload.getvalue()), 'noise.jpg'))
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertLessEqual(data['bytes'], 40000)
+        self.assertLess(data['quality'], 95)
+        result = self.client.get(data['url'])
+        self.assertEqual(len(result.data), data['bytes'])
+
+        response = self.post('/api/process', size='一寸', format='webp', quality='70')
+        self.assertEqual(response.get_json()['quality'], 70)
+        result = self.client.get(response.get_json()['url'])
+        self.assertEqual(result.mimetype, 'image/webp')
+
+        response = self.post('/api/process', size='二寸', max_bytes='300',
+                             image=(io.BytesIO(upload.getvalue()), 'noise.jpg'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post('/api/process', size='一寸', format='bmp').status_code, 400)
+
+    def test_background(self):
+        """测试替换背景色：不同颜色的结果 ID 不同，背景为指定颜色"""
+        upload = io.BytesIO()
+        image = Image.new('RGB', (800, 1100), (235, 235, 235))
+        image.paste((200, 150, 120), (250, 200, 550, 900))
+        image.save(upload, format='PNG')
+        ids = set()
+        for background in ('white', 'blue', 'red'):
+            response = self.post('/api/process', size='一寸', background=background, quality='100',
+                                 image=(io.BytesIO(upload.getvalue()), 'photo.png'))
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            ids.add(data['id'])
+            result = Image.open(io.BytesIO(self.client.get(data['url']).data))
+            for channel, expected in zip(result.getpixel((3, 3)), BACKGROUND_COLORS[background]):
+                self.assertLessEqual(abs(channel - expected), 4)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(self.post('/api/process', size='一寸', background='green').status_code, 400)
+
+    def test_sheet(self):
+        """测试冲印排版：上传生成，引用源图片重复冲印命中同一结果"""
+        response = self.post('/api/sheet', paper='6寸', sizes=['一寸', '二寸'], copies=['4', '2'])
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['items'], [{'size': '一寸', 'copies': 4}, {'size': '二寸', 'copies': 2}])
+        result = self.client.get(data['url'])
+        self.assertEqual(result.mimetype, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(result.data)).size, (1200, 1800))
+
+        response = self.client.post('/api/sheet', data={
+            'source': data['source'], 'paper': '6寸', 'sizes': ['一寸', '二寸'], 'copies': ['4', '2']})
+        self.assertEqual(response.get_json()['id'], data['id'])
+
+        self.assertEqual(self.post('/api/sheet', sizes='一寸', copies='100').status_code, 400)
+        self.assertEqual(self.client.post('/api/sheet', data={'source': 'x', 'sizes': '一寸'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/sheet', data={'sizes': '一寸'}).status_code, 400)
+
+    def test_metrics(self):
+        """测试 /metrics 以 Prometheus 文本格式输出阶段耗时和服务指标"""
+        self.post('/api/process', size='一寸')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+        for name in ('photo_stage_duration_seconds_count{stage="cache_io"}', 'photo_upload_bytes_total',
+                     'photo_cache_hit_ratio', 'photo_queue_depth', 'photo_inflight_requests'):
+            self.assertIn(name, text)
+
+if __name__ == '__main__':
+    unittest.main()
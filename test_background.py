@@ -0,0 +1,95 @@
+import unittest
+import io
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image, ImageDraw
+from background import background_mask, connected_to_border, estimate_background, replace_background
+from config import BACKGROUND_COLORS
+from engine import InlineEngine
+from image_processor import ImageProcessor
+from memory_cache import MemoryCache
+from result_cache import ResultCache
+from spec import ProcessingSpec
+
+def create_portrait(size=(413, 579), background=(236, 238, 242)):
+    """带噪声背景的模拟证件照：脸部中有与背景同色的封闭区域，白衬衫与下边相连"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    pixels = np.array(background, dtype=np.int16) + rng.integers(-6, 7, (height, width, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.29, height * 0.14, width * 0.7, height * 0.52), fill=(225, 180, 150))
+    draw.ellipse((width * 0.36, height * 0.26, width * 0.48, height * 0.31), fill=background)
+    draw.rectangle((width * 0.15, height * 0.66, width * 0.85, height), fill=(40, 40, 60))
+    draw.rectangle((width * 0.44, height * 0.72, width * 0.56, height), fill=(240, 240, 240))
+    return image
+
+class TestBackground(unittest.TestCase):
+    def setUp(self):
+        self.image = create_portrait()
+
+    def test_estimate_background(self):
+        """测试由边缘样本估计背景色和容差"""
+        color, tolerance = estimate_background(np.asarray(self.image))
+        for estimated, expected in zip(color, (236, 238, 242)):
+            self.assertLessEqual(abs(estimated - expected), 2)
+        self.assertGreater(tolerance, 0)
+
+    def test_mask(self):
+        """测试蒙版只包含与边缘连通的背景：脸部中同色的区域和与下边相连的白衬衫保留"""
+        mask = background_mask(self.image)
+        width, height = self.image.size
+        self.assertEqual(mask.getpixel((5, 5)), 255)
+        self.assertEqual(mask.getpixel((width - 3, height // 2)), 255)
+        self.assertEqual(mask.getpixel((width // 2, height * 2 // 5)), 0)
+        self.assertEqual(mask.getpixel((round(width * 0.42), round(height * 0.285))), 0)
+        self.assertEqual(mask.getpixel((width // 2, height - 5)), 0)
+
+    def test_connected_to_border(self):
+        """测试连通性沿多次转折的通道传播，不会越过前景进入封闭区域"""
+        candidates = np.zeros((60, 60), dtype=bool)
+        candidates[:4, :] = True
+        # 4 像素宽的蛇形通道：从上边开始来回折返
+        for index, row in enumerate(range(10, 50, 10)):
+            column = 8 if index % 2 == 0 else 48
+            candidates[row - 10:row + 4, column:column + 4] = True
+            candidates[row:row + 4, 8:52] = True
+        enclosed = np.zeros_like(candidates)
+        enclosed[54:58, 20:40] = True
+        connected = connected_to_border(candidates | enclosed)
+        self.assertTrue(connected[candidates].all())
+        self.assertFalse(connected[enclosed].any())
+
+    def test_replace_background(self):
+        """测试三种标准背景色，未指定时原样返回"""
+        self.assertIs(replace_background(self.image, None), self.image)
+        for name, color in BACKGROUND_COLORS.items():
+            result = replace_background(self.image, name)
+            self.assertEqual(result.size, self.image.size)
+            self.assertEqual(result.getpixel((5, 5)), color)
+            self.assertEqual(result.getpixel((self.image.width // 2, self.image.height // 3)), (225, 180, 150))
+
+    def test_spec_and_pipeline(self):
+        """测试背景色参与缓存键，并在几何中间结果之后替换"""
+        spec = ProcessingSpec.create('二寸', background='Blue')
+        self.assertEqual(spec.background, 'blue')
+        self.assertNotEqual(spec.cache_key, ProcessingSpec.create('二寸').cache_key)
+        self.assertNotEqual(spec.cache_key, ProcessingSpec.create('二寸', background='red').cache_key)
+        with self.assertRaises(ValueError):
+            ProcessingSpec.create('二寸', background='green')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        processor = ImageProcessor(ResultCache(cache_dir=cache_dir), InlineEngine())
+        processor.intermediates = MemoryCache(0)
+        source = io.BytesIO()
+        create_portrait((826, 1158)).save(source, format='PNG')
+        source.seek(0)
+        result = processor.process_image(source, ProcessingSpec.create('二寸', quality=100, background='blue'))
+        self.assertEqual(result.size, (413, 579))
+        for channel, expected in zip(result.getpixel((5, 5)), BACKGROUND_COLORS['blue']):
+            self.assertLessEqual(abs(channel - expected), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import io
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+from PIL import Image
+from batch import BatchJob, BatchManager, CANCELLED, COMPLETED, iter_zip
+from engine import InlineEngine
+from image_processor import ImageProcessor
+from result_cache import ResultCache
+from spec import ProcessingSpec
+
+
+def encode(color, size=(400, 300)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.batch_dir = tempfile.mkdtemp()
+        self.processor = ImageProcessor(ResultCache(cache_dir=self.cache_dir), InlineEngine())
+        self.batches = BatchManager(self.processor, batch_dir=self.batch_dir, workers=2, job_concurrency=2)
+        self.specs = [ProcessingSpec.create('一寸'), ProcessingSpec.create((200, 300))]
+
+    def tearDown(self):
+        self.batches.shutdown()
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.batch_dir)
+
+    def wait(self, job):
+        for item in job.items:
+            self.assertTrue(job.wait(item, timeout=30))
+
+    def test_failures_do_not_fail_job(self):
+        """测试单张图片失败只记录原因，任务中的其他图片正常处理"""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('team/alice.jpg', encode('red'))
+            zf.writestr('other/alice.jpg', encode('blue'))
+            zf.writestr('__MACOSX/team/._alice.jpg', b'')
+            zf.writestr('notes.txt', b'hello')
+        archive.seek(0)
+        job = self.batches.submit(self.specs,
+                                  files=[('bob.jpg', io.BytesIO(encode('green'))),
+                                         ('broken.jpg', io.BytesIO(b'not an image'))],
+                                  archives=[archive])
+        self.wait(job)
+
+        status = job.status()
+        self.assertEqual((status['state'], status['total'], status['done'], status['failed']),
+                         (COMPLETED, 5, 3, 2))
+        self.assertEqual({error['name'] for error in status['errors']}, {'broken.jpg', 'notes.txt'})
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip(job)))) as result:
+            names = set(result.namelist())
+            self.assertIn('bob_一寸.jpg', names)
+            self.assertIn('alice_custom_200x300.jpg', names)
+            # 不同目录中的同名文件不会互相覆盖
+            self.assertEqual(len([name for name in names if name.startswith('alice')]), 4)
+            report = json.loads(result.read('report.json'))
+            self.assertEqual(report['status']['failed'], 2)
+            size = Image.open(io.BytesIO(result.read('bob_一寸.jpg'))).size
+            self.assertEqual(size, ProcessingSpec.create('一寸').size)
+
+        # 其他服务进程从 job.json 读取相同的状态
+        self.batches.jobs.clear()
+        self.assertEqual(self.batches.get(job.id).status(), status)
+        self.assertIsNone(self.batches.get('../' + job.id))
+
+    def test_download_streams_while_running(self):
+        """测试任务运行中开始下载，ZIP 随处理进度写出"""
+        release = threading.Event()
+        process_upload = self.processor.process_upload
+
+        def slow_process(upload, specs):
+            release.wait(10)
+            return process_upload(upload, specs)
+
+        with mock.patch.object(self.processor, 'process_upload', side_effect=slow_process):
+            job = self.batches.submit(self.specs[:1], files=[
+                (f'{index}.jpg', io.BytesIO(encode((index, 0, 0)))) for index in range(3)
+            ])
+            chunks = iter_zip(job)
+            self.assertEqual(job.status()['state'], 'running')
+            release.set()
+            data = b''.join(chunks)
+        with zipfile.ZipFile(io.BytesIO(data)) as result:
+            self.assertEqual(len(result.namelist()), 4)
+
+    def test_job_concurrency_limit(self):
+        """测试每个任务同时处理的图片数不超过 job_concurrency"""
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def tracked(upload, specs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return {spec.size_name: 'missing' for spec in specs}
+
+        batches = BatchManager(self.processor, batch_dir=self.batch_dir, workers=8, job_concurrency=2)
+        with mock.patch.object(self.processor, 'process_upload', side_effect=tracked):
+            job = batches.submit(self.specs[:1], files=[
+                (f'{index}.jpg', io.BytesIO(encode('white'))) for index in range(8)
+            ])
+            self.wait(job)
+        batches.shutdown()
+        self.assertEqual(peak[0], 2)
+        # 结果不在缓存中时该图片记为失败
+        self.assertEqual(job.status()['failed'], 8)
+
+    def test_shutdown_cancels_pending(self):
+        """测试停止时尚未开始的图片记为失败、任务记为已取消，过期后由 sweep 删除"""
+        started, release = threading.Event(), threading.Event()
+
+        def blocked(upload, specs):
+            started.set()
+            release.wait(30)
+            return {spec.size_name: 'missing' for spec in specs}
+
+        batches = BatchManager(self.processor, batch_dir=self.batch_dir, workers=1, job_concurrency=1, ttl=0)
+        with mock.patch.object(self.processor, 'process_upload', side_effect=blocked):
+            job = batches.submit(self.specs[:1], files=[
+                (f'{index}.jpg', io.BytesIO(encode('white'))) for index in range(3)
+            ])
+            self.assertTrue(started.wait(30))
+            stopper = threading.Thread(target=batches.shutdown)
+            stopper.start()
+            self.assertTrue(batches._stopping.wait(30))
+            release.set()
+            stopper.join(30)
+        self.wait(job)
+
+        status = job.status()
+        self.assertEqual((status['state'], status['failed'], status['pending']), (CANCELLED, 3, 0))
+        self.assertEqual(sum(error['error'].startswith('Cancelled') for error in status['errors']), 2)
+        self.assertEqual(os.listdir(job.source_dir), [])
+        self.assertEqual(BatchJob.load(job.dir).state, CANCELLED)
+
+        batches.sweep()
+        self.assertFalse(os.path.exists(job.dir))
+
+    def test_invalid_archive(self):
+        """测试损坏的 ZIP 不创建任务"""
+        with self.assertRaises(ValueError):
+            self.batches.submit(self.specs, archives=[io.BytesIO(b'PK broken')])
+        self.assertEqual((self.batches.jobs, os.listdir(self.batch_dir)), ({}, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import io
+import os
+import json
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+import cli
+from spec import ProcessingSpec
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.root, 'in')
+        self.output_dir = os.path.join(self.root, 'out')
+        os.makedirs(os.path.join(self.input_dir, 'team'))
+        for index, name in enumerate(['a.jpg', 'team/b.png']):
+            Image.new('RGB', (600, 400), (index * 80, 40, 90)).save(os.path.join(self.input_dir, name))
+        with open(os.path.join(self.input_dir, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_cli(self, *args):
+        argv = [self.input_dir, '-s', '一寸', '-s', '200x300', '-o', self.output_dir, '-j', '1',
+                '--cache-dir', os.path.join(self.root, 'cache'), *args]
+        with mock.patch('sys.stderr', io.StringIO()):
+            return cli.main(argv)
+
+    def test_process_and_resume(self):
+        """测试批量处理、清单记录，以及重新运行时跳过已完成的图片"""
+        self.assertEqual(self.run_cli(), 1)
+        output = os.path.join(self.output_dir, 'team', 'b_custom_200x300.jpg')
+        self.assertEqual(Image.open(output).size, (200, 300))
+        with open(os.path.join(self.output_dir, 'manifest.jsonl'), encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(len(entries[0]['hash']), 32)
+
+        with mock.patch('cli.process_file', side_effect=cli.process_file) as process_file:
+            self.run_cli()
+        # 只有失败的图片重新处理
+        self.assertEqual([call.args[0] for call in process_file.call_args_list],
+                         [os.path.abspath(os.path.join(self.input_dir, 'broken.jpg'))])
+
+        # 新增尺寸时只补充缺少的输出
+        os.remove(os.path.join(self.input_dir, 'broken.jpg'))
+        with mock.patch('cli.process_file', side_effect=cli.process_file) as process_file:
+            self.assertEqual(self.run_cli('-s', '二寸'), 0)
+        self.assertEqual(process_file.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'a_二寸.jpg')))
+
+    def test_output_options(self):
+        """测试输出格式和字节数目标选项"""
+        os.remove(os.path.join(self.input_dir, 'broken.jpg'))
+        self.assertEqual(self.run_cli('--format', 'webp', '--max-bytes', '50000'), 0)
+        output = os.path.join(self.output_dir, 'a_一寸.webp')
+        self.assertEqual(Image.open(output).format, 'WEBP')
+        self.assertLessEqual(os.path.getsize(output), 50000)
+        with self.assertRaises(SystemExit):
+            self.run_cli('--max-bytes', '0')
+
+    def test_collect_sources(self):
+        """测试目录和通配符输入，以及输出路径保持相对目录"""
+        sources = cli.collect_sources([os.path.join(self.input_dir, '**', '*.png')])
+        self.assertEqual([relative for _, relative in sources], [os.path.join('team', 'b.png')])
+        spec = ProcessingSpec.create('一寸')
+        self.assertEqual(cli.output_path('out', os.path.join('team', 'b.png'), spec),
+                         os.path.join('out', 'team', 'b_一寸.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
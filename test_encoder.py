@@ -0,0 +1,91 @@
+import unittest
+import io
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+from PIL import Image, ImageDraw
+import encoder
+from encoder import TargetTooSmall, encode, read_quality
+from spec import ProcessingSpec, parse_output_options
+from config import ENCODE_MAX_ATTEMPTS
+
+class TestEncoder(unittest.TestCase):
+    def setUp(self):
+        # 有细节的图片，文件大小随质量明显变化
+        self.image = Image.effect_mandelbrot((413, 579), (-2, -1.25, 0.75, 1.25), 80).convert('RGB')
+        draw = ImageDraw.Draw(self.image)
+        for x in range(0, 413, 7):
+            draw.line((x, 0, 413 - x, 579), fill=(x % 256, 120, 200), width=2)
+
+    def test_max_bytes(self):
+        """测试字节数目标：结果不超过 max_bytes，编码次数有上限，质量写入 EXIF 并可读回"""
+        unconstrained = encode(self.image, ProcessingSpec.create('二寸'))
+        spec = ProcessingSpec.create('二寸', max_bytes=unconstrained.size // 3)
+        with mock.patch.object(encoder, 'encode_at', wraps=encoder.encode_at) as encode_at:
+            result = encode(self.image, spec)
+        self.assertLessEqual(result.size, spec.max_bytes)
+        self.assertLess(result.quality, spec.quality)
+        self.assertLessEqual(encode_at.call_count, ENCODE_MAX_ATTEMPTS + 1)
+        # 质量再提高 1 就超出目标（或已达到上限）
+        self.assertGreater(len(encoder.encode_at(self.image, spec, result.quality + 1, stamp=True)),
+                           spec.max_bytes)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'result.jpg')
+            with open(path, 'wb') as f:
+                f.write(result.data)
+            self.assertEqual(read_quality(path, spec), result.quality)
+            self.assertEqual(read_quality(path, ProcessingSpec.create('二寸')), 95)
+
+    def test_max_bytes_noisy(self):
+        """测试噪点多的照片类内容：体积与模型偏差大时仍找到满足目标的最高质量，编码不超过 4 次"""
+        height, width = 579, 413
+        noise = np.random.default_rng(0).normal(0, 30, (2, height, width))
+        pixels = np.stack([np.linspace(0, 255, height)[:, None] + noise[0],
+                           np.broadcast_to(np.linspace(0, 255, height)[:, None], (height, width)),
+                           np.linspace(255, 0, width)[None, :] + noise[1]], axis=-1)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+        spec = ProcessingSpec.create('二寸', max_bytes=20000)
+        with mock.patch.object(encoder, 'encode_at', wraps=encoder.encode_at) as encode_at:
+            result = encode(image, spec)
+        self.assertLessEqual(result.size, spec.max_bytes)
+        self.assertGreater(len(encoder.encode_at(image, spec, result.quality + 1, stamp=True)), spec.max_bytes)
+        self.assertLessEqual(encode_at.call_count, 4)
+
+    def test_target_too_small(self):
+        """测试最低质量仍超出目标时抛出 TargetTooSmall（ValueError 的子类）"""
+        with self.assertRaises(TargetTooSmall):
+            encode(self.image, ProcessingSpec.create('二寸', max_bytes=500))
+        self.assertTrue(issubclass(TargetTooSmall, ValueError))
+
+    def test_formats_and_options(self):
+        """测试 WebP、渐进式 JPEG、色度抽样和 PNG"""
+        webp = encode(self.image, ProcessingSpec.create('二寸', format='webp', quality=80))
+        self.assertEqual(Image.open(io.BytesIO(webp.data)).format, 'WEBP')
+        self.assertEqual(webp.quality, 80)
+
+        progressive = encode(self.image, ProcessingSpec.create('二寸', progressive=True, subsampling='4:4:4'))
+        image = Image.open(io.BytesIO(progressive.data))
+        self.assertTrue(image.info.get('progressive'))
+        self.assertEqual(image.layer[0][1:3], (1, 1))
+
+        png = encode(self.image, ProcessingSpec.create('二寸', format='PNG'))
+        self.assertIsNone(png.quality)
+        self.assertEqual(Image.open(io.BytesIO(png.data)).format, 'PNG')
+
+    def test_spec_options(self):
+        """测试默认选项不改变缓存键，无效选项抛出 ValueError"""
+        default = ProcessingSpec.create('一寸')
+        self.assertEqual(default.cache_key, ProcessingSpec.create('一寸', format='jpeg').cache_key)
+        self.assertNotEqual(default.cache_key, ProcessingSpec.create('一寸', max_bytes=20000).cache_key)
+        self.assertNotEqual(default.cache_key, ProcessingSpec.create('一寸', progressive=True).cache_key)
+        for options in ({'format': 'BMP'}, {'max_bytes': 0}, {'quality': 101}, {'subsampling': '4:1:1'}):
+            with self.assertRaises(ValueError):
+                ProcessingSpec.create('一寸', **options)
+
+        options = parse_output_options({'format': 'webp', 'max_bytes': '30000', 'progressive': 'on'})
+        self.assertEqual(options, {'format': 'webp', 'max_bytes': 30000, 'progressive': True})
+
+if __name__ == '__main__':
+    unittest.main()
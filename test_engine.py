@@ -0,0 +1,61 @@
+import unittest
+import io
+import shutil
+import tempfile
+from PIL import Image
+from engine import InlineEngine, ThreadEngine, create_engine, open_shared, share_bytes
+from image_processor import ImageProcessor, init_worker
+from result_cache import ResultCache
+
+class TestEngine(unittest.TestCase):
+    def test_engines(self):
+        """测试各执行引擎返回结果和异常"""
+        for engine in (InlineEngine(), ThreadEngine(2)):
+            self.assertEqual(engine.submit(pow, 2, 10).result(), 1024)
+            with self.assertRaises(ValueError):
+                engine.submit(int, 'bad').result()
+            engine.shutdown()
+        with self.assertRaises(ValueError):
+            create_engine('gpu', 1)
+
+    def test_shared_memory_reader(self):
+        """测试通过共享内存读取数据"""
+        data = bytes(range(256)) * 10
+        block = share_bytes(data)
+        try:
+            with open_shared(block.name, len(data)) as reader:
+                self.assertEqual(reader.read(16), data[:16])
+                reader.seek(-16, io.SEEK_END)
+                self.assertEqual(reader.read(), data[-16:])
+                reader.seek(0)
+                self.assertEqual(reader.read(), data)
+        finally:
+            block.close()
+            block.unlink()
+
+    def create_processor(self, engine):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        processor = ImageProcessor(ResultCache(cache_dir=cache_dir), engine)
+        self.addCleanup(engine.shutdown)
+        return processor
+
+    def test_process_engine_matches_thread_engine(self):
+        """测试进程模式与线程模式的处理结果一致"""
+        image = Image.linear_gradient('L').resize((1200, 900)).convert('RGB')
+        upload = io.BytesIO()
+        image.save(upload, format='JPEG')
+
+        outputs = []
+        for engine in (create_engine('thread', 1), create_engine('process', 1, init_worker)):
+            processor = self.create_processor(engine)
+            result_ids = processor.process_results(io.BytesIO(upload.getvalue()), ['一寸'], brightness=1.2)
+            with open(processor.get_result_path(result_ids['一寸']), 'rb') as result_file:
+                outputs.append(result_file.read())
+            # 几何中间结果保存在主进程中，可以直接调整亮度
+            source = processor.hash_file(io.BytesIO(upload.getvalue()))
+            processor.readjust_results(source, ['一寸'], brightness=0.8)
+        self.assertEqual(outputs[0], outputs[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from geometry import (EXIF_TRANSPOSES, apply_geometry, center_crop_box, compose_transposes,
+                      plan_auto_rotation, plan_geometry, plan_orientation)
+
+T = Image.Transpose
+
+
+class TestGeometry(unittest.TestCase):
+    def create_test_image(self, size):
+        """创建四角颜色不同的测试图片，便于发现方向错误"""
+        image = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(image)
+        width, height = size
+        draw.rectangle((0, 0, width // 3, height // 3), fill='red')
+        draw.rectangle((width * 2 // 3, 0, width, height // 3), fill='green')
+        draw.rectangle((0, height * 2 // 3, width // 3, height), fill='blue')
+        return image
+
+    def reference_pipeline(self, image, orientation, target_size):
+        """逐步执行变换、裁剪和缩放的参考实现"""
+        for operation in plan_orientation(image.size, orientation):
+            image = image.transpose(operation)
+        for operation in plan_auto_rotation(image.size, target_size):
+            image = image.transpose(operation)
+        image = image.crop(center_crop_box(image.size, target_size))
+        return image.resize(target_size, Image.Resampling.LANCZOS)
+
+    def test_compose_transposes(self):
+        """测试变换合成"""
+        self.assertIsNone(compose_transposes([]))
+        self.assertIsNone(compose_transposes([T.ROTATE_90, T.ROTATE_270]))
+        self.assertEqual(compose_transposes([T.ROTATE_90, T.ROTATE_90]), T.ROTATE_180)
+        self.assertEqual(compose_transposes([T.FLIP_LEFT_RIGHT, T.ROTATE_90]), T.TRANSPOSE)
+
+        image = self.create_test_image((60, 40))
+        for operations in EXIF_TRANSPOSES.values():
+            expected = image
+            for operation in operations:
+                expected = expected.transpose(operation)
+            actual = image.transpose(compose_transposes(operations))
+            self.assertEqual(expected.tobytes(), actual.tobytes())
+
+    def test_orientation_heuristics(self):
+        """测试方向修正规则"""
+        self.assertEqual(plan_orientation((800, 600), 1), [])
+        self.assertEqual(plan_orientation((600, 800), 6), [T.ROTATE_270])
+        # 横图经 EXIF 旋转后变窄时额外旋转 90 度
+        self.assertEqual(plan_orientation((800, 600), 6), [T.ROTATE_270, T.ROTATE_90])
+        self.assertEqual(plan_auto_rotation((800, 600), (295, 413)), [T.ROTATE_270])
+        self.assertEqual(plan_auto_rotation((600, 800), (295, 413)), [])
+
+    def test_single_pass_matches_reference(self):
+        """测试单次缩放结果与逐步处理一致"""
+        for size in ((800, 600), (600, 800), (640, 640)):
+            image = self.create_test_image(size)
+            for orientation in range(1, 9):
+                for target_size in ((295, 413), (413, 295)):
+                    plan = plan_geometry(size, orientation, target_size)
+                    actual = apply_geometry(image, plan)
+                    expected = self.reference_pipeline(image, orientation, target_size)
+                    self.assertEqual(actual.size, target_size)
+                    diff = ImageStat.Stat(ImageChops.difference(actual, expected)).mean
+                    self.assertLessEqual(max(diff), 1, f"{size} {orientation} {target_size}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,23 @@
 import unittest
 import os
 import io
-from PIL import Image
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageDraw, ImageEnhance, ImageStat
 from image_processor import ImageProcessor
-from config import PHOTO_SIZES, CACHE_DIR
+from config import PHOTO_SIZES
+from memory_cache import MemoryCache
+from result_cache import ResultCache
+from spec import ProcessingSpec
 
 class TestImageProcessor(unittest.TestCase):
     def setUp(self):
-        self.processor = ImageProcessor()
+        # 结果写入临时缓存目录，不改动仓库中的 cache/
+        self.cache_dir = tempfile.mkdtemp()
+        self.processor = ImageProcessor(ResultCache(cache_dir=self.cache_dir))
         self.test_image = self.create_test_image()
 
     def create_test_image(self, size=(800, 600)):
@@ -18,6 +28,27 @@ class TestImageProcessor(unittest.TestCase):
         img_byte_arr.seek(0)
         return img_byte_arr
 
+    def create_detailed_image(self, size, format='JPEG'):
+        """创建带渐变和色块的测试图片，用于比较缩放质量"""
+        width, height = size
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        for x in range(0, width, width // 12):
+            draw.ellipse((x, height // 4, x + width // 14, height // 2), fill=(200, 30, 90))
+        draw.rectangle((width // 3, height // 2, width // 2, height * 3 // 4), fill=(20, 160, 220))
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format=format)
+        img_byte_arr.seek(0)
+        return img_byte_arr
+
+    def process_uncached(self, image_file, size_name, **kwargs):
+        """绕过缓存处理图片"""
+        with mock.patch.object(ImageProcessor, 'get_cached_image', return_value=None), \
+                mock.patch.object(ImageProcessor, 'cache_image'), \
+                mock.patch.object(self.processor, 'intermediates', MemoryCache(0)):
+            image_file.seek(0)
+            return self.processor.process_image(image_file, size_name, **kwargs)
+
     def test_file_validation(self):
         """测试文件验证"""
         # 有效文件
@@ -56,6 +87,36 @@ class TestImageProcessor(unittest.TestCase):
         contrasted = self.processor.adjust_image(image, contrast=1.5)
         self.assertIsNotNone(contrasted)
 
+    def test_tone_lut_parity(self):
+        """测试查找表调整与 ImageEnhance 依次处理的结果一致"""
+        image = Image.open(self.create_detailed_image((413, 579))).convert('RGB')
+        for brightness, contrast in ((1.3, 1.0), (1.0, 0.7), (0.8, 1.4), (1.2, 1.2)):
+            expected = image
+            if brightness != 1.0:
+                expected = ImageEnhance.Brightness(expected).enhance(brightness)
+            if contrast != 1.0:
+                expected = ImageEnhance.Contrast(expected).enhance(contrast)
+            actual = self.processor.adjust_image(image, brightness, contrast)
+            diff = ImageChops.difference(actual, expected).getextrema()
+            self.assertLessEqual(max(high for _, high in diff), 1, f"{brightness} {contrast}")
+
+    def test_process_many(self):
+        """测试一次解码生成多个尺寸"""
+        image_file = self.create_detailed_image((1600, 1200))
+        sizes = ['一寸', '二寸', (200, 300)]
+        with mock.patch.object(ImageProcessor, 'open_image', wraps=self.processor.open_image) as open_image:
+            with mock.patch.object(ImageProcessor, 'get_cached_image', return_value=None), \
+                    mock.patch.object(ImageProcessor, 'cache_image'):
+                results = self.processor.process_many(image_file, sizes)
+        self.assertEqual(open_image.call_count, 1)
+        self.assertEqual(list(results), ['一寸', '二寸', 'custom_200x300'])
+        self.assertEqual(results['一寸'].size, PHOTO_SIZES['一寸'])
+        self.assertEqual(results['custom_200x300'].size, (200, 300))
+
+        # 与单独处理的结果一致
+        single = self.process_uncached(image_file, '二寸')
+        self.assertEqual(results['二寸'].tobytes(), single.tobytes())
+
     def test_caching(self):
         """测试缓存功能"""
         size_name = list(PHOTO_SIZES.keys())[0]
@@ -74,12 +135,114 @@ class TestImageProcessor(unittest.TestCase):
             processed2.tobytes()
         )
 
+    def test_decode_scale(self):
+        """测试解码缩小倍数的计算"""
+        # 4000x3000 裁剪为二寸（413x579）时短边比为 3000/413
+        self.assertEqual(ImageProcessor.calculate_decode_scale((4000, 3000), (413, 579)), 3)
+        self.assertEqual(ImageProcessor.calculate_decode_scale((3000, 4000), (413, 579)), 3)
+        # 小图不缩小
+        self.assertEqual(ImageProcessor.calculate_decode_scale((800, 600), (413, 579)), 1)
+
+    def test_decode_downscale_parity(self):
+        """测试解码时缩小的结果与全分辨率解码一致（每通道平均误差不超过 2）"""
+        for format in ('JPEG', 'PNG'):
+            for size in ((4000, 3000), (3000, 4000)):
+                image_file = self.create_detailed_image(size, format)
+                fast = self.process_uncached(image_file, '二寸')
+                with mock.patch.object(ImageProcessor, 'calculate_decode_scale', return_value=1):
+                    full = self.process_uncached(image_file, '二寸')
+                self.assertEqual(fast.size, full.size)
+                diff = ImageStat.Stat(ImageChops.difference(fast, full)).mean
+                self.assertLessEqual(max(diff), 2, f"{format} {size}: {diff}")
+
+    def test_spec_cache_key(self):
+        """测试缓存键包含全部处理参数"""
+        base = ProcessingSpec.create('一寸')
+        self.assertEqual(base.cache_key, ProcessingSpec.create((295, 413)).cache_key)
+        self.assertNotEqual(base.cache_key, ProcessingSpec.create('一寸', brightness=1.2).cache_key)
+        self.assertNotEqual(base.cache_key, ProcessingSpec.create('一寸', quality=80).cache_key)
+        self.assertNotIn('custom_100x120', PHOTO_SIZES)
+        with self.assertRaises(ValueError):
+            ProcessingSpec.create('不存在')
+
+    def test_cache_respects_adjustments(self):
+        """测试不同亮度的请求不会命中彼此的缓存"""
+        image_file = self.create_detailed_image((800, 600))
+        normal = self.processor.process_image(image_file, '一寸')
+        image_file.seek(0)
+        brighter = self.processor.process_image(image_file, '一寸', brightness=1.5)
+        self.assertNotEqual(normal.tobytes(), brighter.tobytes())
+
+    def test_cache_hit_skips_decode(self):
+        """测试结果命中缓存时不打开图片"""
+        size_name = list(PHOTO_SIZES.keys())[0]
+        first = self.processor.process_results(self.test_image, [size_name])
+        self.test_image.seek(0)
+        with mock.patch('image_processor.Image.open') as image_open:
+            second = self.processor.process_results(self.test_image, [size_name])
+        image_open.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_readjust_reuses_intermediate(self):
+        """测试调整亮度/对比度时复用几何中间结果，不重新解码"""
+        # 使用空的临时缓存目录，保证本次处理生成几何中间结果
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.processor = ImageProcessor(ResultCache(cache_dir=cache_dir))
+
+        image_file = self.create_detailed_image((1600, 1200))
+        file_hash = self.processor.hash_file(image_file)
+        self.processor.process_results(image_file, ['一寸'])
+
+        with mock.patch.object(ImageProcessor, 'decode_image') as decode_image:
+            result_ids = self.processor.readjust_results(file_hash, ['一寸'], brightness=1.3)
+        decode_image.assert_not_called()
+
+        adjusted = Image.open(self.processor.get_result_path(result_ids['一寸']))
+        expected = self.process_uncached(image_file, '一寸', brightness=1.3)
+        diff = ImageStat.Stat(ImageChops.difference(adjusted.convert('RGB'), expected)).mean
+        self.assertLessEqual(max(diff), 2)
+
+        # 没有中间结果时需要重新上传
+        with self.assertRaises(KeyError):
+            self.processor.readjust_results('0' * 32, ['一寸'], brightness=1.3)
+
+    def test_concurrent_requests_are_coalesced(self):
+        """测试相同源图片和参数的并发请求只处理一次"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.processor = ImageProcessor(ResultCache(cache_dir=cache_dir))
+        data = self.create_detailed_image((1600, 1200)).getvalue()
+
+        # 第一个请求在解码时等待放行；其余 3 个请求开始等待它的结果时到达屏障，全部到达后才放行
+        release = threading.Event()
+        arrived = threading.Barrier(4)
+
+        class ArrivingFuture(Future):
+            def result(self, timeout=None):
+                arrived.wait(30)
+                return super().result(timeout)
+
+        decode_image = self.processor.decode_image
+        def blocked_decode(*args):
+            release.wait(30)
+            return decode_image(*args)
+
+        with mock.patch.object(self.processor, 'decode_image', side_effect=blocked_decode) as decode, \
+                mock.patch('singleflight.Future', ArrivingFuture):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(self.processor.process_results, io.BytesIO(data), ['一寸'])
+                           for _ in range(4)]
+                arrived.wait(30)
+                release.set()
+                results = [future.result() for future in futures]
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(len(set(result['一寸'] for result in results)), 1)
+        self.assertEqual(self.processor.flights.stats()['coalesced'], 3)
+
     def tearDown(self):
         """清理测试环境"""
-        # 清理测试过程中创建的缓存文件
-        for filename in os.listdir(CACHE_DIR):
-            if filename.startswith('test_'):
-                os.remove(os.path.join(CACHE_DIR, filename))
+        shutil.rmtree(self.cache_dir)
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,59 @@
+import unittest
+import io
+from PIL import Image
+from ingest import (ImageTooLarge, InvalidImage, UploadIngest, ingest_stream, read_header,
+                    sniff_format)
+from image_processor import ImageProcessor
+
+
+def encode(image, image_format, **params):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **params)
+    return output.getvalue()
+
+
+class TestIngest(unittest.TestCase):
+    def test_header_without_decode(self):
+        """测试只解析文件头得到格式、尺寸、模式和 EXIF 方向"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        data = encode(Image.new('RGB', (640, 480), 'red'), 'JPEG', exif=exif.tobytes())
+        header = read_header(data)
+        self.assertEqual((header.format, header.size, header.mode, header.orientation),
+                         ('JPEG', (640, 480), 'RGB', 6))
+
+        self.assertEqual(read_header(encode(Image.new('P', (8, 4)), 'GIF')).format, 'GIF')
+        self.assertEqual(sniff_format(encode(Image.new('RGBA', (8, 4)), 'PNG')), 'PNG')
+        self.assertIsNone(sniff_format(b'%PDF-1.4'))
+
+    def test_hash_matches_whole_file_hash(self):
+        """测试增量哈希与整个文件的哈希一致，内容不被修改"""
+        data = encode(Image.effect_noise((300, 200), 64).convert('RGB'), 'JPEG')
+        upload = ingest_stream(io.BytesIO(data), chunk_size=1000)
+        self.assertEqual(upload.file_hash, ImageProcessor.get_file_hash(data))
+        self.assertEqual(upload.open().read(), data)
+        self.assertEqual(len(upload), len(data))
+
+    def test_reject_early(self):
+        """测试无效的文件头和超过像素限制的图片在收到第一块时就被拒绝"""
+        ingest = UploadIngest()
+        with self.assertRaises(InvalidImage):
+            ingest.write(b'MZ' + b'\0' * 1000)
+
+        bomb = encode(Image.new('1', (10000, 10000)), 'PNG')
+        ingest = UploadIngest(max_pixels=64 * 1000 * 1000)
+        with self.assertRaises(ImageTooLarge):
+            ingest.write(bomb[:4096])
+
+        with self.assertRaises(ImageTooLarge):
+            ingest_stream(io.BytesIO(bomb), max_bytes=1024)
+
+    def test_truncated_header(self):
+        """测试文件头不完整的上传在接收完成时拒绝"""
+        data = encode(Image.new('RGB', (64, 64)), 'JPEG')
+        with self.assertRaises(InvalidImage):
+            ingest_stream(io.BytesIO(data[:10]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+from log_setup import DeferredQueueHandler, JsonFormatter, JsonMessage, TEXT_FORMAT, request_log
+import metrics
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JsonFormatter(TEXT_FORMAT))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+class TestLogSetup(unittest.TestCase):
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger(f'test.{self.id()}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def test_request_record(self):
+        """测试每个请求一条 JSON 记录，包含字段和各阶段耗时"""
+        with request_log(self.logger, 'results', rate=1, source='abc') as record:
+            with metrics.stage('decode'):
+                pass
+            record['cached'] = 1
+        self.assertEqual(len(self.handler.lines), 1)
+        entry = json.loads(self.handler.lines[0])
+        self.assertEqual((entry['event'], entry['source'], entry['cached']), ('results', 'abc', 1))
+        self.assertIn('decode', entry['stages_ms'])
+        self.assertEqual(entry['level'], 'INFO')
+
+    def test_sampling_keeps_failures(self):
+        """测试未采样的成功请求不记录，失败的请求总是记录"""
+        with request_log(self.logger, 'results', rate=0):
+            pass
+        self.assertEqual(self.handler.lines, [])
+        with self.assertRaises(KeyError):
+            with request_log(self.logger, 'results', rate=0):
+                raise KeyError('expired')
+        entry = json.loads(self.handler.lines[0])
+        self.assertEqual(entry['level'], 'WARNING')
+        self.assertIn('KeyError', entry['error'])
+
+    def test_deferred_formatting(self):
+        """测试消息在监听线程中才序列化，调用线程只入队"""
+        serialized = []
+
+        class Message(JsonMessage):
+            def as_dict(self):
+                serialized.append(True)
+                return super().as_dict()
+
+        log_queue = queue.SimpleQueue()
+        logger = logging.getLogger('test.deferred')
+        logger.propagate = False
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        logger.setLevel(logging.INFO)
+        logger.info(Message({'event': 'x'}))
+        self.assertEqual(serialized, [])
+
+        listener = QueueListener(log_queue, self.handler)
+        listener.start()
+        listener.stop()
+        self.assertEqual(json.loads(self.handler.lines[0])['event'], 'x')
+
+    def test_text_records(self):
+        """测试普通记录仍使用文本格式"""
+        self.logger.info('Cache sweep evicted %d files', 3)
+        self.assertTrue(self.handler.lines[0].endswith('INFO - Cache sweep evicted 3 files'))
+
+if __name__ == '__main__':
+    unittest.main()
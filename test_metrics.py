@@ -0,0 +1,64 @@
+import unittest
+import io
+import shutil
+import tempfile
+from PIL import Image
+import metrics
+from engine import create_engine
+from image_processor import ImageProcessor, init_worker
+from result_cache import ResultCache
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets(self):
+        """测试直方图按桶累计，超过最大桶上限的计入 +Inf"""
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        buckets, total, count = histogram.snapshot()
+        self.assertEqual(buckets, [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertAlmostEqual(total, 3.65)
+        self.assertEqual(count, 4)
+
+    def test_record_timings(self):
+        """测试计时记录只包含 with 块内的阶段和计数"""
+        with metrics.stage('outside'):
+            pass
+        with metrics.record_timings() as timings:
+            with metrics.stage('decode'):
+                pass
+            with metrics.stage('decode'):
+                pass
+            metrics.count('upload_bytes', 10)
+        self.assertEqual(list(timings.stages), ['decode'])
+        self.assertEqual(timings.counts, {'upload_bytes': 10})
+        self.assertGreaterEqual(timings.total, 0)
+
+    def test_render(self):
+        """测试 Prometheus 文本格式"""
+        with metrics.stage('encode'):
+            pass
+        text = metrics.render([('queue_depth', '排队请求数', 3)])
+        self.assertIn('# TYPE photo_stage_duration_seconds histogram', text)
+        self.assertIn('photo_stage_duration_seconds_bucket{stage="encode",le="+Inf"}', text)
+        self.assertIn('photo_stage_duration_seconds_count{stage="encode"}', text)
+        self.assertIn('# TYPE photo_upload_bytes_total counter', text)
+        self.assertIn('photo_queue_depth 3\n', text)
+
+    def test_pipeline_stages(self):
+        """测试线程和进程引擎的处理阶段都计入调用方的计时记录"""
+        upload = io.BytesIO()
+        Image.new('RGB', (1200, 900), 'gray').save(upload, format='JPEG')
+        for engine in (create_engine('thread', 1), create_engine('process', 1, init_worker)):
+            cache_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, cache_dir)
+            self.addCleanup(engine.shutdown)
+            processor = ImageProcessor(ResultCache(cache_dir=cache_dir), engine)
+            with metrics.record_timings() as timings:
+                processor.process_results(io.BytesIO(upload.getvalue()), ['一寸'], brightness=1.2)
+            self.assertTrue({'decode', 'resize', 'enhance', 'encode', 'cache_io'} <= set(timings.stages),
+                            (engine.mode, timings.stages))
+            self.assertGreater(timings.counts['decoded_megapixels'], 0)
+            self.assertGreater(timings.counts['result_bytes'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import queue
+import sqlite3
+from unittest import mock
+import cache_index
+from cache_index import LOCK_SUFFIX, file_lock
+from engine import process_context
+from result_cache import ResultCache
+
+
+def open_and_put(cache_dir, barrier, results, index):
+    """在另一个进程中与其他进程同时打开（重建）索引并写入一个结果"""
+    cache = ResultCache(cache_dir=cache_dir)
+    barrier.wait()
+    cache.put(f'{index:02d}_worker.jpg', b'x' * 10)
+    results.put(cache.stats()['entries'])
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(cache_dir=self.cache_dir, max_bytes=250, expiry_days=7)
+
+    def test_put_and_get(self):
+        """测试分片存放、原子写入和命中统计"""
+        path = self.cache.put('ab12_result.jpg', b'data')
+        self.assertEqual(path, os.path.join(self.cache_dir, 'ab', 'ab12_result.jpg'))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['ab12_result.jpg'])
+        self.assertEqual(self.cache.get('ab12_result.jpg'), path)
+        self.assertIsNone(self.cache.get('cd34_result.jpg'))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def set_access_time(self, result_id, age):
+        with sqlite3.connect(self.cache.index.path) as connection:
+            connection.execute('UPDATE entries SET accessed = ? WHERE result_id = ?',
+                               (time.time() - age, result_id))
+
+    def test_sweep_evicts_least_recently_used(self):
+        """测试超出容量预算时按访问时间淘汰"""
+        for index, age in enumerate((300, 100, 200)):
+            result_id = f'0{index}_result.jpg'
+            self.cache.put(result_id, b'x' * 100)
+            self.set_access_time(result_id, age)
+
+        self.cache.sweep()
+        self.assertFalse(self.cache.contains('00_result.jpg'))
+        self.assertTrue(self.cache.contains('01_result.jpg'))
+        self.assertTrue(self.cache.contains('02_result.jpg'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 200)
+
+    def test_sweep_removes_expired(self):
+        """测试过期结果和旧版平铺文件被清理"""
+        # 索引建立之前已存在的旧版文件，由首次使用时的目录扫描加入索引
+        legacy_path = os.path.join(self.cache_dir, 'legacy_一寸.jpg')
+        with open(legacy_path, 'wb') as legacy_file:
+            legacy_file.write(b'x')
+        os.utime(legacy_path, (0, 0))
+        self.cache.put('aa_result.jpg', b'x')
+        self.set_access_time('aa_result.jpg', 8 * 24 * 3600)
+
+        self.cache.sweep()
+        self.assertFalse(self.cache.contains('aa_result.jpg'))
+        self.assertFalse(os.path.exists(legacy_path))
+
+    def test_background_sweeper(self):
+        """测试后台清理线程"""
+        self.cache.sweep_interval = 0.01
+        self.cache.put('bb_result.jpg', b'x' * 300)
+        self.cache.start_sweeper()
+        deadline = time.time() + 5
+        while self.cache.contains('bb_result.jpg') and time.time() < deadline:
+            time.sleep(0.01)
+        self.cache.stop_sweeper()
+        self.assertFalse(self.cache.contains('bb_result.jpg'))
+
+    def test_shared_between_workers(self):
+        """测试共用缓存目录的多个实例（多个服务进程）共享结果和统计"""
+        other = ResultCache(cache_dir=self.cache_dir, max_bytes=250, expiry_days=7)
+        path = self.cache.put('cc_result.jpg', b'data')
+        self.assertEqual(other.get('cc_result.jpg'), path)
+        self.assertIsNone(other.get('dd_result.jpg'))
+        self.cache.get('cc_result.jpg')
+        # 其他进程的计数在其定期写入后可见
+        other.index.flush()
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['bytes']), (2, 1, 1, 4))
+        self.assertEqual(other.stats(), stats)
+
+    def test_batched_hits(self):
+        """测试命中只记录在内存中，累积到批量大小时唤醒后台线程写入索引"""
+        index = self.cache.index
+        index.batch_size, index.flush_interval = 3, 3600
+        self.cache.sweep_interval = 3600
+        self.cache.put('ee_result.jpg', b'data')
+
+        def stored_hits():
+            with sqlite3.connect(index.path) as connection:
+                return connection.execute("SELECT hits FROM entries WHERE result_id = 'ee_result.jpg'").fetchone()[0]
+
+        self.cache.get('ee_result.jpg')
+        self.cache.get('ee_result.jpg')
+        self.assertFalse(index.flush_wanted.is_set())
+        self.cache.get('ee_result.jpg')
+        self.assertTrue(index.flush_wanted.is_set())
+        self.assertEqual(stored_hits(), 0)
+
+        self.cache.start_sweeper()
+        deadline = time.time() + 5
+        while stored_hits() < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(stored_hits(), 3)
+
+    def test_rebuild_missing_index(self):
+        """测试索引文件丢失后由目录扫描重建"""
+        self.cache.put('ff_result.jpg', b'x' * 10)
+        self.cache.put('ab_result.jpg', b'x' * 20)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.index'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+        self.cache.index.flush()
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes']), (2, 30))
+        self.assertTrue(os.path.exists(self.cache.index.path))
+
+    def test_concurrent_rebuild(self):
+        """测试多个进程同时重建丢失的索引：打开索引等待锁文件，各进程写入的结果都保留"""
+        for index in range(20):
+            self.cache.put(f'{index:02d}_result.jpg', b'x' * 10)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.index'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+        context = process_context()
+        workers = 3
+        barrier, results = context.Barrier(workers), context.Queue()
+        processes = [context.Process(target=open_and_put, args=(self.cache_dir, barrier, results, index))
+                     for index in range(workers)]
+        # 持有锁期间（如同另一个进程正在重建）各进程都不能打开索引
+        with file_lock(self.cache.index.path + LOCK_SUFFIX):
+            for process in processes:
+                process.start()
+            with self.assertRaises(queue.Empty):
+                results.get(timeout=1)
+            self.assertFalse(os.path.exists(self.cache.index.path))
+        counts = [results.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join()
+        self.assertTrue(all(20 < count <= 20 + workers for count in counts))
+
+        other = ResultCache(cache_dir=self.cache_dir)
+        self.assertEqual(other.stats()['entries'], 20 + workers)
+        with sqlite3.connect(other.index.path) as connection:
+            self.assertEqual(connection.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+
+    def test_without_file_locking(self):
+        """测试没有 fcntl 和 msvcrt 时不加跨进程锁也能打开和重建索引"""
+        self.cache.put('hh_result.jpg', b'data')
+        os.remove(self.cache.index.path)
+        with mock.patch.multiple(cache_index, fcntl=None, msvcrt=None):
+            other = ResultCache(cache_dir=self.cache_dir)
+            self.assertEqual(other.stats()['entries'], 1)
+
+    def test_deleted_file_leaves_index(self):
+        """测试被外部删除的结果文件从索引中移除"""
+        path = self.cache.put('gg_result.jpg', b'data')
+        os.remove(path)
+        self.assertIsNone(self.cache.get('gg_result.jpg'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_single_sweeper(self):
+        """测试每个清理间隔只有一个实例获得清理权"""
+        other = ResultCache(cache_dir=self.cache_dir)
+        self.assertTrue(self.cache.index.claim_sweep(60))
+        self.assertFalse(other.index.claim_sweep(60))
+        self.assertFalse(self.cache.index.claim_sweep(60))
+
+    def tearDown(self):
+        self.cache.stop_sweeper()
+        shutil.rmtree(self.cache_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from functools import partial
+from unittest import mock
+from aiohttp import FormData
+from aiohttp.test_utils import AioHTTPTestCase
+from PIL import Image
+from server import create_app
+from batch import BatchManager
+from result_cache import ResultCache
+from config import PHOTO_SIZES
+
+
+class TestServer(AioHTTPTestCase):
+    def setUp(self):
+        # 应用启动时创建的处理器和批处理管理使用临时目录，不改动仓库中的 cache/ 和 batches/
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        for patch in (mock.patch('image_processor.ResultCache',
+                                 partial(ResultCache, cache_dir=os.path.join(work_dir, 'cache'))),
+                      mock.patch('server.BatchManager',
+                                 partial(BatchManager, batch_dir=os.path.join(work_dir, 'batches')))):
+            patch.start()
+            self.addCleanup(patch.stop)
+        super().setUp()
+
+    async def get_application(self):
+        return await create_app()
+
+    def encode_image(self, image_size=(800, 600)):
+        upload = io.BytesIO()
+        Image.new('RGB', image_size, color='white').save(upload, format='JPEG')
+        return upload.getvalue()
+
+    def create_form(self, image_size=(800, 600), filename='test.jpg', **fields):
+        """创建上传用的 multipart 表单"""
+        form = FormData()
+        form.add_field('image', self.encode_image(image_size), filename=filename, content_type='image/jpeg')
+        for name, value in fields.items():
+            for item in (value if isinstance(value, list) else [value]):
+                form.add_field(name, item)
+        return form
+
+    async def test_sizes(self):
+        """测试尺寸列表与 Flask 接口一致"""
+        response = await self.client.get('/api/sizes')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(set(await response.json()), set(PHOTO_SIZES))
+
+    async def test_process_and_fetch_result(self):
+        """测试处理后通过结果 URL 获取图片，并支持 ETag 304"""
+        response = await self.client.post('/api/process', data=self.create_form(size='一寸'))
+        self.assertEqual(response.status, 200)
+        data = await response.json()
+        self.assertEqual(data['size'], '一寸')
+
+        result = await self.client.get(data['url'])
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.content_type, 'image/jpeg')
+        self.assertIn('immutable', result.headers['Cache-Control'])
+        self.assertEqual(Image.open(io.BytesIO(await result.read())).size, PHOTO_SIZES['一寸'])
+
+        # 通过 sendfile 发送时 ETag 仍为结果 ID
+        result_id = data['url'].rsplit('/', 1)[1]
+        self.assertEqual(result.headers['ETag'], f'"{result_id}"')
+
+        not_modified = await self.client.get(data['url'], headers={'If-None-Match': result.headers['ETag']})
+        self.assertEqual(not_modified.status, 304)
+        self.assertIn('immutable', not_modified.headers['Cache-Control'])
+
+    async def test_unknown_result(self):
+        """测试无效或不存在的结果 ID 返回 404，即使 ETag 匹配"""
+        for result_id in ['bad', f"{'0' * 32}_{'0' * 16}.jpg"]:
+            response = await self.client.get(f'/api/result/{result_id}')
+            self.assertEqual(response.status, 404)
+            response = await self.client.get(f'/api/result/{result_id}', headers={'If-None-Match': f'"{result_id}"'})
+            self.assertEqual(response.status, 404)
+
+    async def test_custom_size_and_process_all(self):
+        """测试自定义尺寸与多尺寸处理"""
+        response = await self.client.post('/api/custom-size', data=self.create_form(width='200', height='300'))
+        self.assertEqual(response.status, 200)
+        self.assertEqual((await response.json())['size'], 'custom_200x300')
+
+        response = await self.client.post('/api/process-all', data=self.create_form(sizes=['一寸', '200x300']))
+        sizes = [item['size'] for item in (await response.json())['images']]
+        self.assertEqual(sizes, ['一寸', 'custom_200x300'])
+
+    async def test_invalid_uploads(self):
+        """测试无效的上传和参数返回 400，超过大小限制时不读取完整请求体"""
+        response = await self.client.post('/api/process', data={'size': '一寸'})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(await response.json(), {'error': '没有上传图片'})
+
+        response = await self.client.post('/api/process', data=self.create_form(filename='test.txt', size='一寸'))
+        self.assertEqual(response.status, 400)
+
+        response = await self.client.post('/api/custom-size', data=self.create_form(width='x', height='1'))
+        self.assertEqual(response.status, 400)
+
+        form = FormData()
+        form.add_field('image', b'not an image' * 1000, filename='test.jpg')
+        form.add_field('size', '一寸')
+        response = await self.client.post('/api/process', data=form)
+        self.assertEqual(await response.json(), {'error': '无效的图片文件'})
+
+        # 1 位 PNG 只有几十 KB，但像素数超过 MAX_IMAGE_PIXELS，在解码之前拒绝
+        bomb = io.BytesIO()
+        Image.new('1', (10000, 10000)).save(bomb, format='PNG')
+        form = FormData()
+        form.add_field('image', bomb.getvalue(), filename='bomb.png')
+        form.add_field('size', '一寸')
+        with mock.patch.object(self.app['processor'], 'decode_image') as decode_image:
+            response = await self.client.post('/api/process', data=form)
+            decode_image.assert_not_called()
+        self.assertEqual(response.status, 400)
+
+    async def test_batch_job(self):
+        """测试通过 ZIP 提交批处理并以流式 ZIP 下载结果"""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('a.jpg', self.encode_image())
+            zf.writestr('b.png', b'not an image')
+        form = FormData()
+        form.add_field('archive', archive.getvalue(), filename='photos.zip')
+        form.add_field('sizes', '二寸')
+        response = await self.client.post('/api/batch', data=form)
+        self.assertEqual(response.status, 202)
+        job = await response.json()
+
+        download = await self.client.get(job['download_url'])
+        self.assertEqual(download.content_type, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(await download.read())) as result:
+            self.assertIn('a_二寸.jpg', result.namelist())
+        status = await (await self.client.get(job['status_url'])).json()
+        self.assertEqual((status['total'], status['done'], status['failed']), (2, 1, 1))
+
+    async def test_overloaded(self):
+        """测试排队已满返回 503 和 Retry-After"""
+        with mock.patch.object(self.app['admission'], 'max_inflight', 0):
+            response = await self.client.post('/api/process', data=self.create_form(size='一寸'))
+        self.assertEqual(response.status, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    async def test_output_options(self):
+        """测试输出选项：max_bytes 结果返回字节数和质量，目标过小返回 400"""
+        response = await self.client.post('/api/process', data=self.create_form(
+            size='一寸', format='webp', max_bytes='20000'))
+        self.assertEqual(response.status, 200)
+        data = await response.json()
+        self.assertLessEqual(data['bytes'], 20000)
+        self.assertIsInstance(data['quality'], int)
+        result = await self.client.get(data['url'])
+        self.assertEqual(result.content_type, 'image/webp')
+
+        response = await self.client.post('/api/process', data=self.create_form(size='一寸', max_bytes='100'))
+        self.assertEqual(response.status, 400)
+
+    async def test_sheet(self):
+        """测试冲印排版：上传生成，引用源图片时不需要上传"""
+        response = await self.client.post('/api/sheet', data=self.create_form(sizes='一寸'))
+        self.assertEqual(response.status, 200)
+        data = await response.json()
+        self.assertEqual(data['items'][0]['size'], '一寸')
+        self.assertGreater(data['items'][0]['copies'], 1)
+        result = await self.client.get(data['url'])
+        self.assertEqual(result.status, 200)
+
+        response = await self.client.post('/api/sheet', data={'source': data['source'], 'sizes': '一寸'})
+        self.assertEqual((await response.json())['id'], data['id'])
+        response = await self.client.post('/api/sheet', data={'source': '0' * 32, 'sizes': '一寸'})
+        self.assertEqual(response.status, 404)
+        response = await self.client.post('/api/sheet', data={'sizes': '一寸'})
+        self.assertEqual(response.status, 400)
+
+    async def test_metrics(self):
+        """测试 /metrics 输出 Prometheus 文本格式"""
+        response = await self.client.get('/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('photo_inflight_requests 0', await response.text())
+
+
+    async def test_cache_stats_off_event_loop(self):
+        """测试查询共享索引的统计接口在线程池中读取缓存统计，不阻塞事件循环"""
+        cache = self.app['processor'].cache
+        threads = []
+
+        def stats():
+            threads.append(threading.current_thread())
+            return ResultCache.stats(cache)
+
+        with mock.patch.object(cache, 'stats', stats):
+            for path in ('/api/cache/stats', '/api/stats', '/metrics'):
+                response = await self.client.get(path)
+                self.assertEqual(response.status, 200)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
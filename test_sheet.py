@@ -0,0 +1,140 @@
+import unittest
+import io
+import shutil
+import tempfile
+from dataclasses import fields, replace
+from unittest import mock
+from PIL import Image
+from engine import InlineEngine
+from image_processor import ImageProcessor
+from ingest import ingest_stream
+from memory_cache import MemoryCache
+from result_cache import ResultCache
+from sheet import SheetSpec, compose_sheet, encode_sheet, parse_sheet, plan_sheet
+from config import SHEET_GUIDE_COLOR
+
+class TestSheet(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.processor = ImageProcessor(ResultCache(cache_dir=self.cache_dir), InlineEngine())
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def create_upload(self, size=(1200, 1600)):
+        image = Image.new('RGB', size, color=(30, 120, 200))
+        buffered = io.BytesIO()
+        image.save(buffered, format='JPEG')
+        buffered.seek(0)
+        return ingest_stream(buffered)
+
+    def test_plan_sheet(self):
+        """测试网格选择放下更多照片的方向、照片互不重叠且不超出页边距"""
+        layout = plan_sheet((1200, 1800), [((295, 413), None)], margin=35, gap=24)
+        self.assertEqual(layout.canvas_size, (1200, 1800))
+        self.assertEqual(len(layout.placements), 12)
+        for _, (x, y) in layout.placements:
+            self.assertGreaterEqual(min(x, y), 35)
+            self.assertLessEqual(x + 295, 1200 - 35)
+            self.assertLessEqual(y + 413, 1800 - 35)
+        positions = {position for _, position in layout.placements}
+        self.assertEqual(len(positions), 12)
+
+        # 横向照片在横放的相纸上放得更多
+        layout = plan_sheet((1200, 1800), [((600, 400), None)], margin=0, gap=0)
+        self.assertEqual(layout.canvas_size, (1800, 1200))
+        self.assertEqual(len(layout.placements), 9)
+
+        with self.assertRaises(ValueError):
+            plan_sheet((1200, 1800), [((295, 413), 40)], margin=35, gap=24)
+        with self.assertRaises(ValueError):
+            plan_sheet((1200, 1800), [((2000, 2000), None)], margin=0, gap=0)
+
+    def test_mixed_sheet(self):
+        """测试混合尺寸：指定份数的尺寸排入指定份数，未指定的排满剩余空间"""
+        sheet = SheetSpec.create('6寸', ['一寸', '二寸'], [4])
+        copies = dict(sheet.placed_copies())
+        self.assertEqual(copies['一寸'], 4)
+        self.assertGreaterEqual(copies['二寸'], 2)
+
+        # 未指定份数的尺寸各至少排一行
+        copies = dict(SheetSpec.create('6寸', ['一寸', '二寸']).placed_copies())
+        self.assertTrue(all(copies.values()))
+
+        with self.assertRaises(ValueError):
+            SheetSpec.create('8寸', ['一寸'])
+        with self.assertRaises(ValueError):
+            SheetSpec.create('6寸', ['一寸'], [0])
+
+    def test_cache_key_and_dpi(self):
+        """测试缓存键区分相纸、份数和分辨率，分辨率不同时照片按比例生成"""
+        base = SheetSpec.create('6寸', ['一寸'])
+        self.assertEqual(base.cache_key, SheetSpec.create('6寸', ['一寸']).cache_key)
+        self.assertNotEqual(base.cache_key, SheetSpec.create('6寸', ['一寸'], [8]).cache_key)
+        self.assertNotEqual(base.cache_key, SheetSpec.create('5寸', ['一寸']).cache_key)
+        self.assertEqual(base.tile_specs[0].cache_key, base.items[0][0].cache_key)
+
+        high = SheetSpec.create('6寸', ['一寸'], dpi=600)
+        self.assertEqual(high.items[0][0].size, (590, 826))
+        self.assertEqual(high.items[0][0].size_name, '一寸')
+        self.assertEqual(high.canvas_size, (2400, 3600))
+
+    def test_compose_sheet(self):
+        """测试照片粘贴到版面位置，裁切线画在照片外侧"""
+        sheet = SheetSpec.create('6寸', ['一寸'], [2])
+        spec = sheet.items[0][0]
+        tile = Image.new('RGB', spec.size, (200, 30, 30))
+        layout = sheet.layout()
+        canvas = compose_sheet(sheet, {spec: tile}, layout)
+        self.assertEqual(canvas.size, layout.canvas_size)
+        for _, (x, y) in layout.placements:
+            self.assertEqual(canvas.getpixel((x, y)), (200, 30, 30))
+            self.assertEqual(canvas.getpixel((x + spec.size[0] - 1, y + spec.size[1] - 1)), (200, 30, 30))
+            self.assertEqual(canvas.getpixel((x - 1, y + 10)), SHEET_GUIDE_COLOR)
+        self.assertEqual(canvas.getpixel((0, 0)), (255, 255, 255))
+
+    def test_encode_sheet(self):
+        """测试排版结果按排版参数的质量编码并写入 DPI；排版参数没有 max_bytes"""
+        self.assertNotIn('max_bytes', {field.name for field in fields(SheetSpec)})
+        sheet = SheetSpec.create('6寸', ['一寸'])
+        image = Image.effect_noise(sheet.canvas_size, 40).convert('RGB')
+        data = encode_sheet(image, sheet)
+        with Image.open(io.BytesIO(data)) as encoded:
+            self.assertEqual(tuple(round(value) for value in encoded.info['dpi']), (sheet.dpi, sheet.dpi))
+        self.assertLess(len(encode_sheet(image, replace(sheet, quality=50))), len(data))
+
+    def test_process_sheet(self):
+        """测试排版复用已处理的结果：源图片只解码一次，重复冲印直接命中缓存"""
+        upload = self.create_upload()
+        sheet = SheetSpec.create('6寸', ['一寸', '二寸'], [4, 2])
+        with mock.patch.object(self.processor, 'decode_image', wraps=self.processor.decode_image) as decode:
+            result_id = self.processor.process_sheet(upload.open(), upload.file_hash, sheet)
+            self.assertEqual(decode.call_count, 1)
+            self.assertEqual(self.processor.process_sheet(None, upload.file_hash, sheet), result_id)
+            # 单张结果已在缓存中，另一种排版不再处理源图片
+            other = SheetSpec.create('5寸', ['一寸'])
+            self.processor.intermediates = MemoryCache(0)
+            self.processor.process_sheet(None, upload.file_hash, other)
+            self.assertEqual(decode.call_count, 1)
+
+        with Image.open(self.processor.get_result_path(result_id)) as image:
+            self.assertEqual(image.size, (1200, 1800))
+            self.assertEqual(tuple(round(value) for value in image.info['dpi']), (300, 300))
+        self.assertEqual(self.processor.result_info(result_id, sheet)['quality'], sheet.quality)
+
+        # 没有上传且结果和中间结果都不可用
+        with self.assertRaises(KeyError):
+            self.processor.process_sheet(None, upload.file_hash, SheetSpec.create('6寸', ['护照']))
+
+    def test_parse_sheet(self):
+        """测试表单解析：copies 为空时排满，guides 可关闭"""
+        sheet = parse_sheet({'paper': '6寸', 'guides': 'off'}, ['一寸', '200x300'], ['', '3'])
+        self.assertFalse(sheet.guides)
+        self.assertEqual([count for _, count in sheet.items], [None, 3])
+        self.assertEqual(sheet.items[1][0].size, (200, 300))
+        for sizes, copies in (([], []), (['bad'], []), (['一寸'], ['x'])):
+            with self.assertRaises(ValueError):
+                parse_sheet({}, sizes, copies)
+
+if __name__ == '__main__':
+    unittest.main()
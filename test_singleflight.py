@@ -0,0 +1,45 @@
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from singleflight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    def test_concurrent_calls_are_coalesced(self):
+        """测试相同键的并发调用只执行一次并共享结果"""
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def compute():
+            executions.append(1)
+            started.set()
+            release.wait(5)
+            return object()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.flights.do, 'key', compute)
+            started.wait(5)
+            followers = [executor.submit(self.flights.do, 'key', compute) for _ in range(3)]
+            # 等待所有调用进入等待状态后再放行
+            while self.flights.stats()['calls'] < 4:
+                pass
+            release.set()
+            results = [leader.result()] + [future.result() for future in followers]
+
+        self.assertEqual(len(executions), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        stats = self.flights.stats()
+        self.assertEqual((stats['executions'], stats['coalesced'], stats['inflight']), (1, 3, 0))
+
+    def test_errors_are_shared_and_not_cached(self):
+        """测试异常传递给所有等待者，且之后的调用会重新执行"""
+        with self.assertRaises(ValueError):
+            self.flights.do('key', int, 'bad')
+        self.assertEqual(self.flights.do('key', int, '5'), 5)
+        self.assertEqual(self.flights.stats()['executions'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+from functools import lru_cache
+from config import TONE_LUT_CACHE_SIZE
+
+# RGB 转灰度的权重（与 Pillow 的 L 模式转换一致，定点 16 位）
+_LUMA_WEIGHTS = (19595, 38470, 7471)
+
+
+def _blend(base, value, factor):
+    """与 Image.blend 相同的 8 位混合：截断取整并限制在 0~255"""
+    result = base + factor * (value - base)
+    if result <= 0:
+        return 0
+    if result >= 255:
+        return 255
+    return int(result)
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def build_tone_lut(brightness=1.0, contrast=1.0, mean=128):
+    """生成亮度、对比度合成后的 256 项查找表
+
+    亮度等价于与黑色图混合，对比度等价于与灰度均值 mean 的纯色图混合，
+    两次混合各自截断取整，结果与 ImageEnhance 依次处理一致。
+    """
+    lut = []
+    for value in range(256):
+        if brightness != 1.0:
+            value = _blend(0, value, brightness)
+        if contrast != 1.0:
+            value = _blend(mean, value, contrast)
+        lut.append(value)
+    return tuple(lut)
+
+
+def estimate_luma_mean(image, brightness=1.0):
+    """根据直方图估算亮度调整后的灰度均值（四舍五入），不生成中间图像"""
+    histogram = image.histogram()
+    bands = image.getbands()
+    brightness_lut = build_tone_lut(brightness)
+    pixel_count = image.width * image.height
+
+    means = []
+    for index in range(len(bands)):
+        band_histogram = histogram[index * 256:(index + 1) * 256]
+        total = sum(brightness_lut[value] * count for value, count in enumerate(band_histogram))
+        means.append(total / pixel_count)
+
+    if bands[:3] == ('R', 'G', 'B'):
+        mean = sum(weight * band_mean for weight, band_mean in zip(_LUMA_WEIGHTS, means)) / 65536
+    else:
+        mean = means[0]
+    return int(mean + 0.5)
+
+
+def apply_tone(image, brightness=1.0, contrast=1.0):
+    """用一次 Image.point 完成亮度和对比度调整"""
+    if brightness == 1.0 and contrast == 1.0:
+        return image
+
+    mean = estimate_luma_mean(image, brightness) if contrast != 1.0 else 128
+    lut = build_tone_lut(brightness, contrast, mean)
+    # 透明通道与 ImageEnhance 一致：只受亮度影响
+    alpha_lut = build_tone_lut(brightness)
+    table = []
+    for band in image.getbands():
+        table.extend(alpha_lut if band == 'A' else lut)
+    return image.point(table)